@@ -1,6 +1,6 @@
 # Register your models here.
 from django.contrib import admin
-from .models import Category, Tag, Ad, ExchangeProposal
+from .models import Category, Tag, Ad, ExchangeProposal, WebhookDelivery, WebhookEndpoint
 
 
 @admin.register(Category)
@@ -33,3 +33,16 @@ class ExchangeProposalAdmin(admin.ModelAdmin):
         "ad_receiver__title",
         "comment",
     )
+
+
+@admin.register(WebhookEndpoint)
+class WebhookEndpointAdmin(admin.ModelAdmin):
+    list_display = ("id", "url", "event_types", "max_concurrency", "is_active")
+    list_filter = ("is_active",)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("id", "event", "endpoint", "status", "attempts", "next_attempt_at")
+    list_filter = ("status", "endpoint")
+    raw_id_fields = ("event",)
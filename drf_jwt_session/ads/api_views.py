@@ -1,18 +1,32 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, generics, permissions
 
-from .models import ExchangeProposal, Ad, Category, Post
-from .serializers import ProposalCreateSerializer, ProposalStatusUpdateSerializer, AdSerializer, CategorySerializer, PostSerializer
+from .models import ExchangeProposal, Ad, Category, Post, Tag, TradeCycle, UserProposalStats
+from .serializers import ProposalBulkStatusSerializer, ProposalCreateSerializer, ProposalSerializer, ProposalStatusUpdateSerializer, AdSerializer, AdListSerializer, AdMatchSerializer, AdExportSerializer, CategorySerializer, PostSerializer, TagSerializer, TradeCycleSerializer, UserProposalStatsSerializer
 
 from rest_framework import viewsets
 
 from rest_framework.permissions import IsAuthenticated
 
 from .permissions import IsOwnerOrReadOnly
-
-from rest_framework.filters import SearchFilter, OrderingFilter
-
-from rest_framework.parsers import MultiPartParser, FormParser
+from .pagination import CreatedAtCursorPagination
+from .reference import reference_data
+from .cache import CachedAdResponseMixin
+from .budgets import QueryBudget, extend_query_budget
+from .bulk import bulk_create_ads, bulk_delete_ads, bulk_update_ads
+from .export import EXPORT_RENDERERS, stream_ads
+from .facets import facet_counts
+from .filters import AdFilter
+from .matches import matches_for, parse_matches_limit
+from .search import AdFullTextSearchFilter
+from .suggest import did_you_mean, parse_suggest_params, suggest_ads, suggest_tags
+from .transitions import ProposalConflict, change_status
+
+from rest_framework.filters import OrderingFilter
+
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.exceptions import NotFound, ValidationError
+from django.conf import settings
 
 
 from rest_framework.decorators import action
@@ -25,29 +39,65 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from rest_framework.permissions import IsAuthenticated
 
 
 
 
-class AdViewSet(viewsets.ModelViewSet):
-    queryset = Ad.objects.select_related('user', 'category').prefetch_related('tags').order_by('-created_at')
+class AdViewSet(CachedAdResponseMixin, viewsets.ModelViewSet):
+    queryset = Ad.objects.select_related('user', 'category').prefetch_related('tags').defer('search_vector').order_by('-created_at')
     serializer_class = AdSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
     parser_classes = [MultiPartParser, FormParser]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['category', 'condition', 'user__username']
+    pagination_class = CreatedAtCursorPagination
+    filter_backends = [DjangoFilterBackend, AdFullTextSearchFilter, OrderingFilter]
+    filterset_class = AdFilter  # category, condition, user__username, tags (+tags_mode)
     search_fields = ['title', 'description']
     ordering_fields = ['created_at', 'title']
+    # +1 запрос на пользователя, если в JWT нет claims (ads/authentication.py)
+    query_budgets = {
+        'list': QueryBudget(queries=2),  # ?facets=1 доплачивает в get_paginated_response
+        'retrieve': QueryBudget(queries=3),
+        'recent': QueryBudget(queries=3),
+        'suggest': QueryBudget(queries=3),
+        'matches': QueryBudget(queries=3),  # готовый список; пустой — ещё проверка, что объявление есть
+    }
+    # отдельный лимит на запись (ads/throttling.py), чтение — только общий 'user'
+    throttle_scopes = {
+        action: 'ads_write'
+        for action in (
+            'create', 'update', 'partial_update', 'destroy', 'mark_as_sold',
+            'bulk_create', 'bulk_update', 'bulk_destroy',
+        )
+    }
 
 
     # РАЗЛИЧНЫЕ СЕРИАЛЗАТОРЫ ДЛЯ РАЗНЫХ МЕТОДОВ
-    # def get_serializer_class(self):
-    #     if self.action == 'list':
-    #         return AdListSerializer
-    #     elif self.action == 'retrieve':
-    #         return AdDetailSerializer
-    #     return AdSerializer
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return AdListSerializer
+        if self.action == 'export':
+            return AdExportSerializer
+        return AdSerializer
+
+    def get_queryset(self):
+        if self.action == 'list':
+            # один запрос: длина описания и теги агрегируются в SQL
+            return Ad.objects.for_list().order_by('-created_at')
+        if self.action == 'export':
+            return Ad.objects.for_export().order_by('-created_at', '-id')
+        return super().get_queryset()
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.action == 'list' and self.request.query_params.get('facets') in ('1', 'true'):
+            # те же фильтры, но без JOIN-ов и агрегатов for_list();
+            # попадает в кеш ответа вместе со страницей (ключ учитывает facets=1)
+            response.data['facets'] = facet_counts(self.filter_queryset(Ad.objects.all()))
+            # ещё один агрегат и повторная проверка ?category= фильтром
+            extend_query_budget(self.request, queries=2)
+        return response
 
     # переопределяем queryset
     # def get_queryset(self):
@@ -124,12 +174,143 @@ class AdViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(recent_ads, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk', parser_classes=[JSONParser])
+    def bulk_create(self, request):
+        """
+        Пакетное создание: тело — JSON-массив объявлений (без картинок).
+        Вызывается POST /ads/bulk/. Ответ — результат по каждому элементу.
+        """
+        items = self._bulk_payload(request)
+        results = bulk_create_ads(items, request.user, self.get_serializer_context())
+        return self._bulk_response(results, status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        """PATCH /ads/bulk/ — массив частичных обновлений, у каждого есть id."""
+        items = self._bulk_payload(request)
+        results = bulk_update_ads(items, request.user, self.get_serializer_context())
+        return self._bulk_response(results, status.HTTP_200_OK)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        """DELETE /ads/bulk/ — массив id своих объявлений."""
+        ids = self._bulk_payload(request)
+        return self._bulk_response(bulk_delete_ads(ids, request.user), status.HTTP_200_OK)
+
+    def _bulk_payload(self, request):
+        max_items = getattr(settings, 'ADS_BULK_MAX_ITEMS', 1000)
+        if not isinstance(request.data, list) or not request.data:
+            raise ValidationError('Ожидался непустой JSON-массив.')
+        if len(request.data) > max_items:
+            raise ValidationError(f'Не больше {max_items} элементов за запрос.')
+        return request.data
+
+    def _bulk_response(self, results, success_status):
+        failed = sum(1 for result in results if result['status'] == 'error')
+        if not failed:
+            response_status = success_status
+        elif failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response(
+            {'succeeded': len(results) - failed, 'failed': failed, 'results': results},
+            status=response_status,
+        )
+
+    @action(detail=False, methods=['get'], renderer_classes=EXPORT_RENDERERS)
+    def export(self, request):
+        """
+        Выгрузка всех объявлений потоком, без пагинации.
+        Вызывается GET /ads/export/?format=ndjson (по умолчанию) или ?format=json,
+        фильтры, поиск и ordering — те же, что у списка.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        return stream_ads(queryset, self.get_serializer(), request.accepted_renderer.format)
+
+    @action(detail=True, methods=['get'])
+    def matches(self, request, pk=None):
+        """
+        Кандидаты на обмен: чужие объявления, похожие по тегам и категории.
+        Вызывается GET /ads/{pk}/matches/?limit=10, список посчитан заранее (ads/matches.py).
+        """
+        try:
+            ad_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        matches = matches_for(ad_id, parse_matches_limit(request.query_params))
+        if not matches and not Ad.objects.filter(pk=ad_id).exists():
+            raise NotFound()
+        serializer = AdMatchSerializer(matches, many=True, context=self.get_serializer_context())
+        return Response({'results': serializer.data})
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Автодополнение заголовков по триграммам.
+        Вызывается GET /ads/suggest/?q=айфо&limit=10
+        """
+        text, limit = parse_suggest_params(request.query_params)
+        if text is None:
+            return Response({'results': [], 'did_you_mean': None})
+        return Response({
+            'results': suggest_ads(text, limit),
+            'did_you_mean': did_you_mean(text),
+        })
+
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
+    # пользователь (JWT без claims) + перечитать снимок справочников
+    query_budgets = {'list': QueryBudget(queries=3)}
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список из снимка справочников (ads/reference.py), при общем кеше — без запроса к БД.
+        ETag меняется только вместе с данными — клиент переспрашивает
+        с If-None-Match и получает 304.
+        """
+        if set(request.query_params) - {'page'}:
+            return super().list(request, *args, **kwargs)  # сортировка/поиск — через БД
+        snapshot = reference_data()
+        etag = f'"categories-{snapshot.digests[Category]}-{request.query_params.get("page", "1")}"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        categories = snapshot.ordered(Category)
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = Response(self.get_serializer(categories, many=True).data)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Tag.objects.order_by('name')
+    serializer_class = TagSerializer
+    permission_classes = [IsAuthenticated]
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Автодополнение тегов по триграммам.
+        Вызывается GET /tags/suggest/?q=телеф
+        """
+        text, limit = parse_suggest_params(request.query_params)
+        if text is None:
+            return Response({'results': [], 'did_you_mean': None})
+        results = suggest_tags(text, limit)
+        # лучший тег уже в выдаче — исправление нужно, только если он не продолжение запроса
+        correction = None
+        if results and not results[0]['name'].lower().startswith(text.lower()):
+            correction = did_you_mean(text)
+        return Response({'results': results, 'did_you_mean': correction})
 
 
 
@@ -140,17 +321,40 @@ class ProposalCreateView(generics.CreateAPIView):
     queryset = ExchangeProposal.objects.all()
     serializer_class = ProposalCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = "proposals_create"
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # такое предложение уже ожидает ответа — 200 с ним, а не второй экземпляр
+        response_status = status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK
+        return Response(serializer.data, status=response_status)
 
     def perform_create(self, serializer):
         serializer.save()
 
 
+def proposals_with_ads():
+    # обе стороны обмена одним JOIN'ом; тяжёлые колонки объявлений не читаем
+    return ExchangeProposal.objects.select_related(
+        "ad_sender__user", "ad_receiver__user"
+    ).defer(
+        "ad_sender__description",
+        "ad_sender__search_vector",
+        "ad_receiver__description",
+        "ad_receiver__search_vector",
+    )
+
+
 class ProposalsToMeListView(generics.ListAPIView):
-    serializer_class = ProposalCreateSerializer
+    serializer_class = ProposalSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    query_budget = QueryBudget(queries=2)
 
     def get_queryset(self):
-        return ExchangeProposal.objects.filter(ad_receiver__user=self.request.user)
+        return proposals_with_ads().filter(ad_receiver__user=self.request.user)
 
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ["ad_sender", "status"]
@@ -159,11 +363,13 @@ class ProposalsToMeListView(generics.ListAPIView):
 
 
 class ProposalsFromMeListView(generics.ListAPIView):
-    serializer_class = ProposalCreateSerializer
+    serializer_class = ProposalSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    query_budget = QueryBudget(queries=2)
 
     def get_queryset(self):
-        return ExchangeProposal.objects.filter(ad_sender__user=self.request.user)
+        return proposals_with_ads().filter(ad_sender__user=self.request.user)
 
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ["ad_receiver", "status"]
@@ -171,19 +377,95 @@ class ProposalsFromMeListView(generics.ListAPIView):
     ordering = ["-created_at"]
 
 
+class ProposalSummaryView(generics.RetrieveAPIView):
+    """
+    Сводка по своим предложениям: GET /proposals/summary/.
+    Счётчики готовые (ads/counters.py) — одна строка по первичному ключу.
+    """
+    serializer_class = UserProposalStatsSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = QueryBudget(queries=2)
+    # бейдж «новые предложения»: с разных реплик с разным отставанием число
+    # прыгало бы туда-обратно, а чтение одной строки primary не нагружает
+    use_replica = False
+
+    def get_object(self):
+        stats = UserProposalStats.objects.filter(user_id=self.request.user.pk).first()
+        # строки нет — предложений ещё не было
+        return stats or UserProposalStats(user_id=self.request.user.pk)
+
+
+class TradeCycleListView(generics.ListAPIView):
+    """
+    Обмены по кругу с участием пользователя: GET /proposals/cycles/.
+    Циклы ищет manage.py find_trade_cycles (ads/cycles.py), здесь только чтение.
+    """
+    serializer_class = TradeCycleSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    # страница циклов + предложения всей страницы одним запросом
+    query_budget = QueryBudget(queries=3)
+
+    def get_queryset(self):
+        return TradeCycle.objects.filter(user_ids__contains=[self.request.user.pk])
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        ids = {pk for cycle in page for pk in cycle.proposal_ids}
+        context = {**self.get_serializer_context(), "proposals": proposals_with_ads().in_bulk(ids)}
+        serializer = self.get_serializer_class()(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+
 class ProposalStatusUpdateView(generics.UpdateAPIView):
-    queryset = ExchangeProposal.objects.all()
+    queryset = ExchangeProposal.objects.select_related("ad_receiver").defer(
+        "ad_receiver__description", "ad_receiver__search_vector"
+    )
     serializer_class = ProposalStatusUpdateSerializer
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ["patch"]
 
     def get_object(self):
         obj = super().get_object()
-        if obj.ad_receiver.user != self.request.user:
+        if obj.ad_receiver.user_id != self.request.user.id:
             from rest_framework.exceptions import PermissionDenied
 
             raise PermissionDenied("Вы не можете изменить статус этого предложения.")
         return obj
+
+    def perform_update(self, serializer):
+        # условный UPDATE вместо save() всей строки (ads/transitions.py)
+        proposal = serializer.instance
+        changed = change_status(self.request.user, [proposal.pk], serializer.validated_data["status"])
+        if not any(p.pk == proposal.pk for p in changed):
+            raise ProposalConflict()
+        proposal.status = serializer.validated_data["status"]
+
+
+class ProposalBulkStatusView(generics.GenericAPIView):
+    """
+    Принять или отклонить несколько входящих предложений: POST /proposals/bulk-status/
+    {"ids": [...], "status": "accepted" | "rejected"}. При принятии остальные ожидающие
+    предложения по тем же объявлениям отклоняются в той же транзакции.
+    """
+    serializer_class = ProposalBulkStatusSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        changed = {p.pk: p.status for p in change_status(request.user, ids, serializer.validated_data["status"])}
+        results = [
+            {"id": pk, "status": changed[pk]} if pk in changed else {"id": pk, "status": "conflict"}
+            for pk in ids
+        ]
+        requested = set(ids)
+        return Response({
+            "results": results,
+            # конкуренты принятых — не из запроса
+            "auto_rejected": sorted(pk for pk in changed if pk not in requested),
+        })
     
 
 
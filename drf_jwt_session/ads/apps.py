@@ -8,3 +8,8 @@ class AdsConfig(AppConfig):
     
     def ready(self):
         import ads.signals  # noqa
+        from ads.routers import check_replica_settings
+        from ads.throttling import check_throttle_settings
+
+        check_replica_settings()
+        check_throttle_settings()
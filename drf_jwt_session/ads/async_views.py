@@ -0,0 +1,207 @@
+"""
+Async-версии читающих API-эндпоинтов для ASGI (uvicorn src.asgi:application):
+
+    GET /async/ads/                 — как GET /ads/
+    GET /async/ads/recent/          — как GET /ads/recent/
+    GET /async/ads/{id}/            — как GET /ads/{id}/
+    GET /async/proposals/to-me/     — как GET /proposals/to-me/
+    GET /async/proposals/from-me/   — как GET /proposals/from-me/
+
+APIView в DRF синхронный, поэтому здесь обычные async-views Django:
+JWT-аутентификация через aget, IsAuthenticated, те же throttling, фильтры,
+пагинация и сериализаторы, что у синхронных двойников. Пока запрос ждёт
+Postgres, воркер обслуживает другие соединения.
+
+Кеша ответов (ads/cache.py) тут нет — это путь «как есть до БД».
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .api_views import AdViewSet, ProposalsFromMeListView, ProposalsToMeListView, proposals_with_ads
+from .authentication import USER_CLAIMS, ClaimsJWTAuthentication
+from .budgets import QueryBudget
+from .models import Ad
+from .serializers import AdListSerializer, AdSerializer, ProposalSerializer
+
+
+class AsyncJWTAuthentication(ClaimsJWTAuthentication):
+    """ClaimsJWTAuthentication, где пользователь (если claims нет) читается через async ORM."""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        # подпись и срок действия проверяются без БД
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if not api_settings.CHECK_REVOKE_TOKEN and all(claim in validated_token for claim in USER_CLAIMS):
+            return self.get_user(validated_token)  # из claims, без БД
+        # те же проверки, что в JWTAuthentication.get_user
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(
+                user.password
+            ):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+        return user
+
+
+class AsyncAPIView(View):
+    """
+    Минимальный async-аналог APIView только для чтения: JWT + IsAuthenticated,
+    throttling, filter_backends, пагинация и JSON-ответ в формате DRF.
+    """
+
+    http_method_names = ["get", "options"]
+    use_replica = False  # см. ads/routers.py
+    authentication = AsyncJWTAuthentication()
+    throttle_classes = drf_settings.DEFAULT_THROTTLE_CLASSES
+    filter_backends = ()
+    pagination_class = None
+    renderer = JSONRenderer()
+
+    async def dispatch(self, request, *args, **kwargs):
+        # DRF Request — ради query_params для фильтров и пагинации
+        request = Request(request)
+        self.request = request
+        try:
+            await self.authenticate(request)
+            await self.check_throttles(request)
+            response = await super().dispatch(request, *args, **kwargs)
+        except Http404 as exc:
+            response = self.handle_exception(exceptions.NotFound(*exc.args))
+        except exceptions.APIException as exc:
+            response = self.handle_exception(exc)
+        return response
+
+    async def authenticate(self, request):
+        result = await self.authentication.aauthenticate(request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+        request.user, request.auth = result
+
+    async def check_throttles(self, request):
+        # троттлы DRF ходят в кеш синхронно
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                raise exceptions.Throttled(throttle.wait())
+
+    def handle_exception(self, exc):
+        response = self.render(
+            exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail},
+            status=exc.status_code,
+        )
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response["WWW-Authenticate"] = self.authentication.authenticate_header(self.request)
+        if getattr(exc, "wait", None):
+            response["Retry-After"] = str(int(exc.wait))
+        return response
+
+    def render(self, data, status=200):
+        return HttpResponse(
+            self.renderer.render(data), status=status, content_type=self.renderer.media_type
+        )
+
+    def get_serializer_context(self):
+        return {"request": self.request, "view": self}
+
+    def filter_queryset(self, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(self.request, queryset, self)
+        return queryset
+
+    async def alist(self, queryset, serializer_class):
+        # django-filter валидирует ModelChoiceFilter запросом к БД — в поток
+        queryset = await sync_to_async(self.filter_queryset)(queryset)
+        paginator = self.pagination_class()
+        # штатный paginate_queryset из DRF в потоке: курсоры те же, что у sync-двойника
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, self.request, view=self)
+        data = serializer_class(page, many=True, context=self.get_serializer_context()).data
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+class AsyncAdListView(AsyncAPIView):
+    filter_backends = AdViewSet.filter_backends
+    filterset_class = AdViewSet.filterset_class
+    search_fields = AdViewSet.search_fields
+    ordering_fields = AdViewSet.ordering_fields
+    pagination_class = AdViewSet.pagination_class
+    query_budget = AdViewSet.query_budgets["list"]
+
+    async def get(self, request):
+        return await self.alist(Ad.objects.for_list().order_by("-created_at"), AdListSerializer)
+
+
+class AsyncAdRecentView(AsyncAPIView):
+    query_budget = AdViewSet.query_budgets["recent"]
+
+    async def get(self, request):
+        ads = [ad async for ad in AdViewSet.queryset[:5].aiterator()]
+        return self.render(
+            AdSerializer(ads, many=True, context=self.get_serializer_context()).data
+        )
+
+
+class AsyncAdDetailView(AsyncAPIView):
+    query_budget = AdViewSet.query_budgets["retrieve"]
+
+    async def get(self, request, pk):
+        ad = await aget_object_or_404(AdViewSet.queryset, pk=pk)
+        return self.render(AdSerializer(ad, context=self.get_serializer_context()).data)
+
+
+class AsyncProposalsToMeView(AsyncAPIView):
+    filter_backends = ProposalsToMeListView.filter_backends
+    filterset_fields = ProposalsToMeListView.filterset_fields
+    ordering_fields = ProposalsToMeListView.ordering_fields
+    ordering = ProposalsToMeListView.ordering
+    pagination_class = ProposalsToMeListView.pagination_class
+    query_budget = QueryBudget(queries=2)
+
+    async def get(self, request):
+        queryset = proposals_with_ads().filter(ad_receiver__user=request.user)
+        return await self.alist(queryset, ProposalSerializer)
+
+
+class AsyncProposalsFromMeView(AsyncAPIView):
+    filter_backends = ProposalsFromMeListView.filter_backends
+    filterset_fields = ProposalsFromMeListView.filterset_fields
+    ordering_fields = ProposalsFromMeListView.ordering_fields
+    ordering = ProposalsFromMeListView.ordering
+    pagination_class = ProposalsFromMeListView.pagination_class
+    query_budget = QueryBudget(queries=2)
+
+    async def get(self, request):
+        queryset = proposals_with_ads().filter(ad_sender__user=request.user)
+        return await self.alist(queryset, ProposalSerializer)
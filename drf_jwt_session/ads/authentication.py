@@ -0,0 +1,163 @@
+"""
+JWT-аутентификация без похода в БД на каждый запрос.
+
+Стандартный JWTAuthentication на каждый запрос заново проверяет подпись
+и читает пользователя по первичному ключу. Здесь:
+
+- в токен при выдаче и обновлении кладутся claims username, is_staff,
+  is_active (ClaimsTokenObtainPairSerializer, ClaimsTokenRefreshSerializer);
+- пользователь собирается из claims как User с отложенными (deferred)
+  остальными полями: request.user.pk, username, is_staff, сравнение с
+  obj.user и filter(user=request.user) работают без запросов, а первое
+  обращение к, например, email догрузит поле из БД;
+- проверенные токены держатся в ограниченном LRU (JWT_VERIFIED_TOKEN_CACHE_SIZE),
+  повторный запрос с тем же токеном не считает HMAC — только срок действия.
+
+Claims могут отставать от БД до конца жизни access-токена (ACCESS_TOKEN_LIFETIME):
+снятый is_staff или заблокированный пользователь вступят в силу при
+следующем обновлении токена. Токены без claims (выданные раньше)
+обрабатываются по-старому, с чтением пользователя.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .token_blacklist import FastBlacklistRefreshToken
+
+USER_CLAIMS = ("username", "is_staff", "is_active")
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Новый access-токен получает claims из БД, а не копию из refresh.
+
+    validate() — тот же порядок, что у TokenRefreshSerializer из simplejwt 5.5
+    (версия закреплена в requirements.txt), но пользователь читается один раз:
+    базовый validate() его загружает и не отдаёт, и claims пришлось бы брать
+    вторым запросом, заново разбирая выданный access-токен.
+    """
+
+    token_class = FastBlacklistRefreshToken  # blacklist без запроса (ads/token_blacklist.py)
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        data = {"access": str(add_user_claims(refresh.access_token, user))}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            add_user_claims(refresh, user)  # до outstand(): в OutstandingToken — итоговый токен
+            refresh.outstand()
+            data["refresh"] = str(refresh)
+
+        return data
+
+
+class VerifiedTokenCache:
+    """LRU «сырой токен -> проверенный токен», общий для потоков процесса."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, raw_token):
+        with self._lock:
+            token = self._tokens.get(raw_token)
+            if token is not None:
+                self._tokens.move_to_end(raw_token)
+            return token
+
+    def put(self, raw_token, token):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._tokens[raw_token] = token
+            self._tokens.move_to_end(raw_token)
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+verified_tokens = VerifiedTokenCache(getattr(settings, "JWT_VERIFIED_TOKEN_CACHE_SIZE", 1024))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        token = verified_tokens.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            verified_tokens.put(raw_token, token)
+            return token
+        # подпись уже проверена, а срок действия — нет
+        try:
+            token.check_exp(current_time=aware_utcnow())
+        except TokenError as exc:
+            raise InvalidToken({"detail": exc.args[0], "messages": []})
+        return token
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or not all(
+            claim in validated_token for claim in USER_CLAIMS
+        ):
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return claims_user(user_id, validated_token)
+
+
+def claims_user(user_id, validated_token):
+    """User из claims; остальные поля deferred и читаются из БД при обращении."""
+    user_model = get_user_model()
+    known = {api_settings.USER_ID_FIELD: user_id}
+    known.update((claim, validated_token[claim]) for claim in USER_CLAIMS)
+    # from_db ждёт значения в порядке полей модели
+    field_names = [f.attname for f in user_model._meta.concrete_fields if f.attname in known]
+    values = [known[name] for name in field_names]
+    return user_model.from_db(router.db_for_read(user_model), field_names, values)
+
+
+class ClaimsJWTScheme(SimpleJWTScheme):
+    # в схеме OpenAPI — тот же jwtAuth, что у обычного JWTAuthentication
+    target_class = ClaimsJWTAuthentication
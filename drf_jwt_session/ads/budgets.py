@@ -0,0 +1,168 @@
+"""
+Бюджеты запросов к БД для эндпоинтов.
+
+Бюджет объявляется рядом с view:
+
+    @query_budget(queries=6)
+    def index(request): ...
+
+    class ProposalsToMeListView(generics.ListAPIView):
+        query_budget = QueryBudget(queries=3)
+
+    class AdViewSet(viewsets.ModelViewSet):
+        query_budgets = {"list": QueryBudget(queries=3), ...}
+
+QueryBudgetMiddleware считает запросы и время БД на каждый запрос и при
+превышении пишет в лог или бросает QueryBudgetExceeded (QUERY_BUDGET_MODE).
+В бюджет входит всё, что произошло за запрос, включая сессию и аутентификацию.
+Дорогой, но явно запрошенный параметр (?facets=1) доплачивает к бюджету
+из самого view: extend_query_budget(request, queries=2).
+"""
+
+from django.urls import NoReverseMatch, URLPattern, URLResolver, get_resolver, reverse
+
+DEFAULT_DB_TIME_MS = 200
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget:
+    def __init__(self, queries, db_time_ms=DEFAULT_DB_TIME_MS):
+        self.queries = queries
+        self.db_time_ms = db_time_ms
+
+    def violations(self, queries, db_time_ms):
+        problems = []
+        if queries > self.queries:
+            problems.append(f"{queries} запросов при бюджете {self.queries}")
+        if self.db_time_ms is not None and db_time_ms > self.db_time_ms:
+            problems.append(f"{db_time_ms:.1f} мс в БД при бюджете {self.db_time_ms} мс")
+        return problems
+
+    def __repr__(self):
+        return f"QueryBudget(queries={self.queries}, db_time_ms={self.db_time_ms})"
+
+
+# для маршрутов без своего бюджета в assert_query_budgets: только число запросов
+DEFAULT_ROUTE_BUDGET = QueryBudget(queries=10, db_time_ms=None)
+
+
+def query_budget(queries, db_time_ms=DEFAULT_DB_TIME_MS):
+    """Декоратор для function-based views."""
+
+    def decorator(view_func):
+        view_func.query_budget = QueryBudget(queries, db_time_ms)
+        return view_func
+
+    return decorator
+
+
+def extend_query_budget(request, queries):
+    """Добавить запросов к бюджету текущего запроса (если middleware его считает)."""
+    request = getattr(request, "_request", request)  # DRF Request -> HttpRequest
+    budget = getattr(request, "_query_budget", None)
+    if budget is not None:
+        request._query_budget = QueryBudget(budget.queries + queries, budget.db_time_ms)
+
+
+def get_view_budget(view_func, method):
+    """
+    Бюджет для resolved view. DRF-виджеты из as_view() хранят класс в .cls,
+    а viewset'ы ещё и соответствие методов action'ам в .actions.
+    """
+    budget = getattr(view_func, "query_budget", None)
+    if budget is not None:
+        return budget
+
+    view_cls = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+    if view_cls is None:
+        return None
+
+    actions = getattr(view_func, "actions", None)
+    if actions:
+        action = actions.get(method.lower())
+        budget = getattr(view_cls, "query_budgets", {}).get(action)
+        if budget is not None:
+            return budget
+    return getattr(view_cls, "query_budget", None)
+
+
+def _iter_patterns(patterns, namespace=None):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            ns = pattern.namespace
+            if ns and namespace:
+                ns = f"{namespace}:{ns}"
+            yield from _iter_patterns(pattern.url_patterns, ns or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            name = f"{namespace}:{pattern.name}" if namespace else pattern.name
+            yield name, pattern.callback
+
+
+def _allows_get(callback):
+    actions = getattr(callback, "actions", None)
+    if actions:
+        return "get" in actions
+    view_cls = getattr(callback, "cls", None) or getattr(callback, "view_class", None)
+    if view_cls is not None:
+        return hasattr(view_cls, "get") and "get" in view_cls.http_method_names
+    return True  # function-based view
+
+
+def iter_routes(url_kwargs=None, exclude_namespaces=("admin",)):
+    """
+    Все именованные GET-маршруты: (name, url, budget). budget None — бюджет
+    не объявлен, url None — для маршрута не хватило url_kwargs ({"pk": ad.pk}).
+    Админка Django по умолчанию не входит.
+    """
+    url_kwargs = url_kwargs or {}
+    seen = set()
+    for name, callback in _iter_patterns(get_resolver().url_patterns):
+        if name in seen or name.split(":")[0] in exclude_namespaces or not _allows_get(callback):
+            continue
+        seen.add(name)
+        try:
+            url = reverse(name)
+        except NoReverseMatch:
+            try:
+                url = reverse(name, kwargs=url_kwargs)
+            except NoReverseMatch:
+                url = None
+        yield name, url, get_view_budget(callback, "GET")
+
+
+class RouteBudgetReport:
+    def __init__(self):
+        self.checked = []  # URL
+        self.unbudgeted = []  # имена маршрутов без своего бюджета (проверены по умолчанию)
+        self.skipped = []  # имена маршрутов, для которых не хватило url_kwargs
+
+
+def assert_query_budgets(client, url_kwargs=None, default_budget=DEFAULT_ROUTE_BUDGET):
+    """
+    Тестовый помощник: прогоняет GET по всем маршрутам (iter_routes).
+    Маршрут с бюджетом проверяет middleware в режиме raise, без бюджета —
+    сверяется здесь с default_budget: новый эндпоинт с N+1 не проскочит.
+    Превышение — QueryBudgetExceeded. Возвращает RouteBudgetReport.
+    """
+    from django.test import override_settings
+
+    report = RouteBudgetReport()
+    with override_settings(QUERY_BUDGET_MODE="raise"):
+        for name, url, budget in iter_routes(url_kwargs):
+            if url is None:
+                report.skipped.append(name)
+                continue
+            response = client.get(url)
+            assert response.status_code < 500, f"{url}: {response.status_code}"
+            if budget is None:
+                report.unbudgeted.append(name)
+                problems = default_budget.violations(
+                    int(response["X-DB-Queries"]), float(response["X-DB-Time-ms"])
+                )
+                if problems:
+                    raise QueryBudgetExceeded(f"GET {url} ({name}, бюджет по умолчанию): {'; '.join(problems)}")
+            report.checked.append(url)
+    return report
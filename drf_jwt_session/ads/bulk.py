@@ -0,0 +1,285 @@
+"""
+Пакетное создание, обновление и удаление объявлений (POST/PATCH/DELETE /ads/bulk/).
+
+Пакет валидируется целиком: категории, теги и занятые заголовки загружаются
+одним запросом на пакет. Запись идёт чанками — одна транзакция на чанк,
+bulk_create/bulk_update для объявлений и один INSERT в таблицу Ad.tags.
+Ошибка одного элемента не мешает остальным: ответ — результат по каждому.
+bulk_create/bulk_update не шлют сигналы, поэтому события в outbox
+(ads/outbox.py) пишутся здесь же, в транзакции чанка.
+"""
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+from .cache import invalidate_ads
+from .matches import schedule_refresh
+from .models import Ad, Category, Tag
+from .outbox import ad_payload, record_events
+from .reference import write_reference_data
+from .serializers import AdSerializer
+
+DUPLICATE_TITLE_ERROR = "У вас уже есть объявление с таким заголовком."
+FREED_LATER_TITLE_ERROR = "Заголовок освобождается позже в этом пакете — отправьте это изменение отдельно."
+TEMPORARY_TITLE_PREFIX = "bulk-rename-"
+
+
+def _chunk_size():
+    return getattr(settings, "ADS_BULK_CHUNK_SIZE", 200)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _int_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass  # некорректный id отловит поле сериализатора
+    return ids
+
+
+def preload_reference_data(items):
+    """Категории и теги пакета: из снимка справочников (если ему можно верить), промахи — из БД."""
+    items = [item for item in items if isinstance(item, dict)]
+    category_ids = _int_ids(item.get("category") for item in items)
+    tag_ids = _int_ids(
+        tag_id
+        for item in items
+        if isinstance(item.get("tag_ids"), list)
+        for tag_id in item["tag_ids"]
+    )
+    snapshot = write_reference_data()
+    preloaded = {}
+    for model, ids in ((Category, category_ids), (Tag, tag_ids)):
+        known = snapshot.objects[model] if snapshot is not None else {}
+        objects = {pk: known[pk] for pk in ids if pk in known}
+        # чего нет в снимке (создано только что в другом процессе) — дочитываем
+        missing = ids - objects.keys()
+        if missing:
+            objects.update(model.objects.in_bulk(missing))
+        preloaded[model] = objects
+    return preloaded
+
+
+def _error(index, errors):
+    return {"index": index, "status": "error", "errors": errors}
+
+
+def _split_valid(items, results, serializer_factory):
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = _error(index, {"non_field_errors": ["Ожидался объект."]})
+            continue
+        serializer = serializer_factory(index, item)
+        if serializer is None:
+            continue
+        if serializer.is_valid():
+            valid.append((index, serializer))
+        else:
+            results[index] = _error(index, serializer.errors)
+    return valid
+
+
+def _reject_duplicate_titles(valid, results, taken_titles):
+    # UniqueConstraint(user, title) проверяем заранее: иначе IntegrityError
+    # откатит весь чанк вместе с корректными элементами
+    accepted = []
+    for index, serializer in valid:
+        title = serializer.validated_data.get("title")
+        if title is not None and title in taken_titles:
+            results[index] = _error(index, {"title": [DUPLICATE_TITLE_ERROR]})
+            continue
+        if title is not None:
+            taken_titles.add(title)
+        accepted.append((index, serializer))
+    return accepted
+
+
+def _renames(serializer):
+    return serializer.validated_data.get("title", serializer.instance.title) != serializer.instance.title
+
+
+def _plan_renames(valid, results, user):
+    """
+    Чанки для bulk_update_ads без конфликтов UniqueConstraint(user, title).
+
+    Проверяется только смена заголовка: свой заголовок не конфликтует, а занят
+    заголовок любого объявления, кроме тех, что в пакете его меняют, — но
+    освободиться он должен в том же или более раннем чанке (чанк — своя
+    транзакция). Отклонённое переименование оставляет объявлению старый
+    заголовок, поэтому проверка повторяется, пока отказы не перестанут
+    добавляться.
+    """
+    chunks = list(_chunks(valid, _chunk_size()))
+    chunk_of = {index: number for number, chunk in enumerate(chunks) for index, _ in chunk}
+    renamed = [(index, serializer) for index, serializer in valid if _renames(serializer)]
+    holders = dict(
+        Ad.objects.filter(user=user, title__in=[serializer.validated_data["title"] for _, serializer in renamed])
+        .order_by()
+        .values_list("title", "pk")
+    )
+    renamed_by_pk = {serializer.instance.pk: index for index, serializer in renamed}
+    rejected = {}
+    while True:
+        claimed, errors = set(), {}
+        for index, serializer in renamed:
+            if index in rejected:
+                continue
+            title = serializer.validated_data["title"]
+            holder = renamed_by_pk.get(holders.get(title))
+            if title in claimed or (title in holders and (holder is None or holder in rejected)):
+                errors[index] = DUPLICATE_TITLE_ERROR
+            elif holder is not None and chunk_of[holder] > chunk_of[index]:
+                errors[index] = FREED_LATER_TITLE_ERROR
+            else:
+                claimed.add(title)
+        if not errors:
+            break
+        rejected.update(errors)
+    for index, message in rejected.items():
+        results[index] = _error(index, {"title": [message]})
+    chunks = [[item for item in chunk if item[0] not in rejected] for chunk in chunks]
+    return [chunk for chunk in chunks if chunk]
+
+
+def _write_tags(ads_with_tags):
+    through = Ad.tags.through
+    through.objects.bulk_create(
+        [through(ad_id=ad.pk, tag_id=tag.pk) for ad, tags in ads_with_tags for tag in tags],
+        ignore_conflicts=True,
+    )
+
+
+def bulk_create_ads(items, user, context):
+    results = [None] * len(items)
+    context = {**context, "preloaded": preload_reference_data(items)}
+
+    valid = _split_valid(
+        items, results, lambda index, item: AdSerializer(data=item, context=context)
+    )
+    titles = [serializer.validated_data["title"] for _, serializer in valid]
+    taken = set(
+        Ad.objects.filter(user=user, title__in=titles).order_by().values_list("title", flat=True)
+    )
+    valid = _reject_duplicate_titles(valid, results, taken)
+
+    for chunk in _chunks(valid, _chunk_size()):
+        ads, tags = [], []
+        for _, serializer in chunk:
+            data = dict(serializer.validated_data)
+            tags.append(data.pop("tag_ids", []))
+            ads.append(Ad(user=user, **data))
+        try:
+            with transaction.atomic():
+                Ad.objects.bulk_create(ads)
+                _write_tags(zip(ads, tags))
+                # bulk_create не шлёт post_save/m2m_changed — outbox и кеш сами
+                record_events("ad.created", [ad_payload(ad) for ad in ads])
+                invalidate_ads([ad.pk for ad in ads])
+                schedule_refresh(ad.pk for ad, ad_tags in zip(ads, tags) if ad_tags)
+        except DatabaseError as exc:
+            for index, _ in chunk:
+                results[index] = _error(index, {"non_field_errors": [str(exc)]})
+            continue
+        for (index, _), ad in zip(chunk, ads):
+            results[index] = {"index": index, "status": "created", "id": ad.pk}
+    return results
+
+
+def bulk_update_ads(items, user, context):
+    results = [None] * len(items)
+    context = {**context, "preloaded": preload_reference_data(items)}
+    ids = _int_ids(item.get("id") for item in items if isinstance(item, dict))
+    instances = Ad.objects.filter(user=user).defer("search_vector").in_bulk(ids)
+
+    def make_serializer(index, item):
+        try:
+            instance = instances.get(int(item.get("id")))
+        except (TypeError, ValueError):
+            instance = None
+        if instance is None:
+            results[index] = _error(index, {"id": ["Объявление не найдено."]})
+            return None
+        return AdSerializer(instance, data=item, partial=True, context=context)
+
+    valid = _split_valid(items, results, make_serializer)
+
+    for chunk in _plan_renames(valid, results, user):
+        ads, fields, retagged, rematched = [], set(), [], []
+        new_titles = {serializer.validated_data.get("title") for _, serializer in chunk}
+        # заголовок, который в этом же чанке переходит к другому объявлению (обмен A <-> B)
+        freed = [
+            serializer.instance.pk
+            for _, serializer in chunk
+            if _renames(serializer) and serializer.instance.title in new_titles
+        ]
+        for _, serializer in chunk:
+            ad = serializer.instance
+            data = dict(serializer.validated_data)
+            if "tag_ids" in data or "category" in data:
+                rematched.append(ad.pk)
+            if "tag_ids" in data:
+                retagged.append((ad, data.pop("tag_ids")))
+            for attr, value in data.items():
+                setattr(ad, attr, value)
+            fields.update(data)
+            ads.append(ad)
+        try:
+            with transaction.atomic():
+                if freed:
+                    # уникальность (user, title) проверяется на каждой строке UPDATE,
+                    # поэтому сначала освобождаем заголовки временными
+                    Ad.objects.filter(pk__in=freed).update(
+                        title=Concat(Value(TEMPORARY_TITLE_PREFIX), Cast("pk", CharField()))
+                    )
+                if fields:
+                    Ad.objects.bulk_update(ads, sorted(fields))
+                if retagged:
+                    Ad.tags.through.objects.filter(ad_id__in=[ad.pk for ad, _ in retagged]).delete()
+                    _write_tags(retagged)
+                record_events("ad.updated", [ad_payload(ad) for ad in ads])
+                invalidate_ads([ad.pk for ad in ads])
+                if rematched:
+                    schedule_refresh(rematched)
+        except DatabaseError as exc:
+            for index, _ in chunk:
+                results[index] = _error(index, {"non_field_errors": [str(exc)]})
+            continue
+        for (index, _), ad in zip(chunk, ads):
+            results[index] = {"index": index, "status": "updated", "id": ad.pk}
+    return results
+
+
+def bulk_delete_ads(ids, user):
+    results = [None] * len(ids)
+    valid = []
+    for index, value in enumerate(ids):
+        try:
+            valid.append((index, int(value)))
+        except (TypeError, ValueError):
+            results[index] = _error(index, {"id": ["Ожидался целочисленный id."]})
+
+    for chunk in _chunks(valid, _chunk_size()):
+        queryset = Ad.objects.filter(user=user, pk__in=[pk for _, pk in chunk])
+        try:
+            with transaction.atomic():
+                found = set(queryset.values_list("pk", flat=True))
+                queryset.delete()  # post_delete сам инвалидирует кеш
+        except DatabaseError as exc:
+            for index, _ in chunk:
+                results[index] = _error(index, {"non_field_errors": [str(exc)]})
+            continue
+        for index, pk in chunk:
+            if pk in found:
+                results[index] = {"index": index, "status": "deleted", "id": pk}
+            else:
+                results[index] = _error(index, {"id": ["Объявление не найдено."]})
+    return results
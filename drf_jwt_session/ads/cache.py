@@ -0,0 +1,117 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+# Поколения (generations): вместо удаления ключей по маске увеличиваем
+# номер поколения — старые записи просто перестают читаться и умирают по TTL.
+LIST_GENERATION_KEY = "ads:gen:list"
+REFERENCE_GENERATION_KEY = "ads:gen:ref"  # категории/теги — влияют на все ответы
+DETAIL_GENERATION_KEY = "ads:gen:detail:{pk}"
+
+
+def is_shared_cache(alias="default"):
+    """Видят ли записи в кеше другие воркеры (Redis и т.п., а не память процесса)."""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def _cache_timeout():
+    return getattr(settings, "ADS_RESPONSE_CACHE_TIMEOUT", 300)
+
+
+def _get_generations(*keys):
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # случайное начальное значение: после вытеснения ключа
+            # не должны ожить записи старого поколения
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _request_digest(request):
+    # в ответе абсолютные URL (картинки, next/previous) — хост входит в ключ
+    params = sorted(
+        (name, value) for name, values in request.query_params.lists() for value in values
+    )
+    raw = f"{request.get_host()}?{urlencode(params)}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def list_cache_key(request):
+    ref_gen, list_gen = _get_generations(REFERENCE_GENERATION_KEY, LIST_GENERATION_KEY)
+    return f"ads:list:{ref_gen}:{list_gen}:{_request_digest(request)}"
+
+
+def detail_cache_key(request, pk):
+    ref_gen, detail_gen = _get_generations(
+        REFERENCE_GENERATION_KEY, DETAIL_GENERATION_KEY.format(pk=pk)
+    )
+    return f"ads:detail:{pk}:{ref_gen}:{detail_gen}:{_request_digest(request)}"
+
+
+def invalidate_ad(pk):
+    """Объявление изменилось: его детальная запись и все списки устарели."""
+
+    def bump():
+        _bump(DETAIL_GENERATION_KEY.format(pk=pk))
+        _bump(LIST_GENERATION_KEY)
+
+    # после коммита — иначе параллельный запрос успеет закешировать старые данные
+    transaction.on_commit(bump)
+
+
+def invalidate_ads(pks):
+    pks = list(pks)
+
+    def bump():
+        for pk in pks:
+            _bump(DETAIL_GENERATION_KEY.format(pk=pk))
+        _bump(LIST_GENERATION_KEY)
+
+    transaction.on_commit(bump)
+
+
+def invalidate_reference_data():
+    """Переименовали категорию или тег — устарели все ответы."""
+    transaction.on_commit(lambda: _bump(REFERENCE_GENERATION_KEY))
+
+
+class CachedAdResponseMixin:
+    """
+    Кеш ответов list/retrieve для AdViewSet. Ключ — нормализованные
+    query-параметры + поколение; инвалидация в ads/signals.py.
+    Проверки аутентификации и прав выполняются до обращения к кешу.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(list_cache_key(request), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        key = detail_cache_key(request, kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return self._cached(key, super().retrieve, request, *args, **kwargs)
+
+    def _cached(self, key, handler, request, *args, **kwargs):
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, _cache_timeout())
+        response["X-Cache"] = "MISS"
+        return response
@@ -0,0 +1,234 @@
+"""
+Денормализованные счётчики предложений обмена.
+
+Ad: received/pending/accepted_proposals_count — входящие предложения
+объявления. UserProposalStats — то же по пользователю плюс исходящие.
+Сигналы ExchangeProposal вызывают proposal_changed в транзакции самого
+изменения; счётчики меняются UPDATE … SET x = x + 1 (F()), без чтения.
+
+Всё, что меняет предложения в обход save()/delete() (bulk_create,
+queryset.update), обязано поправить счётчики само или через reconcile_*.
+Расхождения чинит manage.py reconcile_proposal_counters.
+"""
+
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Q, Subquery
+
+from .cache import invalidate_ads
+from .models import Ad, ExchangeProposal, UserProposalStats
+
+AD_FIELDS = Ad.COUNTER_FIELDS
+USER_FIELDS = (
+    "received_count",
+    "pending_received_count",
+    "accepted_received_count",
+    "sent_count",
+    "pending_sent_count",
+)
+
+
+def _received(status, sign):
+    return {
+        "received": sign,
+        "pending": sign if status == "pending" else 0,
+        "accepted": sign if status == "accepted" else 0,
+    }
+
+
+def _diff(old_status, new_status):
+    """Изменения по статусам: old_status=None — создание, new_status=None — удаление."""
+    total = {"received": 0, "pending": 0, "accepted": 0}
+    if old_status is not None:
+        for key, value in _received(old_status, -1).items():
+            total[key] += value
+    if new_status is not None:
+        for key, value in _received(new_status, 1).items():
+            total[key] += value
+    return total
+
+
+def _increments(mapping):
+    return {field: F(field) + delta for field, delta in mapping.items() if delta}
+
+
+def _update_user(ad_id, mapping, create_missing):
+    increments = _increments(mapping)
+    if not increments:
+        return
+    owner = Subquery(Ad.objects.filter(pk=ad_id).values("user_id"))
+    updated = UserProposalStats.objects.filter(user_id=owner).update(**increments)
+    if not updated and create_missing:
+        # строки ещё нет (пользователь из bulk_create и т.п.) — считаем с нуля;
+        # наше изменение уже в таблице предложений и попадёт в подсчёт.
+        # При удалении не создаём: это может быть каскад от удаления пользователя
+        user_id = Ad.objects.filter(pk=ad_id).values_list("user_id", flat=True).first()
+        if user_id is not None:
+            reconcile_users([user_id])
+
+
+def proposal_changed(proposal, old_status, new_status):
+    proposals_changed([(proposal, old_status, new_status)])
+
+
+def proposals_changed(changes):
+    """
+    Пакет изменений [(proposal, old_status, new_status)]: разницы суммируются
+    по объявлениям, UPDATE — по одному на объявление, а не на предложение.
+    """
+    received, sent = defaultdict(Counter), defaultdict(Counter)
+    create_missing = False
+    for proposal, old_status, new_status in changes:
+        diff = _diff(old_status, new_status)
+        received[proposal.ad_receiver_id].update(diff)
+        sent[proposal.ad_sender_id].update(received=diff["received"], pending=diff["pending"])
+        create_missing = create_missing or new_status is not None
+
+    changed_ads = []
+    for ad_id, diff in received.items():
+        ad_increments = _increments(
+            {
+                "received_proposals_count": diff["received"],
+                "pending_proposals_count": diff["pending"],
+                "accepted_proposals_count": diff["accepted"],
+            }
+        )
+        if ad_increments:
+            Ad.objects.filter(pk=ad_id).update(**ad_increments)
+            changed_ads.append(ad_id)
+        _update_user(
+            ad_id,
+            {
+                "received_count": diff["received"],
+                "pending_received_count": diff["pending"],
+                "accepted_received_count": diff["accepted"],
+            },
+            create_missing,
+        )
+    for ad_id, diff in sent.items():
+        _update_user(
+            ad_id,
+            {"sent_count": diff["received"], "pending_sent_count": diff["pending"]},
+            create_missing,
+        )
+    if changed_ads:
+        invalidate_ads(changed_ads)  # счётчики есть в ответах /ads/
+
+
+def _expected_for_ads(ad_ids):
+    rows = (
+        ExchangeProposal.objects.filter(ad_receiver_id__in=ad_ids)
+        .values("ad_receiver_id")
+        .annotate(
+            received_proposals_count=Count("id"),
+            pending_proposals_count=Count("id", filter=Q(status="pending")),
+            accepted_proposals_count=Count("id", filter=Q(status="accepted")),
+        )
+        .order_by()
+    )
+    return {row.pop("ad_receiver_id"): row for row in rows}
+
+
+def _expected_for_users(user_ids):
+    expected = {user_id: dict.fromkeys(USER_FIELDS, 0) for user_id in user_ids}
+    received = (
+        ExchangeProposal.objects.filter(ad_receiver__user_id__in=user_ids)
+        .values("ad_receiver__user_id")
+        .annotate(
+            received_count=Count("id"),
+            pending_received_count=Count("id", filter=Q(status="pending")),
+            accepted_received_count=Count("id", filter=Q(status="accepted")),
+        )
+        .order_by()
+    )
+    for row in received:
+        expected[row.pop("ad_receiver__user_id")].update(row)
+    sent = (
+        ExchangeProposal.objects.filter(ad_sender__user_id__in=user_ids)
+        .values("ad_sender__user_id")
+        .annotate(sent_count=Count("id"), pending_sent_count=Count("id", filter=Q(status="pending")))
+        .order_by()
+    )
+    for row in sent:
+        expected[row.pop("ad_sender__user_id")].update(row)
+    return expected
+
+
+def reconcile_ads(ad_ids, dry_run=False):
+    """
+    Пересчитывает счётчики объявлений. Строки блокируются до подсчёта: чужие
+    F()-обновления дождутся нашего коммита и лягут поверх верных значений.
+    Возвращает число исправленных объявлений.
+    """
+    with transaction.atomic():
+        ads = list(Ad.objects.filter(pk__in=ad_ids).only("id", *AD_FIELDS).select_for_update())
+        expected = _expected_for_ads([ad.pk for ad in ads])
+        drifted = []
+        for ad in ads:
+            values = expected.get(ad.pk, dict.fromkeys(AD_FIELDS, 0))
+            if any(getattr(ad, field) != values[field] for field in AD_FIELDS):
+                for field in AD_FIELDS:
+                    setattr(ad, field, values[field])
+                drifted.append(ad)
+        if drifted and not dry_run:
+            Ad.objects.bulk_update(drifted, AD_FIELDS)
+            invalidate_ads([ad.pk for ad in drifted])
+    return len(drifted)
+
+
+def reconcile_users(user_ids, dry_run=False):
+    """То же для UserProposalStats; недостающие строки создаются."""
+    with transaction.atomic():
+        existing = {
+            stats.user_id: stats
+            for stats in UserProposalStats.objects.filter(user_id__in=user_ids).select_for_update()
+        }
+        expected = _expected_for_users(user_ids)
+        drifted, missing = [], []
+        for user_id, values in expected.items():
+            stats = existing.get(user_id)
+            if stats is None:
+                if any(values.values()):
+                    missing.append(UserProposalStats(user_id=user_id, **values))
+                continue
+            if any(getattr(stats, field) != values[field] for field in USER_FIELDS):
+                for field in USER_FIELDS:
+                    setattr(stats, field, values[field])
+                drifted.append(stats)
+        if not dry_run:
+            UserProposalStats.objects.bulk_create(missing, ignore_conflicts=True)
+            UserProposalStats.objects.bulk_update(drifted, USER_FIELDS)
+    return len(drifted) + len(missing)
+
+
+def _id_batches(queryset, batch_size):
+    batch = []
+    for pk in queryset.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reconcile_in_batches(ad_ids, user_ids, batch_size=1000, dry_run=False):
+    """Для кода, который пишет предложения через bulk_create (сидирование)."""
+    fixed_ads = sum(
+        reconcile_ads(ad_ids[i : i + batch_size], dry_run) for i in range(0, len(ad_ids), batch_size)
+    )
+    fixed_users = sum(
+        reconcile_users(user_ids[i : i + batch_size], dry_run)
+        for i in range(0, len(user_ids), batch_size)
+    )
+    return fixed_ads, fixed_users
+
+
+def reconcile_all(batch_size=1000, dry_run=False):
+    fixed_ads = sum(reconcile_ads(ids, dry_run) for ids in _id_batches(Ad.objects.all(), batch_size))
+    fixed_users = sum(
+        reconcile_users(ids, dry_run) for ids in _id_batches(User.objects.all(), batch_size)
+    )
+    return fixed_ads, fixed_users
@@ -0,0 +1,156 @@
+"""
+Обмены по кругу (A -> B -> C -> A) из ожидающих предложений для /proposals/cycles/.
+
+Граф: вершины — объявления, ребро ad_sender -> ad_receiver — ожидающее
+предложение. Цикл из 3–4 объявлений разных владельцев — обмен, где каждый
+получает то, что просил. Встречные предложения (цикл из двух) — обычный
+обмен один на один, их не ищем.
+
+Поиск — DFS с ограничением глубины от ребра u -> v: простые пути
+v -> ... -> w длиной до PROPOSAL_CYCLE_MAX_LENGTH, на каждом шаге проверка,
+есть ли ребро w -> u (поиск в словаре смежности). Последний шаг не
+разворачивается: следующие вершины сразу пересекаются с предшественниками u,
+так что перебор идёт на уровень меньше. Порядок — секунды на миллион рёбер.
+
+- полный прогон: цикл ищется только от своей наименьшей вершины, остальные
+  вершины пути больше неё — каждый цикл находится ровно один раз;
+- инкрементальный: новый цикл обязательно содержит новое ребро, поэтому
+  поиск идёт только от предложений с id больше, чем в прошлом прогоне
+  (CycleSearchRun). Предложение с меньшим id, закоммиченное позже чтения,
+  подберёт следующий полный прогон.
+
+Цикл, где предложение перестало ожидать, снимает сигнал (drop_cycles);
+прогон заодно удаляет те, что изменили в обход save().
+Граф целиком в памяти процесса: словари смежности по целым числам,
+рёбра читаются одним потоковым запросом.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import CycleSearchRun, ExchangeProposal, TradeCycle
+
+
+def _max_length():
+    return getattr(settings, "PROPOSAL_CYCLE_MAX_LENGTH", 4)
+
+
+class ProposalGraph:
+    def __init__(self):
+        self.succ = defaultdict(dict)  # ad -> {ad, которое за него просят: id предложения}
+        self.pred = defaultdict(set)  # ad -> объявления, которые предлагают за него
+        self.owners = {}
+        self.last_proposal_id = 0
+
+    def add(self, pk, sender, receiver, sender_user, receiver_user):
+        if receiver not in self.succ[sender]:  # дубли пары: ребро — первое предложение
+            self.succ[sender][receiver] = pk
+            self.pred[receiver].add(sender)
+        self.owners[sender], self.owners[receiver] = sender_user, receiver_user
+        self.last_proposal_id = max(self.last_proposal_id, pk)
+
+    @classmethod
+    def load(cls):
+        graph = cls()
+        rows = (
+            ExchangeProposal.objects.filter(status="pending")
+            .order_by("id")
+            .values_list("id", "ad_sender_id", "ad_receiver_id", "ad_sender__user_id", "ad_receiver__user_id")
+        )
+        for row in rows.iterator(chunk_size=10_000):
+            graph.add(*row)
+        return graph
+
+    def edges(self, after=None):
+        for sender, following in self.succ.items():
+            for receiver, pk in following.items():
+                if after is None or pk > after:
+                    yield sender, receiver
+
+    def cycles_through(self, sender, receiver, max_length, anchored):
+        """Циклы с ребром sender -> receiver: кортежи объявлений от sender."""
+        owners = self.owners
+        if owners[sender] == owners[receiver] or (anchored and receiver < sender):
+            return
+        closing = self.pred.get(sender, set())  # из них есть ребро обратно в sender
+        if not closing:
+            return
+        stack = [((sender, receiver), (owners[sender], owners[receiver]))]
+        while stack:
+            path, users = stack.pop()
+            following = self.succ.get(path[-1], {})
+            if len(path) >= 3 and sender in following:
+                yield path
+            if len(path) == max_length:
+                continue
+            if len(path) == max_length - 1:
+                # последний шаг — пересечение «куда можно пойти» и «откуда есть ребро в sender»
+                last_step = closing.intersection(following)
+            else:
+                last_step = None
+            for ad in following if last_step is None else last_step:
+                if ad in path or owners[ad] in users or (anchored and ad < sender):
+                    continue
+                if last_step is not None:
+                    yield path + (ad,)
+                else:
+                    stack.append((path + (ad,), users + (owners[ad],)))
+
+    def proposal_ids(self, ad_ids):
+        return [self.succ.get(a, {}).get(b) for a, b in zip(ad_ids, ad_ids[1:] + ad_ids[:1])]
+
+    def cycle(self, path):
+        start = path.index(min(path))
+        ad_ids = list(path[start:] + path[:start])
+        return TradeCycle(
+            signature="-".join(map(str, ad_ids)),
+            ad_ids=ad_ids,
+            user_ids=[self.owners[ad] for ad in ad_ids],
+            proposal_ids=self.proposal_ids(ad_ids),
+        )
+
+
+def find_cycles(full=False, max_length=None, batch_size=1000):
+    """Найти и записать циклы. Возвращает CycleSearchRun."""
+    max_length = max_length or _max_length()
+    graph = ProposalGraph.load()
+    previous = None if full else CycleSearchRun.objects.order_by("-id").first()
+    after = previous.last_proposal_id if previous else None
+
+    found = {}
+    for sender, receiver in graph.edges(after):
+        for path in graph.cycles_through(sender, receiver, max_length, anchored=after is None):
+            cycle = graph.cycle(path)
+            found.setdefault(cycle.signature, cycle)
+
+    # сохранённый цикл жив, пока все его предложения — те же ожидающие рёбра
+    stale, kept = [], set()
+    for pk, signature, ad_ids, proposal_ids in TradeCycle.objects.values_list(
+        "id", "signature", "ad_ids", "proposal_ids"
+    ).iterator():
+        if graph.proposal_ids(ad_ids) != proposal_ids or (after is None and signature not in found):
+            stale.append(pk)
+        else:
+            kept.add(signature)
+    new = [cycle for signature, cycle in found.items() if signature not in kept]
+
+    with transaction.atomic():
+        for start in range(0, len(stale), batch_size):
+            TradeCycle.objects.filter(pk__in=stale[start:start + batch_size]).delete()
+        TradeCycle.objects.bulk_create(new, batch_size=batch_size, ignore_conflicts=True)
+        return CycleSearchRun.objects.create(
+            last_proposal_id=max(graph.last_proposal_id, after or 0),
+            full=after is None,
+            found=len(new),
+            removed=len(stale),
+        )
+
+
+def drop_cycles(proposal_ids):
+    """Предложения больше не ожидают — циклы с ними неактуальны."""
+    proposal_ids = list(proposal_ids)
+    transaction.on_commit(
+        lambda: TradeCycle.objects.filter(proposal_ids__overlap=proposal_ids).delete()
+    )
@@ -0,0 +1,72 @@
+"""
+Потоковая выгрузка объявлений (GET /ads/export/?format=ndjson|json).
+
+Строки читаются из БД серверным курсором через iterator(chunk_size),
+сериализуются по одной и сразу уходят клиенту в StreamingHttpResponse —
+в памяти одновременно не больше одного чанка, сколько бы объявлений ни было.
+"""
+
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Нужен для content negotiation: ?format=ndjson и Accept: application/x-ndjson.
+    Сам поток собирает stream_ads, а этот рендерер отдаёт только ошибки.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return _dumps(data).encode() + b'\n'
+
+
+EXPORT_RENDERERS = [NDJSONRenderer, JSONRenderer]
+
+
+def _chunk_size():
+    return getattr(settings, 'ADS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def _dumps(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _iter_rows(queryset, serializer):
+    # to_representation у одного экземпляра сериализатора — без создания
+    # нового сериализатора и копирования полей на каждую строку
+    for ad in queryset.iterator(chunk_size=_chunk_size()):
+        yield _dumps(serializer.to_representation(ad))
+
+
+def _iter_ndjson(rows):
+    for row in rows:
+        yield row + '\n'
+
+
+def _iter_json_array(rows):
+    yield '['
+    for index, row in enumerate(rows):
+        yield row if index == 0 else ',' + row
+    yield ']'
+
+
+def stream_ads(queryset, serializer, export_format):
+    rows = _iter_rows(queryset, serializer)
+    if export_format == 'json':
+        content, content_type = _iter_json_array(rows), 'application/json'
+    else:
+        content, content_type = _iter_ndjson(rows), NDJSONRenderer.media_type
+    response = StreamingHttpResponse(content, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="ads.{export_format}"'
+    # иначе nginx соберёт весь ответ в буфер перед отправкой
+    response['X-Accel-Buffering'] = 'no'
+    return response
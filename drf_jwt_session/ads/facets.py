@@ -0,0 +1,74 @@
+"""
+Фасеты для GET /ads/?facets=1: сколько объявлений текущей выборки
+(те же фильтры и поиск) в каждой категории, состоянии и с каждым тегом.
+
+Один SQL-запрос — UNION ALL трёх GROUP BY по одной и той же выборке:
+
+    SELECT 'category', category_id, COUNT(*) FROM ads_ad WHERE id IN (выборка) GROUP BY 2
+    UNION ALL SELECT 'condition', condition, COUNT(*) ...
+    UNION ALL SELECT 'tag', tag_id, COUNT(*) FROM ads_ad_tags WHERE ad_id IN (выборка) GROUP BY 2
+
+Индекс ads_ad_facets (category, condition) позволяет считать первые две
+части index-only scan'ом; теги — по индексам ads_ad_tags (ad_id, tag_id).
+Названия категорий и тегов берутся из снимка справочников (ads/reference.py).
+"""
+
+from django.db.models import CharField, Count, Value
+from django.db.models.functions import Cast
+
+from .models import Ad, Category, Tag
+from .reference import reference_data
+
+
+def _grouped(queryset, facet, field):
+    return (
+        queryset.order_by()
+        .values(key=Cast(field, CharField()))
+        .annotate(facet=Value(facet, CharField()), count=Count("*"))
+        .values_list("facet", "key", "count")
+    )
+
+
+def facet_counts(queryset):
+    ids = queryset.order_by().values("pk")
+    base = Ad.objects.filter(pk__in=ids)
+    links = Ad.tags.through.objects.filter(ad_id__in=ids)
+    rows = _grouped(base, "category", "category_id").union(
+        _grouped(base, "condition", "condition"),
+        _grouped(links, "tag", "tag_id"),
+        all=True,
+    )
+
+    counts = {"category": {}, "condition": {}, "tag": {}}
+    for facet, key, count in rows:
+        counts[facet][key] = count
+
+    snapshot = reference_data()
+    categories, tags = snapshot.objects[Category], snapshot.objects[Tag]
+    conditions = dict(Ad.CONDITION_CHOICES)
+
+    def ordered(items):
+        return sorted(items, key=lambda item: (-item["count"], str(item.get("id") or item.get("value"))))
+
+    return {
+        "category": ordered(
+            {
+                "id": int(key) if key is not None else None,
+                "title": categories[int(key)].title if key is not None and int(key) in categories else None,
+                "count": count,
+            }
+            for key, count in counts["category"].items()
+        ),
+        "condition": ordered(
+            {"value": key, "label": conditions.get(key, key), "count": count}
+            for key, count in counts["condition"].items()
+        ),
+        "tags": ordered(
+            {
+                "id": int(key),
+                "name": tags[int(key)].name if int(key) in tags else None,
+                "count": count,
+            }
+            for key, count in counts["tag"].items()
+        ),
+    }
@@ -0,0 +1,55 @@
+import django_filters
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Lower
+
+from .models import Ad, Tag
+from .reference import reference_data
+
+TAGS_MODE_CHOICES = [("any", "любой из тегов"), ("all", "все теги")]
+
+
+def tag_ids_by_name(names):
+    """id тегов по именам (без учёта регистра) из снимка справочников; промахи — из БД."""
+    by_name = {tag.name.lower(): pk for pk, tag in reference_data().objects[Tag].items()}
+    ids = {name: by_name[name] for name in names if name in by_name}
+    missing = [name for name in names if name not in ids]
+    if missing:
+        found = Tag.objects.annotate(lower_name=Lower("name")).filter(lower_name__in=missing)
+        for pk, name in found.values_list("id", "lower_name"):
+            ids[name] = pk
+    return ids
+
+
+class AdFilter(django_filters.FilterSet):
+    """
+    Фильтры списка объявлений. ?tags=книги,фантастика — по именам тегов,
+    ?tags_mode=any (по умолчанию) — хотя бы один, all — все сразу.
+    Теги проверяются через EXISTS по ads_ad_tags, а не JOIN: без дублей строк
+    и без влияния на агрегат тегов в for_list().
+    """
+
+    tags = django_filters.CharFilter(method="filter_tags")
+    tags_mode = django_filters.ChoiceFilter(choices=TAGS_MODE_CHOICES, method="filter_tags_mode")
+
+    class Meta:
+        model = Ad
+        fields = ["category", "condition", "user__username"]
+
+    def filter_tags(self, queryset, name, value):
+        names = list(dict.fromkeys(part.strip().lower() for part in value.split(",") if part.strip()))
+        if not names:
+            return queryset
+        ids = tag_ids_by_name(names)
+        links = Ad.tags.through.objects.filter(ad_id=OuterRef("pk"))
+        if self.form.cleaned_data.get("tags_mode") == "all":
+            if len(ids) < len(names):
+                return queryset.none()  # такого тега нет — ни одно объявление не подходит
+            for tag_id in ids.values():
+                queryset = queryset.filter(Exists(links.filter(tag_id=tag_id)))
+            return queryset
+        if not ids:
+            return queryset.none()
+        return queryset.filter(Exists(links.filter(tag_id__in=ids.values())))
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset  # учитывается в filter_tags
@@ -0,0 +1,266 @@
+"""
+Превью и адаптивные варианты картинок объявлений.
+
+После загрузки Ad.image (post_save, после коммита) задача уходит в пул
+потоков, а не выполняется в запросе: картинка поворачивается по EXIF,
+метаданные (EXIF, GPS) вырезаются и из оригинала, и из вариантов, затем
+она ужимается до IMAGE_SIZES и сохраняется в WebP и AVIF (если Pillow
+собран с libavif). Результат пишется в Ad.image_variants:
+
+    {"source": "ads_images/photo.jpg",
+     "variants": [{"name": "ads_images/variants/photo_jpg/thumb.webp",
+                   "format": "webp", "width": 320, "height": 240}, ...]}
+
+Сериализаторы отдают из него srcset по форматам (build_srcset).
+
+Оригинал без EXIF сохраняется под новым хеш-именем, и объявление
+переходит на него; ссылка на исходный файл снимается.
+
+Один файл может принадлежать нескольким объявлениям (ads/storage.py),
+поэтому и файл, и его варианты удаляются, когда release_image снимает
+последнюю ссылку.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from PIL import Image, ImageOps, features
+
+from .cache import invalidate_ad
+from .models import Ad, StoredImage
+
+logger = logging.getLogger(__name__)
+
+# вписываем в квадрат, пропорции сохраняются
+IMAGE_SIZES = {"thumb": 320, "medium": 800}
+VARIANTS_DIR = "ads_images/variants"
+SAVE_OPTIONS = {
+    "webp": {"quality": 80, "method": 4},
+    "avif": {"quality": 60},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def image_formats():
+    # AVIF первым: в <picture> браузер берёт первый поддерживаемый <source>
+    return [fmt for fmt in ("avif", "webp") if features.check(fmt)]
+
+
+def needs_processing(ad):
+    if ad.image:
+        return ad.image_variants.get("source") != ad.image.name
+    return bool(ad.image_variants)  # картинку убрали — варианты надо удалить
+
+
+def _variant_prefix(source):
+    # ads_images/3f/a2/3fa2….jpg -> ads_images/variants/3f/a2/3fa2…_jpg
+    directory, filename = os.path.split(source)
+    shard = directory.split("/", 1)[1] if "/" in directory else ""
+    return "/".join(filter(None, [VARIANTS_DIR, shard, filename.replace(".", "_")]))
+
+
+def _open(field_file):
+    with field_file.open("rb") as file:
+        image = Image.open(file)
+        original_format = image.format
+        has_metadata = bool(image.getexif()) or "icc_profile" in image.info
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    return image, original_format, has_metadata
+
+
+def _strip_original(field_file, image, original_format):
+    """
+    Копия оригинала без EXIF под своим хеш-именем (+1 ссылка, ads/storage.py).
+    Переписать на месте нельзя: имя перестало бы совпадать с содержимым.
+    """
+    buffer = BytesIO()
+    options = {"quality": 95} if original_format == "JPEG" else {}
+    image.save(buffer, original_format, **options)
+    # имя как у загрузки (upload_to + файл): каталоги по хешу storage добавит сам
+    name = os.path.join(field_file.field.upload_to, os.path.basename(field_file.name))
+    return field_file.storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def _render_variants(image, prefix):
+    storage = default_storage
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    variants, seen_sizes = [], set()
+    for label, box in IMAGE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((box, box), Image.Resampling.LANCZOS)
+        if resized.size in seen_sizes:
+            continue  # маленький оригинал: одинаковые ширины в srcset не нужны
+        seen_sizes.add(resized.size)
+        for fmt in image_formats():
+            buffer = BytesIO()
+            # exif= не передаём — в вариант метаданные не попадают
+            resized.save(buffer, fmt.upper(), **SAVE_OPTIONS[fmt])
+            name = f"{prefix}/{label}.{fmt}"
+            storage.delete(name)
+            variants.append({
+                "name": storage.save(name, ContentFile(buffer.getvalue())),
+                "format": fmt,
+                "width": resized.width,
+                "height": resized.height,
+            })
+    return variants
+
+
+def delete_variants(source):
+    prefix = _variant_prefix(source)
+    try:
+        _, files = default_storage.listdir(prefix)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        default_storage.delete(f"{prefix}/{filename}")
+
+
+def retain_image(name):
+    """+1 ссылка на файл картинки."""
+    if StoredImage.objects.filter(name=name).update(refcount=F("refcount") + 1):
+        return
+    _, created = StoredImage.objects.get_or_create(name=name, defaults={"refcount": 1})
+    if not created:  # параллельный запрос успел создать строку
+        StoredImage.objects.filter(name=name).update(refcount=F("refcount") + 1)
+
+
+def release_image(name):
+    """-1 ссылка; после коммита файл и варианты удаляются, если ссылок не осталось."""
+    StoredImage.objects.filter(name=name).update(refcount=F("refcount") - 1)
+
+    def delete_if_unused():
+        # под блокировкой строки: параллельная загрузка того же файла ждёт
+        # в ContentAddressedStorage.save и после нас запишет его заново
+        with transaction.atomic():
+            stored = StoredImage.objects.select_for_update().filter(name=name, refcount__lte=0).first()
+            if stored is None:
+                return
+            stored.delete()
+            Ad._meta.get_field("image").storage.delete(name)
+            delete_variants(name)
+
+    transaction.on_commit(delete_if_unused)
+
+
+def process_ad_image(ad_id, force=False):
+    """
+    Строит варианты для текущей картинки объявления. Идемпотентна:
+    если варианты уже соответствуют картинке, ничего не делает (кроме force).
+    """
+    ad = Ad.objects.only("id", "image", "image_variants").filter(pk=ad_id).first()
+    if ad is None or not (force or needs_processing(ad)):
+        return
+    source = final = ad.image.name or None
+    done = _processed(source, ad_id) if source and not force else None
+    if done:
+        result = done
+    elif source:
+        image, original_format, has_metadata = _open(ad.image)
+        if has_metadata:
+            try:
+                final = _strip_original(ad.image, image, original_format)
+            except (OSError, ValueError, KeyError):
+                logger.warning("Не удалось пересохранить оригинал %s без EXIF", source)
+        # очищенный файл уже был у другого объявления — его варианты готовы
+        done = _processed(final, ad_id) if final != source and not force else None
+        result = done or {"source": final, "variants": _render_variants(image, _variant_prefix(final))}
+    else:
+        result = {}
+
+    # условие на image: если картинку успели заменить, наш результат устарел
+    current = Ad.objects.filter(pk=ad_id)
+    if source:
+        current = current.filter(image=source)
+    else:
+        current = current.filter(Q(image="") | Q(image__isnull=True))
+    with transaction.atomic():
+        updated = current.update(image=final, image_variants=result)
+        if final != source:
+            # объявление перешло на очищенный файл — ссылку на оригинал отдаём;
+            # не перешло — отдаём взятую _strip_original ссылку на копию
+            release_image(source if updated else final)
+    if not updated:
+        return  # лишние варианты уберёт release_image вместе с файлом
+    # update() не шлёт post_save — кеш ответов сбрасываем сами
+    invalidate_ad(ad_id)
+
+
+def _processed(source, ad_id):
+    """Варианты того же файла у другого объявления, если они уже построены."""
+    return (
+        Ad.objects.filter(image=source, image_variants__source=source)
+        .exclude(pk=ad_id)
+        .values_list("image_variants", flat=True)
+        .first()
+    )
+
+
+def process_safely(ad_id, force=False):
+    """process_ad_image с логированием ошибок: True — если всё прошло."""
+    try:
+        process_ad_image(ad_id, force=force)
+        return True
+    except Exception:
+        logger.exception("Не удалось обработать картинку объявления %s", ad_id)
+        return False
+
+
+def run_in_worker(ad_id, force=False):
+    # у потока пула своё соединение с БД — закрываем как после запроса
+    close_old_connections()
+    try:
+        return process_safely(ad_id, force=force)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "ADS_IMAGE_WORKERS", 2), thread_name_prefix="ad-images"
+            )
+    return _executor
+
+
+def schedule_image_processing(ad_id):
+    """
+    После коммита отправляет обработку в пул потоков. ADS_IMAGE_WORKERS = 0 —
+    обработка сразу в текущем потоке (тесты, отладка).
+    """
+
+    def submit():
+        if getattr(settings, "ADS_IMAGE_WORKERS", 2) > 0:
+            _get_executor().submit(run_in_worker, ad_id)
+        else:
+            process_safely(ad_id)
+
+    transaction.on_commit(submit)
+
+
+def build_srcset(ad, request=None):
+    """{"avif": "url 320w, url 800w", "webp": "..."} для актуальной картинки."""
+    variants = ad.image_variants or {}
+    if not ad.image or variants.get("source") != ad.image.name:
+        return {}
+    srcset = {}
+    for variant in variants.get("variants", []):
+        url = default_storage.url(variant["name"])
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        srcset.setdefault(variant["format"], []).append(f"{url} {variant['width']}w")
+    return {fmt: ", ".join(entries) for fmt, entries in srcset.items()}
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ads.images import needs_processing, process_safely, run_in_worker
+from ads.models import Ad
+
+
+class Command(BaseCommand):
+    help = "Строит превью и WebP/AVIF-варианты для уже загруженных картинок объявлений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="потоков обработки, 0 — в этом же")
+        parser.add_argument("--force", action="store_true", help="пересобрать и готовые варианты")
+        parser.add_argument("--batch-size", type=int, default=500, help="строк на fetch курсора")
+
+    def handle(self, *args, **options):
+        force = options["force"]
+        ads = (
+            Ad.objects.exclude(image="")
+            .exclude(image__isnull=True)
+            .only("id", "image", "image_variants")
+            .order_by("id")
+            .iterator(chunk_size=options["batch_size"])
+        )
+        ad_ids = [ad.pk for ad in ads if force or needs_processing(ad)]
+        self.stdout.write(f"К обработке: {len(ad_ids)}")
+
+        if options["workers"] > 0:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                results = list(pool.map(lambda pk: run_in_worker(pk, force=force), ad_ids))
+        else:
+            results = [process_safely(pk, force=force) for pk in ad_ids]
+
+        failed = results.count(False)
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Ошибок: {failed} (подробности в логе)"))
+        self.stdout.write(self.style.SUCCESS(f"Готово: {len(ad_ids) - failed}"))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ads.webhooks import dispatch_once
+
+
+class Command(BaseCommand):
+    help = "Рассылает события из outbox по вебхукам (с повторами и backoff)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="один цикл и выход")
+        parser.add_argument("--batch-size", type=int, help="по умолчанию WEBHOOK_BATCH_SIZE")
+        parser.add_argument("--interval", type=float, default=1.0, help="пауза, когда делать нечего, с")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = dispatch_once(options["batch_size"])
+            if stats["events"] or stats["delivered"] or stats["failed"]:
+                self.stdout.write(
+                    f"событий: {stats['events']}, доставлено: {stats['delivered']}, "
+                    f"ошибок: {stats['failed']}"
+                )
+            if options["once"]:
+                break
+            if not (stats["events"] or stats["delivered"] or stats["failed"]):
+                time.sleep(options["interval"])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ads.cycles import find_cycles
+
+
+class Command(BaseCommand):
+    help = "Ищет обмены по кругу (3–4 участника) среди ожидающих предложений для /proposals/cycles/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="весь граф, а не только новые предложения")
+        parser.add_argument("--max-length", type=int, choices=[3, 4], help="объявлений в цикле, по умолчанию из настроек")
+        parser.add_argument("--batch-size", type=int, default=1000, help="строк на INSERT/DELETE")
+
+    def handle(self, *args, **options):
+        run = find_cycles(full=options["full"], max_length=options["max_length"], batch_size=options["batch_size"])
+        kind = "Полный" if run.full else "Инкрементальный"
+        self.stdout.write(self.style.SUCCESS(f"{kind} прогон: новых циклов {run.found}, снято {run.removed}"))
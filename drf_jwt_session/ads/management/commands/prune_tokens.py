@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет истёкшие OutstandingToken/BlacklistedToken пачками: каждая пачка — "
+        "своя короткая транзакция (в отличие от flushexpiredtokens одним DELETE). Для cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="строк на транзакцию")
+        parser.add_argument("--grace-hours", type=float, default=1, help="сколько ждать после истечения")
+        parser.add_argument("--sleep", type=float, default=0.1, help="пауза между пачками, с")
+
+    def handle(self, *args, **options):
+        cutoff = aware_utcnow() - timedelta(hours=options["grace_hours"])
+        expired = OutstandingToken.objects.filter(expires_at__lt=cutoff).order_by("id")
+        total = 0
+        while True:
+            with transaction.atomic():
+                # SKIP LOCKED: строки, которые сейчас кто-то блокирует (refresh), не ждём
+                ids = list(
+                    expired.select_for_update(skip_locked=True).values_list("id", flat=True)[
+                        : options["batch_size"]
+                    ]
+                )
+                if not ids:
+                    break
+                BlacklistedToken.objects.filter(token_id__in=ids).delete()
+                OutstandingToken.objects.filter(id__in=ids).delete()
+            total += len(ids)
+            if len(ids) < options["batch_size"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Удалено токенов: {total}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ads.matches import rebuild_matches
+
+
+class Command(BaseCommand):
+    help = "Пересобирает с нуля кандидатов на обмен (/ads/{id}/matches/) по тегам и категориям"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="строк на INSERT")
+
+    def handle(self, *args, **options):
+        written = rebuild_matches(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Записано пар: {written}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ads.counters import reconcile_all
+
+
+class Command(BaseCommand):
+    help = "Сверяет счётчики предложений (Ad, UserProposalStats) с таблицей предложений и чинит расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="строк на транзакцию")
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать расхождения")
+
+    def handle(self, *args, **options):
+        fixed_ads, fixed_users = reconcile_all(options["batch_size"], dry_run=options["dry_run"])
+        verb = "Расходится" if options["dry_run"] else "Исправлено"
+        self.stdout.write(self.style.SUCCESS(f"{verb}: объявлений {fixed_ads}, пользователей {fixed_users}"))
@@ -0,0 +1,220 @@
+"""
+Кандидаты на обмен для /ads/{id}/matches/, посчитанные заранее.
+
+Объявление — разреженный бинарный вектор признаков: его теги плюс категория.
+Похожесть двух объявлений — косинус этих векторов:
+
+    (общих тегов + одна ли категория) / sqrt(|признаки A| * |признаки B|)
+
+Числители для всех пар — это произведение A·Aᵀ разреженной матрицы
+«объявление × тег». Считаем его по инвертированному индексу (тег -> объявления,
+т.е. столбцы матрицы): обходятся только ненулевые элементы, пары без общих
+тегов не рассматриваются вовсе. Поэтому объявление без тегов кандидатов не
+получает — одной категории мало.
+
+Кандидаты — только чужие объявления. Для каждого объявления хранится
+ADS_MATCHES_PER_AD лучших (AdMatch), чтение — один запрос по индексу
+(ad, -score). Теги или категория поменялись — заново ранжируются само
+объявление, его новые кандидаты и все, у кого оно было в списке (ads/signals.py):
+top-K несимметричен, и просто удалить «обратные» строки значило бы потерять
+их у соседей. Соседи, у которых объявление не было и не стало кандидатом
+в его top-K, ждут manage.py rebuild_matches (пересборка всего с нуля).
+
+Пересчёт читает всех соседей по тегам (у популярного тега их тысячи),
+поэтому после коммита он уходит в пул потоков (ADS_MATCHES_WORKERS), как
+обработка картинок. Два пересчёта соседних объявлений пишут одни и те же
+пары — запись через INSERT … ON CONFLICT DO UPDATE, без IntegrityError.
+"""
+
+import heapq
+import logging
+import math
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+
+from .models import Ad, AdMatch
+
+logger = logging.getLogger(__name__)
+
+MATCHES_DEFAULT_LIMIT = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _per_ad():
+    return getattr(settings, "ADS_MATCHES_PER_AD", 20)
+
+
+def parse_matches_limit(query_params):
+    try:
+        limit = int(query_params.get("limit", MATCHES_DEFAULT_LIMIT))
+    except ValueError:
+        limit = MATCHES_DEFAULT_LIMIT
+    return max(1, min(limit, _per_ad()))
+
+
+def _load(ad_ids=None):
+    """Векторы {ad_id: (user_id, category_id, теги)}: все или нужные для ad_ids."""
+    links = Ad.tags.through.objects.all()
+    ads = Ad.objects.all()
+    if ad_ids is not None:
+        # сами объявления и все, у кого есть общий с ними тег, — с полными наборами тегов
+        shared = links.filter(tag_id__in=links.filter(ad_id__in=ad_ids).values("tag_id"))
+        links = links.filter(Q(ad_id__in=shared.values("ad_id")) | Q(ad_id__in=ad_ids))
+    tags = defaultdict(set)
+    for ad_id, tag_id in links.values_list("ad_id", "tag_id"):
+        tags[ad_id].add(tag_id)
+    if ad_ids is not None:
+        ads = ads.filter(pk__in=set(tags) | set(ad_ids))
+    return {
+        pk: (user_id, category_id, frozenset(tags.get(pk, ())))
+        for pk, user_id, category_id in ads.values_list("pk", "user_id", "category_id")
+    }
+
+
+def _postings(vectors):
+    postings = defaultdict(list)
+    for ad_id, (_user_id, _category_id, tags) in vectors.items():
+        for tag_id in tags:
+            postings[tag_id].append(ad_id)
+    return postings
+
+
+def _rank(ad_id, vectors, postings, limit):
+    """Лучшие limit кандидатов: [(score, общих тегов, candidate_id)]."""
+    user_id, category_id, tags = vectors[ad_id]
+    shared = Counter()
+    for tag_id in tags:
+        shared.update(postings[tag_id])
+    size = len(tags) + (category_id is not None)
+    ranked = []
+    for other_id, common in shared.items():
+        other_user_id, other_category_id, other_tags = vectors[other_id]
+        if other_user_id == user_id:  # в том числе само объявление
+            continue
+        same_category = category_id is not None and category_id == other_category_id
+        other_size = len(other_tags) + (other_category_id is not None)
+        score = (common + same_category) / math.sqrt(size * other_size)
+        ranked.append((score, common, other_id))
+    return heapq.nlargest(limit, ranked)
+
+
+def rebuild_matches(batch_size=1000):
+    """Пересчитать всё с нуля. Возвращает число записанных пар."""
+    vectors = _load()
+    postings = _postings(vectors)
+    limit = _per_ad()
+    rows = [
+        AdMatch(ad_id=ad_id, candidate_id=candidate_id, score=score, shared_tags=common)
+        for ad_id in vectors
+        for score, common, candidate_id in _rank(ad_id, vectors, postings, limit)
+    ]
+    with transaction.atomic():
+        AdMatch.objects.all().delete()
+        AdMatch.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def refresh_matches(ad_ids):
+    """
+    Пересчитать кандидатов ad_ids и списки, которые их касаются: тех, у кого
+    ad_ids уже в кандидатах, и новых кандидатов ad_ids. Возвращает число пар.
+    """
+    ad_ids = set(ad_ids)
+    holders = set(AdMatch.objects.filter(candidate_id__in=ad_ids).values_list("ad_id", flat=True))
+    vectors = _load(ad_ids)
+    postings = _postings(vectors)
+    limit = _per_ad()
+    candidates = {
+        candidate_id
+        for ad_id in ad_ids & vectors.keys()  # удалённые объявления ушли каскадом
+        for _score, _common, candidate_id in _rank(ad_id, vectors, postings, limit)
+    }
+    affected = ad_ids | holders | candidates
+    # у соседей свои соседи — нужны их векторы тоже
+    vectors = _load(affected)
+    postings = _postings(vectors)
+    rows = {
+        (ad_id, candidate_id): AdMatch(
+            ad_id=ad_id, candidate_id=candidate_id, score=score, shared_tags=common
+        )
+        for ad_id in affected & vectors.keys()
+        for score, common, candidate_id in _rank(ad_id, vectors, postings, limit)
+    }
+    with transaction.atomic():
+        AdMatch.objects.filter(ad_id__in=affected).delete()
+        # параллельный пересчёт мог успеть вставить те же пары; порядок ключей —
+        # чтобы два таких INSERT не ждали друг друга крест-накрест
+        AdMatch.objects.bulk_create(
+            [rows[key] for key in sorted(rows)],
+            update_conflicts=True,
+            unique_fields=["ad", "candidate"],
+            update_fields=["score", "shared_tags"],
+        )
+    return len(rows)
+
+
+def refresh_safely(ad_ids):
+    try:
+        refresh_matches(ad_ids)
+        return True
+    except Exception:
+        logger.exception("Не удалось пересчитать кандидатов на обмен для %s", ad_ids)
+        return False
+
+
+def run_in_worker(ad_ids):
+    # у потока пула своё соединение с БД — закрываем как после запроса
+    close_old_connections()
+    try:
+        return refresh_safely(ad_ids)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "ADS_MATCHES_WORKERS", 2), thread_name_prefix="ad-matches"
+            )
+    return _executor
+
+
+def schedule_refresh(ad_ids):
+    """
+    После коммита: пересчёт читает уже сохранённые теги и не удлиняет
+    транзакцию запроса. ADS_MATCHES_WORKERS = 0 — сразу в текущем потоке.
+    """
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return
+
+    def submit():
+        # колбэк внутри внешней транзакции (TestCase) — поток её данных не увидит
+        if getattr(settings, "ADS_MATCHES_WORKERS", 2) > 0 and not connection.in_atomic_block:
+            _get_executor().submit(run_in_worker, ad_ids)
+        else:
+            refresh_safely(ad_ids)
+
+    transaction.on_commit(submit)
+
+
+def matches_for(ad_id, limit):
+    """Готовые кандидаты одним запросом по индексу (ad, -score)."""
+    return list(
+        AdMatch.objects.filter(ad_id=ad_id)
+        .select_related("candidate__user", "candidate__category")
+        .only(
+            "score", "shared_tags", "candidate__id", "candidate__title", "candidate__image",
+            "candidate__condition", "candidate__user__username", "candidate__category__title",
+        )
+        .order_by("-score", "candidate_id")[:limit]
+    )
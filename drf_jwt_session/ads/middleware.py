@@ -0,0 +1,103 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .budgets import QueryBudgetExceeded, get_view_budget
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """execute_wrapper: считает запросы и суммарное время в БД."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    @property
+    def db_time_ms(self):
+        return self.db_time * 1000
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к БД на каждый запрос и сверяет с бюджетом view
+    (ads/budgets.py). QUERY_BUDGET_MODE: "off", "log" или "raise".
+
+    Умеет и sync, и async: иначе под ASGI Django оборачивал бы всю цепочку
+    в поток и async-views (ads/async_views.py) теряли бы смысл.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        mode = getattr(settings, "QUERY_BUDGET_MODE", "off")
+        if mode == "off":
+            return self.get_response(request)
+
+        request._query_budget = None
+        stats = QueryStats()
+        with ExitStack() as stack:
+            self._install(stack, stats)
+            response = self.get_response(request)
+        return self._check(request, response, stats, mode)
+
+    async def __acall__(self, request):
+        mode = getattr(settings, "QUERY_BUDGET_MODE", "off")
+        if mode == "off":
+            return await self.get_response(request)
+
+        request._query_budget = None
+        stats = QueryStats()
+        # соединения thread-local, а async ORM ходит в БД через sync_to_async —
+        # в поток запроса (ThreadSensitiveContext), туда и ставим wrapper
+        stack = ExitStack()
+        await sync_to_async(self._install)(stack, stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._check(request, response, stats, mode)
+
+    def _install(self, stack, stats):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+    def _check(self, request, response, stats, mode):
+        response["X-DB-Queries"] = str(stats.queries)
+        response["X-DB-Time-ms"] = f"{stats.db_time_ms:.1f}"
+
+        budget = request._query_budget
+        if budget is not None:
+            problems = budget.violations(stats.queries, stats.db_time_ms)
+            if problems:
+                message = f"{request.method} {request.path}: превышен бюджет — {'; '.join(problems)}"
+                if mode == "raise":
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, "_query_budget"):
+            request._query_budget = get_view_budget(view_func, request.method)
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+import ads.storage
+
+
+def count_existing_images(apps, schema_editor):
+    # уже загруженные картинки остаются под старыми именами, но тоже считаются
+    Ad = apps.get_model("ads", "Ad")
+    StoredImage = apps.get_model("ads", "StoredImage")
+    rows = (
+        Ad.objects.exclude(image="")
+        .exclude(image__isnull=True)
+        .values("image")
+        .annotate(refcount=Count("id"))
+        .order_by()
+    )
+    StoredImage.objects.bulk_create(
+        (StoredImage(name=row["image"], refcount=row["refcount"]) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0012_ad_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refcount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=ads.storage.ContentAddressedStorage(), upload_to='ads_images/'),
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
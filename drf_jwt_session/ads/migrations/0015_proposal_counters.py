@@ -0,0 +1,99 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    # дальше счётчики ведёт ads/counters.py, здесь — начальные значения
+    Ad = apps.get_model("ads", "Ad")
+    ExchangeProposal = apps.get_model("ads", "ExchangeProposal")
+    UserProposalStats = apps.get_model("ads", "UserProposalStats")
+    pending, accepted = Q(status="pending"), Q(status="accepted")
+
+    ads = []
+    received = (
+        ExchangeProposal.objects.values("ad_receiver_id")
+        .annotate(total=Count("id"), pending=Count("id", filter=pending), accepted=Count("id", filter=accepted))
+        .order_by()
+    )
+    for row in received.iterator():
+        ads.append(
+            Ad(
+                pk=row["ad_receiver_id"],
+                received_proposals_count=row["total"],
+                pending_proposals_count=row["pending"],
+                accepted_proposals_count=row["accepted"],
+            )
+        )
+    Ad.objects.bulk_update(
+        ads,
+        ["received_proposals_count", "pending_proposals_count", "accepted_proposals_count"],
+        batch_size=1000,
+    )
+
+    stats = {}
+    by_receiver = (
+        ExchangeProposal.objects.values("ad_receiver__user_id")
+        .annotate(total=Count("id"), pending=Count("id", filter=pending), accepted=Count("id", filter=accepted))
+        .order_by()
+    )
+    for row in by_receiver.iterator():
+        row_stats = stats.setdefault(row["ad_receiver__user_id"], {})
+        row_stats.update(
+            received_count=row["total"],
+            pending_received_count=row["pending"],
+            accepted_received_count=row["accepted"],
+        )
+    by_sender = (
+        ExchangeProposal.objects.values("ad_sender__user_id")
+        .annotate(total=Count("id"), pending=Count("id", filter=pending))
+        .order_by()
+    )
+    for row in by_sender.iterator():
+        row_stats = stats.setdefault(row["ad_sender__user_id"], {})
+        row_stats.update(sent_count=row["total"], pending_sent_count=row["pending"])
+    UserProposalStats.objects.bulk_create(
+        (UserProposalStats(user_id=user_id, **values) for user_id, values in stats.items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0014_webhook_outbox'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProposalStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='proposal_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('received_count', models.IntegerField(default=0)),
+                ('pending_received_count', models.IntegerField(default=0)),
+                ('accepted_received_count', models.IntegerField(default=0)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('pending_sent_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='accepted_proposals_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='pending_proposals_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='received_proposals_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0016_ad_facets_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdMatch',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('score', models.FloatField()),
+                ('shared_tags', models.PositiveSmallIntegerField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='ads.ad')),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ads.ad')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ad', '-score', 'candidate'], name='ads_match_ranked')],
+                'constraints': [models.UniqueConstraint(fields=('ad', 'candidate'), name='unique_ad_match')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:26
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0017_ad_matches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CycleSearchRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_proposal_id', models.BigIntegerField()),
+                ('full', models.BooleanField()),
+                ('found', models.IntegerField(default=0)),
+                ('removed', models.IntegerField(default=0)),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TradeCycle',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('signature', models.CharField(max_length=100, unique=True)),
+                ('ad_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('user_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('proposal_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['user_ids'], name='ads_cycle_users'), django.contrib.postgres.indexes.GinIndex(fields=['proposal_ids'], name='ads_cycle_proposals')],
+            },
+        ),
+    ]
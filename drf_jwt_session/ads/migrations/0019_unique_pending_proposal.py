@@ -0,0 +1,58 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:38
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Subquery
+
+
+def reject_duplicate_pending(apps, schema_editor):
+    # перед уникальным индексом: из повторов пары ожидает только самое раннее предложение
+    Ad = apps.get_model("ads", "Ad")
+    ExchangeProposal = apps.get_model("ads", "ExchangeProposal")
+    UserProposalStats = apps.get_model("ads", "UserProposalStats")
+
+    pairs = (
+        ExchangeProposal.objects.filter(status="pending")
+        .values("ad_sender_id", "ad_receiver_id")
+        .annotate(first_id=Min("id"), total=Count("id"))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    received, sent = Counter(), Counter()
+    for pair in pairs.iterator():
+        rejected = (
+            ExchangeProposal.objects.filter(
+                status="pending", ad_sender_id=pair["ad_sender_id"], ad_receiver_id=pair["ad_receiver_id"]
+            )
+            .exclude(pk=pair["first_id"])
+            .update(status="rejected")
+        )
+        received[pair["ad_receiver_id"]] += rejected
+        sent[pair["ad_sender_id"]] += rejected
+
+    # счётчики ads/counters.py: update() мимо сигналов
+    for ad_id, count in received.items():
+        Ad.objects.filter(pk=ad_id).update(pending_proposals_count=F("pending_proposals_count") - count)
+        UserProposalStats.objects.filter(
+            user_id=Subquery(Ad.objects.filter(pk=ad_id).values("user_id"))
+        ).update(pending_received_count=F("pending_received_count") - count)
+    for ad_id, count in sent.items():
+        UserProposalStats.objects.filter(
+            user_id=Subquery(Ad.objects.filter(pk=ad_id).values("user_id"))
+        ).update(pending_sent_count=F("pending_sent_count") - count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0018_trade_cycles'),
+    ]
+
+    operations = [
+        migrations.RunPython(reject_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='exchangeproposal',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('ad_sender', 'ad_receiver'), name='unique_pending_proposal'),
+        ),
+    ]
@@ -1,7 +1,18 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.aggregates import JSONBAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
 from django.urls import reverse
 from django.db.models import Q, F, Index
+from django.db.models.functions import JSONObject, Length
+
+from .search import ad_search_vector
+from .storage import ContentAddressedStorage
 
 
 class TimestampedModel(models.Model):
@@ -22,36 +33,117 @@ class Category(models.Model):
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
+    class Meta:
+        indexes = [
+            # автодополнение тегов (pg_trgm)
+            GinIndex(fields=['name'], name='ads_tag_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
     def __str__(self):
         return self.name
         
 
+class AdQuerySet(models.QuerySet):
+    def for_list(self):
+        """
+        Один SQL-запрос под AdListSerializer: длина описания и теги
+        считаются в Postgres, а само описание и tsvector не читаются.
+        """
+        return (
+            self.defer('description', 'search_vector')
+            .annotate(
+                username=F('user__username'),
+                description_length=Length('description'),
+                tag_list=JSONBAgg(
+                    JSONObject(id='tags__id', name='tags__name'),
+                    filter=Q(tags__isnull=False),
+                    order_by='tags__name',
+                    default=[],
+                ),
+            )
+        )
+
+    def for_export(self):
+        """Как for_list, но с полным описанием — для потоковой выгрузки."""
+        return self.for_list().defer(None).defer('search_vector')
+
+
 class Ad(models.Model):
     CONDITION_CHOICES = [
         ("new", "Новый"),
         ("used", "Б/у"),
     ]
 
+    COUNTER_FIELDS = ("received_proposals_count", "pending_proposals_count", "accepted_proposals_count")
+
     id = models.BigAutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ads")
     title = models.CharField(max_length=255)
     description = models.TextField()
-    image = models.ImageField(upload_to="ads_images/", blank=True, null=True)
+    # имя файла — хеш содержимого, одинаковые фото хранятся один раз (ads/storage.py)
+    image = models.ImageField(
+        upload_to="ads_images/", storage=ContentAddressedStorage(), blank=True, null=True
+    )
+    # превью и WebP/AVIF-варианты картинки, заполняет ads/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # счётчики входящих предложений, ведёт ads/counters.py
+    received_proposals_count = models.IntegerField(default=0, editable=False)
+    pending_proposals_count = models.IntegerField(default=0, editable=False)
+    accepted_proposals_count = models.IntegerField(default=0, editable=False)
 
     category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.SET_NULL)
     condition = models.CharField(max_length=10, choices=CONDITION_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
     tags = models.ManyToManyField(Tag, blank=True, related_name="ads")
 
+    objects = AdQuerySet.as_manager()
+
+    # tsvector хранится в таблице и пересчитывается самим Postgres
+    search_vector = models.GeneratedField(
+        expression=ad_search_vector(),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # прежняя категория — post_save пересчитает кандидатов на обмен, только если она сменилась
+        instance._loaded_category_id = instance.__dict__.get("category_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # счётчики меняют только UPDATE … SET x = x + 1 (ads/counters.py): полный save
+            # записал бы прочитанные раньше значения поверх чужих приращений
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and not field.generated
+                and field.name not in self.COUNTER_FIELDS
+                and field.attname not in deferred
+            ]
+        # post_save пишет событие в outbox — в той же транзакции, что и само объявление
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_category_id = self.category_id
+
     class Meta:
         verbose_name = "Объявление"
         verbose_name_plural = "Объявления"
         ordering = ['-created_at']  # последние объявления первыми
         indexes = [
             Index(fields=['user', 'created_at']),
+            Index(fields=['-created_at', '-id']),  # keyset-пагинация ленты
+            GinIndex(fields=['search_vector']),  # полнотекстовый поиск
+            GinIndex(fields=['title'], name='ads_ad_title_trgm', opclasses=['gin_trgm_ops']),
+            # фасеты ?facets=1: счётчики по категориям и состояниям (ads/facets.py)
+            Index(fields=['category', 'condition'], name='ads_ad_facets'),
         ]
         constraints = [
             models.CheckConstraint(
@@ -67,6 +159,77 @@ class Ad(models.Model):
 
 
 
+class AdMatch(models.Model):
+    """Готовый кандидат на обмен: похожее чужое объявление (ведёт ads/matches.py)."""
+    id = models.BigAutoField(primary_key=True)
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="matches")
+    candidate = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()  # косинус векторов «теги + категория»
+    shared_tags = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ad', 'candidate'], name='unique_ad_match'),
+        ]
+        indexes = [
+            # /ads/{id}/matches/: лучшие кандидаты одного объявления
+            Index(fields=['ad', '-score', 'candidate'], name='ads_match_ranked'),
+        ]
+
+    def __str__(self):
+        return f"{self.ad_id} -> {self.candidate_id} ({self.score:.2f})"
+
+
+class StoredImage(models.Model):
+    """Сколько объявлений ссылается на файл картинки."""
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class ExchangeProposalQuerySet(models.QuerySet):
+    def get_or_create_pending(self, ad_sender_id, ad_receiver_id, comment=None):
+        """
+        Ожидающее предложение пары за один INSERT … ON CONFLICT DO NOTHING
+        по индексу unique_pending_proposal: повтор возвращает существующее
+        вместо IntegrityError. Возвращает (proposal, created).
+
+        Сырой SQL: ORM не умеет ON CONFLICT с условием частичного индекса
+        и RETURNING при ignore_conflicts.
+        """
+        model = self.model
+        quote = connections[self.db].ops.quote_name
+        fields = [model._meta.get_field(name) for name in ('ad_sender', 'ad_receiver', 'comment', 'status', 'created_at')]
+        columns = [field.column for field in fields]
+        values = [ad_sender_id, ad_receiver_id, comment, 'pending', timezone.now()]
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(map(quote, columns))}) "
+            f"VALUES ({', '.join(['%s'] * len(values))}) "
+            f"ON CONFLICT ({quote(columns[0])}, {quote(columns[1])}) WHERE {quote(columns[3])} = 'pending' "
+            f"DO NOTHING RETURNING {quote(model._meta.pk.column)}"
+        )
+        with transaction.atomic(using=self.db):
+            # каждый круг либо вставляет, либо находит ожидающее; промах — только если
+            # его успели принять, отклонить или удалить между INSERT и SELECT
+            while True:
+                with connections[self.db].cursor() as cursor:
+                    cursor.execute(sql, values)
+                    row = cursor.fetchone()
+                if row is not None:
+                    break
+                existing = self.filter(
+                    ad_sender_id=ad_sender_id, ad_receiver_id=ad_receiver_id, status='pending'
+                ).first()
+                if existing is not None:
+                    return existing, False
+            proposal = model.from_db(self.db, ['id', *(field.attname for field in fields)], [row[0], *values])
+            # INSERT мимо save(): outbox и счётчики висят на post_save — шлём его сами
+            post_save.send(sender=model, instance=proposal, created=True, update_fields=None, raw=False, using=self.db)
+        return proposal, True
+
+
 class ExchangeProposal(models.Model):
     STATUS_CHOICES = [
         ("pending", "Ожидает"),
@@ -81,9 +244,156 @@ class ExchangeProposal(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ExchangeProposalQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset-пагинация входящих/исходящих предложений
+            Index(fields=['ad_receiver', '-created_at', '-id']),
+            Index(fields=['ad_sender', '-created_at', '-id']),
+        ]
+        constraints = [
+            # одна ожидающая пара: повторный клик/ретрай не плодит дубли (get_or_create_pending)
+            models.UniqueConstraint(
+                fields=['ad_sender', 'ad_receiver'],
+                condition=Q(status='pending'),
+                name='unique_pending_proposal',
+            ),
+        ]
+
     def __str__(self):
         return f"Предложение обмена от '{self.ad_sender}' к '{self.ad_receiver}' [{self.get_status_display()}]"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # прежний статус — чтобы post_save поправил счётчики без лишнего SELECT
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():  # вместе с событием в outbox и счётчиками
+            super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
+
+class TradeCycle(models.Model):
+    """
+    Обмен по кругу на 3–4 участника из ожидающих предложений (ищет ads/cycles.py):
+    ad_ids[i] предлагают за ad_ids[i + 1], последнее — за первое.
+    """
+    id = models.BigAutoField(primary_key=True)
+    # ad_ids по кругу, начиная с меньшего, — один и тот же цикл не записывается дважды
+    signature = models.CharField(max_length=100, unique=True)
+    ad_ids = ArrayField(models.BigIntegerField())
+    user_ids = ArrayField(models.IntegerField())
+    proposal_ids = ArrayField(models.BigIntegerField())  # proposal_ids[i]: ad_ids[i] -> ad_ids[i + 1]
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['user_ids'], name='ads_cycle_users'),  # /proposals/cycles/ участника
+            GinIndex(fields=['proposal_ids'], name='ads_cycle_proposals'),  # снять при смене статуса
+        ]
+
+    def __str__(self):
+        return " -> ".join(map(str, [*self.ad_ids, self.ad_ids[0]]))
+
+
+class CycleSearchRun(models.Model):
+    """Прогон поиска циклов: до какого предложения граф уже просмотрен."""
+    last_proposal_id = models.BigIntegerField()
+    full = models.BooleanField()
+    found = models.IntegerField(default=0)
+    removed = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{'полный' if self.full else 'инкрементальный'} до #{self.last_proposal_id}: +{self.found}/-{self.removed}"
+
+
+class UserProposalStats(models.Model):
+    """Сводка по предложениям пользователя (бейдж «входящие» без COUNT)."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="proposal_stats"
+    )
+    received_count = models.IntegerField(default=0)
+    pending_received_count = models.IntegerField(default=0)
+    accepted_received_count = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    pending_sent_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user}: {self.pending_received_count} входящих"
+
+
+class OutboxEvent(models.Model):
+    """
+    Событие об изменении объявления/предложения. Пишется в той же транзакции,
+    что и изменение, рассылается отдельным процессом (ads/webhooks.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # диспетчер берёт ещё не разосланные события по порядку
+            Index(fields=['id'], condition=Q(dispatched_at__isnull=True), name='ads_outbox_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.pk}"
+
+
+class WebhookEndpoint(models.Model):
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=128, blank=True)  # для подписи X-Webhook-Signature
+    event_types = models.JSONField(default=list, blank=True)  # пусто — все события
+    max_concurrency = models.PositiveSmallIntegerField(default=1)  # на один диспетчер, не глобально
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def accepts(self, event_type):
+        return not self.event_types or event_type in self.event_types
+
+    def __str__(self):
+        return self.url
+
+
+class WebhookDelivery(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Ожидает"),
+        ("delivered", "Доставлено"),
+        ("failed", "Не доставлено"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    event = models.ForeignKey(OutboxEvent, on_delete=models.CASCADE, related_name="deliveries")
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name="deliveries")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'endpoint'], name='unique_event_endpoint'),
+        ]
+        indexes = [
+            Index(
+                fields=['next_attempt_at', 'id'],
+                condition=Q(status='pending'),
+                name='ads_delivery_due',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event} -> {self.endpoint} [{self.status}]"
+
 
 
 class Post(models.Model):
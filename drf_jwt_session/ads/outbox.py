@@ -0,0 +1,44 @@
+"""
+Transactional outbox: события об объявлениях и предложениях пишутся строкой
+в OutboxEvent в той же транзакции, что и само изменение. Запрос ничего не
+отправляет наружу — рассылкой занимается dispatch_webhooks (ads/webhooks.py).
+
+Типы событий: ad.created, ad.updated, ad.deleted,
+proposal.created, proposal.updated, proposal.deleted.
+"""
+
+from .models import OutboxEvent
+
+
+def ad_payload(ad):
+    return {
+        "id": ad.pk,
+        "user_id": ad.user_id,
+        "title": ad.title,
+        "category_id": ad.category_id,
+        "condition": ad.condition,
+        "image": ad.image.name or None,
+        "created_at": ad.created_at,
+    }
+
+
+def proposal_payload(proposal):
+    return {
+        "id": proposal.pk,
+        "ad_sender_id": proposal.ad_sender_id,
+        "ad_receiver_id": proposal.ad_receiver_id,
+        "status": proposal.status,
+        "comment": proposal.comment,
+        "created_at": proposal.created_at,
+    }
+
+
+def record_event(event_type, payload):
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def record_events(event_type, payloads):
+    """Для пакетных операций: одно INSERT на все события."""
+    return OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_type=event_type, payload=payload) for payload in payloads]
+    )
@@ -0,0 +1,33 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+from .search import SEARCH_RANK
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация по (created_at, id) вместо OFFSET + COUNT(*).
+    Стоимость любой страницы одинакова — Postgres идёт по индексу
+    от позиции курсора, а не пропускает N строк.
+
+    paginate_queryset — штатный из DRF; async-views (ads/async_views.py)
+    зовут его через sync_to_async, своей копии курсорной логики тут нет.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if SEARCH_RANK in queryset.query.annotations and not request.query_params.get(
+            api_settings.ORDERING_PARAM
+        ):
+            # полнотекстовый поиск: листаем по релевантности
+            ordering = (f"-{SEARCH_RANK}",)
+        # OrderingFilter может вернуть ['-created_at'] или ['title'] —
+        # добавляем id как tie-breaker, чтобы порядок был однозначным
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            direction = "-" if ordering[0].startswith("-") else ""
+            ordering = (*ordering, f"{direction}id")
+        return ordering
@@ -0,0 +1,72 @@
+"""
+Справочники (Category, Tag) в памяти процесса.
+
+Таблицы маленькие и меняются редко, а нужны почти каждой записи объявления:
+поле category, tag_ids, проверка category.title в validate(). Снимок
+загружается целиком (по запросу на модель) и помечается поколением
+REFERENCE_GENERATION_KEY из ads/cache.py. Сигналы Category/Tag увеличивают
+поколение после коммита — увидев новое, процесс перечитывает снимок.
+
+Объекты снимка общие для всех запросов процесса: только для чтения.
+
+Всё это — только при общем кеше (Redis): в памяти процесса поколение не
+узнает об изменении в другом воркере, и снимок устарел бы навсегда
+(/categories/ с ETag, фасеты, теги по имени, удалённая категория до
+IntegrityError на INSERT). Без него reference_data() каждый раз читает
+справочники из БД, а запись (поля category/tag_ids, пакеты) ищет объекты
+по одному запросу на модель.
+"""
+
+import hashlib
+import threading
+
+from .cache import REFERENCE_GENERATION_KEY, _get_generations, is_shared_cache
+from .models import Category, Tag
+
+REFERENCE_MODELS = (Category, Tag)
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+class ReferenceSnapshot:
+    def __init__(self, generation):
+        self.generation = generation
+        self.objects = {model: model.objects.in_bulk() for model in REFERENCE_MODELS}
+        # одинаковые данные — одинаковый digest в любом процессе (для ETag)
+        self.digests = {model: self._digest(model, objects) for model, objects in self.objects.items()}
+
+    @staticmethod
+    def _digest(model, objects):
+        fields = [field.attname for field in model._meta.concrete_fields]
+        rows = sorted(tuple(getattr(obj, name) for name in fields) for obj in objects.values())
+        return hashlib.md5(repr(rows).encode()).hexdigest()
+
+    def ordered(self, model):
+        return [self.objects[model][pk] for pk in sorted(self.objects[model])]
+
+
+def reference_data():
+    """Актуальный снимок справочников; перечитывает его, если поколение сменилось."""
+    global _snapshot
+    if not is_shared_cache():
+        return ReferenceSnapshot(generation=None)
+    (generation,) = _get_generations(REFERENCE_GENERATION_KEY)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == generation:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.generation != generation:
+            _snapshot = ReferenceSnapshot(generation)
+        return _snapshot
+
+
+def write_reference_data():
+    """Снимок для проверки записи или None — тогда справочники читаются из БД."""
+    return reference_data() if is_shared_cache() else None
+
+
+def reset():
+    global _snapshot
+    with _lock:
+        _snapshot = None
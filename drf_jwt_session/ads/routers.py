@@ -0,0 +1,219 @@
+"""
+Чтение с реплик: безопасные запросы (GET/HEAD/OPTIONS) читают с реплики,
+запись и всё остальное — primary (alias default).
+
+- ReplicaRoutingMiddleware до view выбирает живую реплику, а закрепление
+  проверяется при первом чтении — к этому моменту DRF уже знает
+  пользователя из JWT;
+- после записи (POST/PUT/PATCH/DELETE) пользователь REPLICA_PIN_SECONDS
+  читает с primary — видит то, что только что записал. Метка в общем кеше,
+  как счётчики throttling: запросы приходят в разные воркеры;
+- внутри транзакции на primary чтение тоже идёт туда: иначе не видно своих
+  же незакоммиченных строк. Заодно TestCase (тест — одна транзакция)
+  целиком остаётся на default;
+- сессии, пользователи и чёрный список токенов — всегда с primary: выход
+  и отзыв токена не должны «откатываться» на отставшей реплике;
+- реплика недоступна или отстала больше REPLICA_MAX_LAG_SECONDS — primary.
+  Проверка кешируется в процессе на REPLICA_HEALTH_CHECK_SECONDS и в бюджет
+  запросов (ads/budgets.py) не входит;
+- view, которому нужны свежие данные любой ценой, отказывается от реплик:
+  use_replica = False у класса или @read_from_primary у функции.
+  Async-views (ads/async_views.py) пока читают с primary: async ORM
+  спрашивает роутер в потоке event loop, где не видно транзакций потока,
+  в котором потом идёт сам запрос.
+
+Реплики включаются только с DB_REPLICA_HOSTS (src/settings.py) и только
+с общим кешем — без него метка после записи видна одному воркеру.
+"""
+
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .cache import is_shared_cache
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+PRIMARY_APPS = {"auth", "sessions", "token_blacklist"}
+PIN_KEY = "replica:pin:{}"
+
+# отставание в секундах; реплика, догнавшая primary, — 0, даже если записей
+# давно не было (иначе pg_last_xact_replay_timestamp растёт на простое)
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_read_route = ContextVar("read_route", default=None)
+_health = {}  # alias -> (время проверки, годится ли)
+
+
+def _replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def read_from_primary(view_func):
+    """Декоратор для function-based views: читать только с primary."""
+    view_func.use_replica = False
+    return view_func
+
+
+def _use_replica(view_func):
+    view_cls = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+    return getattr(view_func, "use_replica", getattr(view_cls, "use_replica", True))
+
+
+def check_replica_settings():
+    """При старте: реплики без общего кеша — ошибка конфигурации."""
+    if _replicas() and not is_shared_cache():
+        raise ImproperlyConfigured(
+            "DATABASE_REPLICAS требует общий кеш (REDIS_URL): иначе после записи "
+            "пользователь закреплён за primary только в своём воркере."
+        )
+
+
+def replica_lag(alias):
+    connection = connections[alias]
+    connection.ensure_connection()
+    # курсор драйвера, мимо execute_wrapper'ов: служебный запрос не считается
+    # в бюджет запроса QueryBudgetMiddleware
+    with connection.wrap_database_errors, connection.connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def replica_ok(alias):
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked and now - checked[0] < getattr(settings, "REPLICA_HEALTH_CHECK_SECONDS", 5):
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError as exc:
+        logger.warning("реплика %s недоступна: %s", alias, exc)
+        ok = False
+    else:
+        ok = lag <= getattr(settings, "REPLICA_MAX_LAG_SECONDS", 5)
+        if not ok:
+            logger.warning("реплика %s отстаёт на %.1f с — читаем с primary", alias, lag)
+    _health[alias] = (now, ok)
+    return ok
+
+
+def pin_to_primary(user_id):
+    cache.set(PIN_KEY.format(user_id), 1, getattr(settings, "REPLICA_PIN_SECONDS", 10))
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+def choose_replica():
+    healthy = [alias for alias in _replicas() if replica_ok(alias)]
+    return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+
+class ReadRoute:
+    """
+    Откуда читает один запрос. Реплика выбрана заранее (в middleware),
+    закрепление проверяется при первом чтении: пользователь уже известен.
+    """
+
+    def __init__(self, request, replica):
+        self.request = request
+        self.replica = replica
+        self.alias = None
+
+    def resolve(self):
+        if self.alias is None:
+            user = getattr(self.request, "user", None)
+            pinned = user is not None and user.is_authenticated and is_pinned(user.pk)
+            self.alias = DEFAULT_DB_ALIAS if pinned else self.replica
+        return self.alias
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        route = _read_route.get()
+        if route is None or model._meta.app_label in PRIMARY_APPS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return route.resolve()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # реплика — копия той же базы
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Включает чтение с реплик для безопасных запросов и закрепляет
+    пользователя за primary после записи. Sync и async — как QueryBudgetMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = _read_route.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_route.reset(token)
+        self._pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = _read_route.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_route.reset(token)
+        if request.method not in SAFE_METHODS:
+            await sync_to_async(self._pin)(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method in SAFE_METHODS
+            and _replicas()
+            and _use_replica(view_func)
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            # проверка реплики ходит в БД — здесь, а не в роутере: тот
+            # вызывается и из event loop (async ORM)
+            replica = choose_replica()
+            if replica != DEFAULT_DB_ALIAS:
+                _read_route.set(ReadRoute(request, replica))
+
+    def _pin(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
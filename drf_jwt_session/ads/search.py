@@ -0,0 +1,57 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from rest_framework.filters import SearchFilter
+
+# Объявления пишут и на русском, и на английском — индексируем обоими словарями
+SEARCH_CONFIGS = ("russian", "english")
+SEARCH_RANK = "search_rank"
+
+
+def ad_search_vector():
+    """
+    Выражение tsvector для Ad: заголовок с весом A, описание с весом B.
+    Используется как выражение GeneratedField, поэтому хранится в таблице
+    и пересчитывается самим Postgres при любом INSERT/UPDATE.
+    """
+    vector = None
+    for config in SEARCH_CONFIGS:
+        part = SearchVector("title", weight="A", config=config) + SearchVector(
+            "description", weight="B", config=config
+        )
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def ad_search_query(text):
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(text, config=config, search_type="websearch")
+        query = part if query is None else query | part
+    return query
+
+
+def search_ads_queryset(queryset, text):
+    """
+    Фильтрует объявления по GIN-индексу search_vector и добавляет ранг
+    (ts_rank) в аннотацию search_rank. Сортировку оставляем вызывающему.
+    """
+    query = ad_search_query(text)
+    # real -> double precision, чтобы позиция курсора сравнивалась точно
+    rank = Cast(SearchRank(F("search_vector"), query), FloatField())
+    return queryset.filter(search_vector=query).annotate(**{SEARCH_RANK: rank})
+
+
+class AdFullTextSearchFilter(SearchFilter):
+    """
+    Замена SearchFilter (ILIKE '%q%') на полнотекстовый поиск.
+    Параметр тот же — ?search=, результаты упорядочены по релевантности,
+    пока клиент явно не передал ?ordering=.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "").strip()
+        if not text:
+            return queryset
+        queryset = search_ads_queryset(queryset, text)
+        return queryset.order_by(f"-{SEARCH_RANK}", "-id")
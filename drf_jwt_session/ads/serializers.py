@@ -1,32 +1,132 @@
+from django.conf import settings
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from .models import ExchangeProposal,  Ad, Tag, Category, Post
+from .images import build_srcset
+from .models import ExchangeProposal,  Ad, AdMatch, Tag, Category, Post, TradeCycle, UserProposalStats
+from .reference import REFERENCE_MODELS, write_reference_data
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который сначала ищет объект в
+    context["preloaded"][Model] (словарь pk -> объект). Пакетные операции
+    загружают справочники одним запросом на весь пакет, а не на каждый элемент.
+    Без context["preloaded"] категории и теги берутся из снимка справочников
+    (ads/reference.py, только при общем кеше), промах — обычный запрос.
+    """
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        preloaded = self.context.get("preloaded", {}).get(model)
+        snapshot = None
+        if preloaded is None and model in REFERENCE_MODELS:
+            snapshot = write_reference_data()
+        from_snapshot = snapshot is not None
+        if from_snapshot:
+            preloaded = snapshot.objects[model]
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            obj = preloaded.get(int(data))
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if obj is None:
+            if from_snapshot:
+                # снимок мог отстать (запись в другом процессе) — решает БД
+                return super().to_internal_value(data)
+            self.fail("does_not_exist", pk_value=data)
+        return obj
 
 
 class ProposalCreateSerializer(serializers.ModelSerializer):
+    # владельцы обоих объявлений читаются в validate() одним запросом
+    ad_sender = serializers.IntegerField(source="ad_sender_id")
+    ad_receiver = serializers.IntegerField(source="ad_receiver_id")
+
     class Meta:
         model = ExchangeProposal
         fields = "__all__"
         read_only_fields = ["status", "created_at"]
+        # дубль ожидающей пары ловит индекс unique_pending_proposal в самом INSERT,
+        # без SELECT-проверки от UniqueTogetherValidator
+        validators = []
 
     def validate(self, data):
         user = self.context["request"].user
-        ad_sender = data.get("ad_sender")
-        ad_receiver = data.get("ad_receiver")
+        sender_id, receiver_id = data["ad_sender_id"], data["ad_receiver_id"]
+        owners = dict(Ad.objects.filter(pk__in=[sender_id, receiver_id]).values_list("id", "user_id"))
+        does_not_exist = serializers.PrimaryKeyRelatedField.default_error_messages["does_not_exist"]
+        for field, pk in (("ad_sender", sender_id), ("ad_receiver", receiver_id)):
+            if pk not in owners:
+                raise ValidationError({field: [does_not_exist.format(pk_value=pk)]})
 
-        if ad_sender.user != user:
+        if owners[sender_id] != user.id:
             raise ValidationError(
                 "Вы можете отправлять обмены только от своих объявлений (ad_sender)."
             )
 
-        if ad_receiver.user == user:
+        if owners[receiver_id] == user.id:
             raise ValidationError(
                 "Вы не можете отправлять обмены на свои объявления (ad_receiver)."
             )
 
         return data
 
+    def create(self, validated_data):
+        # повтор той же пары (двойной клик, ретрай клиента) — вернуть уже отправленное
+        proposal, self.created = ExchangeProposal.objects.get_or_create_pending(
+            validated_data["ad_sender_id"], validated_data["ad_receiver_id"], validated_data.get("comment")
+        )
+        return proposal
+
+
+class ProposalAdSerializer(serializers.ModelSerializer):
+    """Краткое представление объявления внутри предложения обмена."""
+    user = serializers.ReadOnlyField(source="user.username")
+
+    class Meta:
+        model = Ad
+        fields = ["id", "title", "user", "image"]
+        read_only_fields = fields
+
+
+class ProposalSerializer(serializers.ModelSerializer):
+    """
+    Чтение предложений: обе стороны обмена вложены.
+    Queryset должен делать select_related("ad_sender__user", "ad_receiver__user").
+    """
+    ad_sender = ProposalAdSerializer(read_only=True)
+    ad_receiver = ProposalAdSerializer(read_only=True)
+
+    class Meta:
+        model = ExchangeProposal
+        fields = ["id", "ad_sender", "ad_receiver", "comment", "status", "created_at"]
+        read_only_fields = fields
+
+
+class TradeCycleSerializer(serializers.ModelSerializer):
+    """
+    Обмен по кругу: предложения по порядку, последнее замыкает цикл.
+    Предложения view загружает для всей страницы разом — context["proposals"].
+    """
+    proposals = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TradeCycle
+        fields = ["id", "proposals", "created_at"]
+        read_only_fields = fields
+
+    @extend_schema_field(ProposalSerializer(many=True))
+    def get_proposals(self, obj):
+        loaded = self.context["proposals"]
+        # удалённое после поиска предложение пропускаем — цикл снимет сигнал
+        proposals = [loaded[pk] for pk in obj.proposal_ids if pk in loaded]
+        return ProposalSerializer(proposals, many=True, context=self.context).data
+
 
 class ProposalStatusUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -47,6 +147,16 @@ class ProposalStatusUpdateSerializer(serializers.ModelSerializer):
     
 
 
+class ProposalBulkStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=settings.ADS_BULK_MAX_ITEMS
+    )
+    status = serializers.ChoiceField(choices=["accepted", "rejected"])
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))  # без повторов, порядок как в запросе
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
@@ -59,23 +169,30 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'title']
 
 
+# денормализованные счётчики входящих предложений (ads/counters.py)
+PROPOSAL_COUNTER_FIELDS = ['received_proposals_count', 'pending_proposals_count', 'accepted_proposals_count']
+
+
 class AdSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username')
     tags = TagSerializer(many=True, read_only=True)  # только для чтения
-    tag_ids = serializers.PrimaryKeyRelatedField(
+    tag_ids = PreloadedPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True, write_only=True, required=False
     )
-    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    category = PreloadedPrimaryKeyRelatedField(queryset=Category.objects.all())
     image = serializers.ImageField(required=False, allow_null=True)
+    # {"webp": "url 320w, url 800w", ...} — пусто, пока варианты не готовы
+    srcset = serializers.SerializerMethodField()
     description_length = serializers.SerializerMethodField()
 
     class Meta:
         model = Ad
         fields = [
             'id', 'user', 'title', 'description', 'description_length',
-            'image', 'category', 'condition', 'tags', 'tag_ids', 'created_at',
+            'image', 'srcset', 'category', 'condition', 'tags', 'tag_ids', 'created_at',
+            *PROPOSAL_COUNTER_FIELDS,
         ]
-        read_only_fields = ['id', 'user', 'created_at']
+        read_only_fields = ['id', 'user', 'created_at', *PROPOSAL_COUNTER_FIELDS]
 
     def validate_title(self, value):
         if len(value) < 10:
@@ -92,6 +209,9 @@ class AdSerializer(serializers.ModelSerializer):
     def get_description_length(self, obj):
         return len(obj.description) if obj.description else 0
 
+    def get_srcset(self, obj):
+        return build_srcset(obj, self.context.get('request'))
+
     def create(self, validated_data):
         tags_data = validated_data.pop('tag_ids', [])
         ad = Ad.objects.create(**validated_data)
@@ -111,6 +231,59 @@ class AdSerializer(serializers.ModelSerializer):
         return instance
 
 
+class AdListSerializer(serializers.ModelSerializer):
+    """
+    Облегчённое представление для GET /ads/: без полного описания.
+    Работает только с Ad.objects.for_list() — все поля уже в аннотациях.
+    """
+    user = serializers.ReadOnlyField(source='username')
+    description_length = serializers.IntegerField(read_only=True, default=0)
+    tags = serializers.ListField(source='tag_list', read_only=True)
+    srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Ad
+        fields = [
+            'id', 'user', 'title', 'description_length',
+            'image', 'srcset', 'category', 'condition', 'tags', 'created_at',
+            *PROPOSAL_COUNTER_FIELDS,
+        ]
+        read_only_fields = fields
+
+    def get_srcset(self, obj):
+        return build_srcset(obj, self.context.get('request'))
+
+
+class AdExportSerializer(AdListSerializer):
+    """Строка выгрузки /ads/export/: то же, что в списке, плюс описание."""
+
+    class Meta(AdListSerializer.Meta):
+        fields = AdListSerializer.Meta.fields[:4] + ['description'] + AdListSerializer.Meta.fields[4:]
+        read_only_fields = fields
+
+
+class UserProposalStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserProposalStats
+        fields = [
+            'received_count', 'pending_received_count', 'accepted_received_count',
+            'sent_count', 'pending_sent_count',
+        ]
+        read_only_fields = fields
+
+
+class AdMatchSerializer(serializers.ModelSerializer):
+    """Кандидат на обмен для /ads/{id}/matches/, queryset — ads.matches.matches_for()."""
+    ad = ProposalAdSerializer(source='candidate', read_only=True)
+    category = serializers.ReadOnlyField(source='candidate.category.title')
+    condition = serializers.ReadOnlyField(source='candidate.condition')
+
+    class Meta:
+        model = AdMatch
+        fields = ['ad', 'category', 'condition', 'score', 'shared_tags']
+        read_only_fields = fields
+
+
 class PostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
@@ -1,6 +1,31 @@
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Ad
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .cache import invalidate_ad, invalidate_ads, invalidate_reference_data
+from .counters import proposal_changed
+from .cycles import drop_cycles
+from .images import needs_processing, release_image, retain_image, schedule_image_processing
+from .matches import schedule_refresh
+from .models import Ad, Category, ExchangeProposal, Tag
+from .outbox import ad_payload, proposal_payload, record_event
+from .token_blacklist import blacklist_filter
+
+
+@receiver(pre_save, sender=Ad)
+def remember_previous_image(sender, instance, update_fields=None, **kwargs):
+    # новое имя файла станет известно только после сохранения — сравним в post_save.
+    # Загружаемый файл ссылку берёт сам (ContentAddressedStorage.save)
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    if instance._state.adding:
+        instance._previous_image = None
+    elif update_fields is not None and "image" not in update_fields:
+        instance._previous_image = instance.image.name or None
+    else:
+        instance._previous_image = (
+            Ad.objects.filter(pk=instance.pk).values_list("image", flat=True).first() or None
+        )
 
 
 @receiver(post_save, sender=Ad)
@@ -10,9 +35,76 @@ def ad_created_or_updated(sender, instance, created, **kwargs):
         # например: отправить email/уведомление
     else:
         print(f"✏️ Объявление обновлено: '{instance.title}'")
+    # Ad.save атомарен — событие попадёт в outbox вместе с изменением
+    record_event("ad.created" if created else "ad.updated", ad_payload(instance))
+    invalidate_ad(instance.pk)
+    if not created and instance.category_id != getattr(instance, "_loaded_category_id", None):
+        schedule_refresh([instance.pk])  # категория входит в вектор похожести
+    previous, current = getattr(instance, "_previous_image", None), instance.image.name or None
+    uploaded = getattr(instance, "_image_uploaded", False)
+    if previous != current:
+        if current and not uploaded:
+            retain_image(current)
+        if previous:
+            release_image(previous)
+    elif uploaded:
+        release_image(current)  # загрузили тот же файл заново — ссылка у объявления уже была
+    if needs_processing(instance):
+        schedule_image_processing(instance.pk)
 
 
 @receiver(post_delete, sender=Ad)
 def ad_deleted(sender, instance, **kwargs):
     print(f"🗑️ Объявление удалено: '{instance.title}' от {instance.user}")
     # например: удалить связанные файлы, логировать и т.п.
+    record_event("ad.deleted", ad_payload(instance))
+    invalidate_ad(instance.pk)
+    if instance.image:
+        release_image(instance.image.name)  # файл удалится вместе с последней ссылкой
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def proposal_created_or_updated(sender, instance, created, **kwargs):
+    record_event("proposal.created" if created else "proposal.updated", proposal_payload(instance))
+    old_status = None if created else getattr(instance, "_loaded_status", instance.status)
+    if old_status != instance.status:
+        proposal_changed(instance, old_status, instance.status)
+        if old_status == "pending":
+            drop_cycles([instance.pk])
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def proposal_deleted(sender, instance, **kwargs):
+    record_event("proposal.deleted", proposal_payload(instance))
+    proposal_changed(instance, instance.status, None)
+    if instance.status == "pending":
+        drop_cycles([instance.pk])
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created, **kwargs):
+    if created:
+        jti, expires_at = instance.token.jti, instance.token.expires_at
+        transaction.on_commit(lambda: blacklist_filter.added(jti, expires_at))
+
+
+@receiver(m2m_changed, sender=Ad.tags.through)
+def ad_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        invalidate_ad(instance.pk)
+        schedule_refresh([instance.pk])
+    elif pk_set:
+        # tag.ads.add(...) — instance это Tag, pk_set — объявления
+        invalidate_ads(pk_set)
+        schedule_refresh(pk_set)
+    else:
+        # tag.ads.clear(): какие объявления затронуты, уже не узнать
+        invalidate_reference_data()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Tag)
+def reference_data_changed(sender, instance, **kwargs):
+    invalidate_reference_data()
@@ -0,0 +1,53 @@
+"""
+Хранилище картинок объявлений с адресацией по содержимому.
+
+Имя файла — sha256 содержимого, разложенный по двум уровням каталогов:
+
+    ads_images/photo.jpg  ->  ads_images/3f/a2/3fa2…c9.jpg
+
+В одном каталоге не больше 256 подкаталогов, а одинаковые загрузки
+сохраняются один раз. Сколько объявлений ссылается на файл, считает
+StoredImage (ads/images.py: retain_image / release_image) — файл удаляется
+только вместе с последней ссылкой.
+
+save() сам берёт ссылку на файл: +1 к StoredImage держит блокировку строки
+до коммита, и release_image, удаляющий файл под той же блокировкой, не
+сотрёт файл, который только что переиспользовала новая загрузка.
+"""
+
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible(path="ads.storage.ContentAddressedStorage")
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, hexdigest[:2], hexdigest[2:4], hexdigest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        from .images import retain_image  # images -> models -> storage
+
+        with transaction.atomic():
+            retain_image(name)
+            # файл уже есть — переиспользуем; нет (или его удалили, пока мы ждали
+            # блокировку) — пишем под тем же именем, а не под свободным соседним
+            if not self.exists(name):
+                self._save(name, content)
+        return name
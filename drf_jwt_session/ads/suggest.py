@@ -0,0 +1,64 @@
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+
+from .models import Ad, Tag
+
+SUGGEST_MIN_LENGTH = 2
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+
+
+def suggest_ads(text, limit=SUGGEST_DEFAULT_LIMIT):
+    """
+    Подсказки заголовков для type-ahead. Оператор %> (word_similarity)
+    идёт по GIN-индексу gin_trgm_ops, поэтому находит «айфо» в «Айфон 14»
+    без скана таблицы.
+    """
+    return list(
+        Ad.objects.filter(title__trigram_word_similar=text)
+        .annotate(similarity=TrigramWordSimilarity(text, "title"))
+        .order_by("-similarity", "-created_at")
+        .values("id", "title", "similarity")[:limit]
+    )
+
+
+def suggest_tags(text, limit=SUGGEST_DEFAULT_LIMIT):
+    return list(
+        Tag.objects.filter(name__trigram_word_similar=text)
+        .annotate(similarity=TrigramWordSimilarity(text, "name"))
+        .order_by("-similarity", "name")
+        .values("id", "name", "similarity")[:limit]
+    )
+
+
+def did_you_mean(text):
+    """
+    Исправление опечатки: ближайшее по similarity имя тега.
+    Теги — короткий словарь ключевых слов, поэтому подходят лучше заголовков.
+    None, если запрос и так совпадает с тегом или похожих нет.
+    """
+    tag = (
+        Tag.objects.filter(name__trigram_similar=text)
+        .annotate(similarity=TrigramSimilarity("name", text))
+        .order_by("-similarity", "name")
+        .values_list("name", flat=True)
+        .first()
+    )
+    if tag is None or tag.lower() == text.lower():
+        return None
+    return tag
+
+
+def parse_suggest_params(query_params):
+    """
+    Достаёт (q, limit) из query-параметров. Слишком короткий запрос даёт
+    q=None — на одну букву подсказки бессмысленны и дорого стоят.
+    """
+    text = query_params.get("q", "").strip()
+    try:
+        limit = int(query_params.get("limit", SUGGEST_DEFAULT_LIMIT))
+    except ValueError:
+        limit = SUGGEST_DEFAULT_LIMIT
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+    if len(text) < SUGGEST_MIN_LENGTH:
+        return None, limit
+    return text, limit
@@ -1,11 +1,76 @@
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.runner import compare_with_baseline, run_in_process, select_endpoints, summarize
+from benchmarks.seeding import BENCH_USER_PREFIX, seed
 from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
-from django.test import Client, TestCase
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.test import AsyncClient, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
-
-from ads.models import Ad, ExchangeProposal
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from ads.api_views import AdViewSet
+from ads.authentication import (
+    ClaimsJWTAuthentication,
+    ClaimsTokenRefreshSerializer,
+    VerifiedTokenCache,
+    verified_tokens,
+)
+from ads.budgets import QueryBudget, QueryBudgetExceeded, assert_query_budgets
+from ads.bulk import DUPLICATE_TITLE_ERROR, FREED_LATER_TITLE_ERROR
+from ads.counters import reconcile_all
+from ads.cycles import ProposalGraph, find_cycles
+from ads.facets import facet_counts
+from ads.filters import tag_ids_by_name
+from ads.images import release_image
+from ads.matches import rebuild_matches, refresh_matches
+from ads.middleware import QueryStats
+from ads.models import (
+    Ad,
+    AdMatch,
+    Category,
+    ExchangeProposal,
+    ExchangeProposalQuerySet,
+    OutboxEvent,
+    StoredImage,
+    Tag,
+    TradeCycle,
+    UserProposalStats,
+    WebhookDelivery,
+    WebhookEndpoint,
+)
+from ads.reference import reference_data
+from ads.reference import reset as reset_reference_data
+from ads.routers import ReadRoute, _health, _read_route, check_replica_settings, replica_lag
+from ads.serializers import AdSerializer
+from ads.throttling import SharedScopedRateThrottle, SharedUserRateThrottle, check_throttle_settings
+from ads.token_blacklist import BLACKLISTED_KEY, BloomFilter, blacklist_filter
+from ads.transitions import change_status
+from ads.webhooks import dispatch_once
 
 from .forms import AdForm
 
@@ -686,3 +751,1979 @@ class ProposalStatusUpdateViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.proposal.refresh_from_db()
         self.assertEqual(self.proposal.status, "rejected")
+
+
+class AdCursorPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        for i in range(25):
+            Ad.objects.create(
+                user=self.user,
+                title=f"Объявление {i}",
+                description="Desc",
+                category=self.category,
+                condition="new",
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_walks_all_pages_without_duplicates(self):
+        url = reverse("ad-list")
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)  # никакого COUNT(*)
+            seen.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        expected = list(Ad.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_respects_ordering_param(self):
+        response = self.client.get(reverse("ad-list"), {"ordering": "title", "page_size": 5})
+        titles = [item["title"] for item in response.data["results"]]
+        self.assertEqual(titles, sorted(titles))
+        self.assertEqual(len(titles), 5)
+
+
+class AdFullTextSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        self.category = Category.objects.create(title="Разное")
+        self.phone = Ad.objects.create(
+            user=self.user,
+            title="Продаю телефоны Samsung",
+            description="Отличное состояние, телефон почти новый",
+            category=self.category,
+            condition="used",
+        )
+        self.book = Ad.objects.create(
+            user=self.user,
+            title="Old books collection",
+            description="Classic novels, one of them mentions a phone",
+            category=self.category,
+            condition="used",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_russian_morphology(self):
+        response = self.client.get(reverse("ad-list"), {"search": "телефон"})
+        ids = [item["id"] for item in response.data["results"]]
+        self.assertEqual(ids, [self.phone.id])
+
+    def test_english_and_rank_ordering(self):
+        Ad.objects.create(
+            user=self.user,
+            title="Phone charger for phones",
+            description="Phone accessories",
+            category=self.category,
+            condition="new",
+        )
+        response = self.client.get(reverse("ad-list"), {"search": "phones"})
+        titles = [item["title"] for item in response.data["results"]]
+        self.assertEqual(titles, ["Phone charger for phones", "Old books collection"])
+
+    def test_vector_follows_updates(self):
+        self.book.title = "Телефон в подарок к книгам"
+        self.book.save()
+        response = self.client.get(reverse("ad-list"), {"search": "подарок"})
+        self.assertEqual([item["id"] for item in response.data["results"]], [self.book.id])
+
+    def test_html_search_uses_full_text(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("ad_search"), {"q": "телефоны"})
+        self.assertEqual(list(response.context["page_obj"].object_list), [self.phone])
+
+
+class SuggestTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        category = Category.objects.create(title="Разное")
+        for title in ["Айфон 14 Pro", "Айфон 12 mini", "Велосипед горный"]:
+            Ad.objects.create(
+                user=self.user, title=title, description="Desc", category=category, condition="used"
+            )
+        for name in ["телефоны", "велосипеды", "книги"]:
+            Tag.objects.create(name=name)
+        self.client.force_authenticate(user=self.user)
+
+    def test_ads_suggest_by_prefix(self):
+        response = self.client.get(reverse("ad-suggest"), {"q": "айфо"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = {item["title"] for item in response.data["results"]}
+        self.assertEqual(titles, {"Айфон 14 Pro", "Айфон 12 mini"})
+
+    def test_ads_suggest_did_you_mean(self):
+        response = self.client.get(reverse("ad-suggest"), {"q": "телефоно"})
+        self.assertEqual(response.data["did_you_mean"], "телефоны")
+
+    def test_short_query_returns_nothing(self):
+        response = self.client.get(reverse("ad-suggest"), {"q": "а"})
+        self.assertEqual(response.data, {"results": [], "did_you_mean": None})
+
+    def test_tags_suggest(self):
+        response = self.client.get(reverse("tag-suggest"), {"q": "вело", "limit": 1})
+        self.assertEqual([item["name"] for item in response.data["results"]], ["велосипеды"])
+        self.assertIsNone(response.data["did_you_mean"])
+
+
+class AdResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        self.category = Category.objects.create(title="Разное")
+        self.tag = Tag.objects.create(name="книги")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad = Ad.objects.create(
+                user=self.user,
+                title="Собрание сочинений",
+                description="Desc",
+                category=self.category,
+                condition="used",
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_repeated_list_is_served_from_cache(self):
+        url = reverse("ad-list")
+        self.assertEqual(self.client.get(url, {"condition": "used"})["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {"condition": "used"})
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(response.data["results"][0]["id"], self.ad.id)
+
+    def test_update_evicts_detail_and_lists(self):
+        detail_url = reverse("ad-detail", kwargs={"pk": self.ad.pk})
+        self.client.get(detail_url)
+        self.client.get(reverse("ad-list"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ad.objects.filter(pk=self.ad.pk).first().save()
+        self.assertEqual(self.client.get(detail_url)["X-Cache"], "MISS")
+        self.assertEqual(self.client.get(reverse("ad-list"))["X-Cache"], "MISS")
+
+    def test_tags_change_evicts_detail(self):
+        detail_url = reverse("ad-detail", kwargs={"pk": self.ad.pk})
+        self.client.get(detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.tags.add(self.tag)
+        response = self.client.get(detail_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["tags"], [{"id": self.tag.id, "name": "книги"}])
+
+    def test_other_ad_detail_survives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Ad.objects.create(
+                user=self.user,
+                title="Другое объявление",
+                description="Desc",
+                category=self.category,
+                condition="new",
+            )
+        detail_url = reverse("ad-detail", kwargs={"pk": self.ad.pk})
+        self.client.get(detail_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        self.assertEqual(self.client.get(detail_url)["X-Cache"], "HIT")
+
+
+class AdListQueryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        category = Category.objects.create(title="Разное")
+        tags = [Tag.objects.create(name=name) for name in ("б-тег", "а-тег")]
+        for i in range(15):
+            ad = Ad.objects.create(
+                user=self.user,
+                title=f"Объявление номер {i}",
+                description="x" * i,
+                category=category,
+                condition="new",
+            )
+            ad.tags.set(tags if i % 2 else [])
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_is_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("ad-list"), {"page_size": 15})
+        self.assertEqual(len(response.data["results"]), 15)
+
+    def test_list_representation(self):
+        response = self.client.get(reverse("ad-list"), {"search": "номер 3"})
+        item = next(i for i in response.data["results"] if i["title"] == "Объявление номер 3")
+        self.assertNotIn("description", item)
+        self.assertEqual(item["description_length"], 3)
+        self.assertEqual(item["user"], "user")
+        self.assertEqual([tag["name"] for tag in item["tags"]], ["а-тег", "б-тег"])
+
+        response = self.client.get(reverse("ad-list"), {"page_size": 15})
+        untagged = next(i for i in response.data["results"] if i["title"] == "Объявление номер 2")
+        self.assertEqual(untagged["tags"], [])
+
+
+class ProposalQueryCountTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.receiver = User.objects.create_user(username="receiver", password="pass1234")
+        self.category = Category.objects.create(title="Разное")
+        self.receiver_ad = self._ad(self.receiver, "Объявление получателя")
+
+    def _ad(self, user, title):
+        return Ad.objects.create(
+            user=user, title=title, description="Desc", category=self.category, condition="new"
+        )
+
+    def _add_proposals(self, count):
+        for i in range(count):
+            sender = User.objects.create_user(username=f"sender{User.objects.count()}")
+            ExchangeProposal.objects.create(
+                ad_sender=self._ad(sender, f"Объявление отправителя {sender.pk}"),
+                ad_receiver=self.receiver_ad,
+            )
+
+    def _count_list_queries(self, url_name, user):
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name), {"page_size": 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries), response
+
+    def test_to_me_query_count_does_not_grow(self):
+        self._add_proposals(2)
+        small, _ = self._count_list_queries("proposals-to-me", self.receiver)
+        self._add_proposals(10)
+        large, response = self._count_list_queries("proposals-to-me", self.receiver)
+        self.assertEqual(small, large)
+        self.assertEqual(large, 1)
+        self.assertEqual(len(response.data["results"]), 12)
+
+        item = response.data["results"][0]
+        self.assertEqual(item["ad_receiver"]["title"], "Объявление получателя")
+        self.assertEqual(item["ad_receiver"]["user"], "receiver")
+        self.assertTrue(item["ad_sender"]["user"].startswith("sender"))
+        self.assertIn("image", item["ad_sender"])
+
+    def test_from_me_query_count(self):
+        sender = User.objects.create_user(username="sender")
+        for i in range(5):
+            ExchangeProposal.objects.create(
+                ad_sender=self._ad(sender, f"Моё объявление {i}"), ad_receiver=self.receiver_ad
+            )
+        count, response = self._count_list_queries("proposals-from-me", sender)
+        self.assertEqual(count, 1)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_create_does_not_load_owners(self):
+        sender = User.objects.create_user(username="sender")
+        sender_ad = self._ad(sender, "Моё объявление")
+        # обычный случай: строки сводки у обоих уже есть
+        UserProposalStats.objects.create(user=sender)
+        UserProposalStats.objects.create(user=self.receiver)
+        self.client.force_authenticate(user=sender)
+        # один SELECT владельцев обоих объявлений + INSERT … ON CONFLICT, событие
+        # в outbox и три UPDATE счётчиков (объявление, получатель, отправитель)
+        # в одной транзакции (в тесте — SAVEPOINT/RELEASE). Было 9: объявления
+        # читались двумя запросами
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                reverse("proposals-create"),
+                {"ad_sender": sender_ad.pk, "ad_receiver": self.receiver_ad.pk},
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_status_update_query_count(self):
+        self._add_proposals(1)
+        proposal = ExchangeProposal.objects.get()
+        self.client.force_authenticate(user=self.receiver)
+        # SELECT предложения вместе с ad_receiver (права), SELECT … FOR UPDATE
+        # его и конкурентов, условный UPDATE, три UPDATE счётчиков и событие
+        # в outbox (в тесте — ещё SAVEPOINT/RELEASE). Блокирующий SELECT
+        # добавился с race-free переходами (ads/transitions.py): было 8
+        with self.assertNumQueries(9):
+            response = self.client.patch(
+                reverse("proposal-status-update", kwargs={"pk": proposal.pk}),
+                {"status": "accepted"},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="pass1234")
+        other = User.objects.create_user(username="other", password="pass1234")
+        category = Category.objects.create(title="Разное")
+        tags = [Tag.objects.create(name=name) for name in ("книги", "телефоны", "велосипеды")]
+        ads = []
+        for i in range(6):
+            ad = Ad.objects.create(
+                user=self.user if i % 2 else other,
+                title=f"Объявление номер {i}",
+                description="Desc",
+                category=category,
+                condition="new",
+            )
+            ad.tags.set(tags[: i % 3 + 1])
+            ads.append(ad)
+        for sender, receiver in zip(ads[::2], ads[1::2]):
+            ExchangeProposal.objects.create(ad_sender=sender, ad_receiver=receiver)
+            ExchangeProposal.objects.create(ad_sender=receiver, ad_receiver=sender)
+        self.ad = ads[0]
+
+        self.client = APIClient()
+        self.client.force_login(self.user)  # HTML-страницы
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")  # API
+
+    def test_all_routes_hold(self):
+        report = assert_query_budgets(self.client, url_kwargs={"pk": self.ad.pk})
+        for url in ("/", "/ads/", f"/ads/{self.ad.pk}/", "/proposals/to-me/", "/tags/"):
+            self.assertIn(url, report.checked)
+        self.assertIn("tag-list", report.unbudgeted)  # проверен бюджетом по умолчанию
+        self.assertNotIn("ad-list", report.unbudgeted)
+        self.assertNotIn("ad-bulk", report.unbudgeted + report.skipped)  # без GET
+        self.assertEqual(report.skipped, [])
+
+    def test_unbudgeted_route_checked_by_default_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "бюджет по умолчанию"):
+            assert_query_budgets(self.client, {"pk": self.ad.pk}, default_budget=QueryBudget(0, None))
+
+    def test_routes_without_url_kwargs_reported(self):
+        report = assert_query_budgets(self.client)
+        self.assertIn("ad-detail", report.skipped)
+        self.assertNotIn(f"/ads/{self.ad.pk}/", report.checked)
+
+    def test_exceeded_budget_raises(self):
+        with mock.patch.dict(AdViewSet.query_budgets, {"list": QueryBudget(queries=0)}):
+            with self.settings(QUERY_BUDGET_MODE="raise"):
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get(reverse("ad-list"))
+
+
+class AdBulkTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        self.tags = [Tag.objects.create(name=name) for name in ("фантастика", "детектив")]
+        self.url = reverse("ad-bulk")
+        self.client.force_authenticate(user=self.user)
+
+    def _item(self, title, **extra):
+        return {
+            "title": title,
+            "description": "Desc",
+            "category": self.category.pk,
+            "condition": "used",
+            **extra,
+        }
+
+    def test_bulk_create_with_tags(self):
+        items = [
+            self._item(f"Книга номер {i}", tag_ids=[tag.pk for tag in self.tags])
+            for i in range(30)
+        ]
+        # категории, теги, занятые заголовки + на чанк: INSERT ads, INSERT tags,
+        # INSERT outbox и savepoint
+        with self.assertNumQueries(8):
+            response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["succeeded"], 30)
+        ad = Ad.objects.get(pk=response.data["results"][0]["id"])
+        self.assertEqual(ad.user, self.user)
+        self.assertEqual(ad.tags.count(), 2)
+
+    def test_partial_failure(self):
+        Ad.objects.create(
+            user=self.user,
+            title="Уже есть такая",
+            description="D",
+            category=self.category,
+            condition="new",
+        )
+        items = [
+            self._item("Нормальная книга"),
+            self._item("Коротко"),
+            self._item("Уже есть такая"),
+            self._item("Нормальная книга"),
+            self._item("Неизвестный тег тут", tag_ids=[999999]),
+        ]
+        response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        statuses = [result["status"] for result in response.data["results"]]
+        self.assertEqual(statuses, ["created", "error", "error", "error", "error"])
+        self.assertIn("tag_ids", response.data["results"][4]["errors"])
+        self.assertEqual(Ad.objects.filter(user=self.user).count(), 2)
+
+    def test_bulk_update_and_delete(self):
+        items = [self._item(f"Книга номер {i}") for i in range(3)]
+        response = self.client.post(self.url, items, format="json")
+        ids = [result["id"] for result in response.data["results"]]
+        foreign = Ad.objects.create(
+            user=User.objects.create_user(username="other"),
+            title="Чужая книга",
+            description="D",
+            category=self.category,
+            condition="new",
+        )
+
+        response = self.client.patch(
+            self.url,
+            [
+                {"id": ids[0], "condition": "new", "tag_ids": [self.tags[0].pk]},
+                {"id": foreign.pk, "condition": "new"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        ad = Ad.objects.get(pk=ids[0])
+        self.assertEqual(ad.condition, "new")
+        self.assertEqual(list(ad.tags.all()), [self.tags[0]])
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.condition, "new")  # создано таким, не изменено нами
+
+        response = self.client.delete(self.url, ids[:2] + [foreign.pk], format="json")
+        statuses = [result["status"] for result in response.data["results"]]
+        self.assertEqual(statuses, ["deleted", "deleted", "error"])
+        self.assertTrue(Ad.objects.filter(pk=foreign.pk).exists())
+        self.assertEqual(Ad.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_update_title_taken_by_ad_in_same_batch(self):
+        items = [self._item(f"Книга номер {letter}") for letter in "ABC"]
+        response = self.client.post(self.url, items, format="json")
+        a, b, c = [result["id"] for result in response.data["results"]]
+
+        response = self.client.patch(
+            self.url,
+            [
+                {"id": a, "title": "Книга номер B"},  # B в пакете, но заголовок не меняет
+                {"id": b, "title": "Книга номер B", "condition": "new"},
+                {"id": c, "title": "Книга номер A"},  # A освобождается, но переименование A отклонено
+            ],
+            format="json",
+        )
+        statuses = [result["status"] for result in response.data["results"]]
+        self.assertEqual(statuses, ["error", "updated", "error"])
+        self.assertEqual(response.data["results"][0]["errors"]["title"], [DUPLICATE_TITLE_ERROR])
+        self.assertEqual(Ad.objects.get(pk=b).condition, "new")
+
+        response = self.client.patch(
+            self.url, [{"id": a, "title": "Книга номер D"}, {"id": c, "title": "Книга номер A"}], format="json"
+        )
+        statuses = [result["status"] for result in response.data["results"]]
+        self.assertEqual(statuses, ["updated", "updated"])
+        titles = sorted(Ad.objects.filter(user=self.user).values_list("title", flat=True))
+        self.assertEqual(titles, ["Книга номер A", "Книга номер B", "Книга номер D"])
+
+    def test_bulk_update_swaps_titles(self):
+        items = [self._item(f"Книга номер {letter}") for letter in "ABC"]
+        a, b, c = [result["id"] for result in self.client.post(self.url, items, format="json").data["results"]]
+
+        response = self.client.patch(
+            self.url,
+            [
+                {"id": a, "title": "Книга номер B"},
+                {"id": b, "title": "Книга номер C"},
+                {"id": c, "title": "Книга номер A"},
+            ],
+            format="json",
+        )
+        self.assertEqual([result["status"] for result in response.data["results"]], ["updated"] * 3)
+        titles = dict(Ad.objects.filter(user=self.user).values_list("pk", "title"))
+        self.assertEqual(titles, {a: "Книга номер B", b: "Книга номер C", c: "Книга номер A"})
+
+    @override_settings(ADS_BULK_CHUNK_SIZE=1)
+    def test_bulk_update_title_freed_in_later_chunk(self):
+        items = [self._item(f"Книга номер {letter}") for letter in "AB"]
+        a, b = [result["id"] for result in self.client.post(self.url, items, format="json").data["results"]]
+
+        response = self.client.patch(
+            self.url, [{"id": a, "title": "Книга номер B"}, {"id": b, "title": "Книга номер D"}], format="json"
+        )
+        self.assertEqual([result["status"] for result in response.data["results"]], ["error", "updated"])
+        self.assertEqual(response.data["results"][0]["errors"]["title"], [FREED_LATER_TITLE_ERROR])
+        titles = dict(Ad.objects.filter(user=self.user).values_list("pk", "title"))
+        self.assertEqual(titles, {a: "Книга номер A", b: "Книга номер D"})
+
+    def test_rejects_non_list_payload(self):
+        response = self.client.post(self.url, {"title": "Не массив"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AdExportTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        tag = Tag.objects.create(name="фантастика")
+        for i in range(5):
+            ad = Ad.objects.create(
+                user=self.user,
+                title=f"Книга {i}",
+                description="Полное описание",
+                category=self.category,
+                condition="new" if i % 2 else "used",
+            )
+            ad.tags.add(tag)
+        self.url = reverse("ad-export")
+        self.client.force_authenticate(user=self.user)
+
+    def _content(self, response):
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson_by_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("application/x-ndjson"))
+        rows = [json.loads(line) for line in self._content(response).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["title"], "Книга 4")  # новые сначала
+        self.assertEqual(rows[0]["description"], "Полное описание")
+        self.assertEqual(rows[0]["tags"][0]["name"], "фантастика")
+
+    def test_json_array_with_filters(self):
+        response = self.client.get(self.url, {"format": "json", "condition": "new"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = json.loads(self._content(response))
+        self.assertEqual({row["title"] for row in rows}, {"Книга 1", "Книга 3"})
+
+    def test_empty_json_export_is_valid(self):
+        response = self.client.get(self.url, {"format": "json", "user__username": "nobody"})
+        self.assertEqual(json.loads(self._content(response)), [])
+
+
+class AsyncReadEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        self.other = User.objects.create_user(username="buyer", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        tag = Tag.objects.create(name="фантастика")
+        self.ads = []
+        for i in range(3):
+            ad = Ad.objects.create(
+                user=self.user,
+                title=f"Книга {i}",
+                description="Описание",
+                category=self.category,
+                condition="new",
+            )
+            ad.tags.add(tag)
+            self.ads.append(ad)
+        other_ad = Ad.objects.create(
+            user=self.other, title="Чужая", description="D", category=self.category, condition="used"
+        )
+        ExchangeProposal.objects.create(ad_sender=other_ad, ad_receiver=self.ads[0])
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def test_same_payload_as_sync_endpoints(self):
+        for sync_url, async_url in [
+            (reverse("ad-list"), reverse("async-ad-list")),
+            (reverse("ad-recent"), reverse("async-ad-recent")),
+            (reverse("ad-detail", args=[self.ads[1].pk]), reverse("async-ad-detail", args=[self.ads[1].pk])),
+            (reverse("proposals-to-me"), reverse("async-proposals-to-me")),
+        ]:
+            expected = self.client.get(sync_url, {"page_size": 2}, **self.auth).json()
+            response = self.client.get(async_url, {"page_size": 2}, **self.auth)
+            self.assertEqual(response.status_code, 200, async_url)
+            data = response.json()
+            if isinstance(data, dict) and "next" in data:
+                # в курсоре другой путь, сравниваем только страницу
+                self.assertEqual(bool(data["next"]), bool(expected["next"]))
+                data, expected = data["results"], expected["results"]
+            self.assertEqual(data, expected, async_url)
+
+    def test_filters_and_cursor(self):
+        response = self.client.get(reverse("async-ad-list"), {"page_size": 2}, **self.auth).json()
+        self.assertEqual([ad["title"] for ad in response["results"]], ["Чужая", "Книга 2"])
+        second = self.client.get(response["next"], **self.auth).json()
+        self.assertEqual([ad["title"] for ad in second["results"]], ["Книга 1", "Книга 0"])
+
+        response = self.client.get(reverse("async-ad-list"), {"condition": "used"}, **self.auth)
+        self.assertEqual([ad["title"] for ad in response.json()["results"]], ["Чужая"])
+
+    def test_cursors_match_sync_paginator(self):
+        # страницы вперёд и назад, с сортировкой и без: курсоры побайтно как у /ads/
+        def cursors(url, params):
+            pages, data = [], self.client.get(url, params, **self.auth).json()
+            while True:
+                links = {
+                    key: parse_qs(urlsplit(data[key]).query) if data[key] else None
+                    for key in ("next", "previous")
+                }
+                pages.append(([ad["id"] for ad in data["results"]], links))
+                if not data["next"] or len(pages) > 5:
+                    break
+                data = self.client.get(data["next"], **self.auth).json()
+            data = self.client.get(data["previous"], **self.auth).json()
+            pages.append(([ad["id"] for ad in data["results"]], data["previous"] is None))
+            return pages
+
+        for params in ({"page_size": 1}, {"page_size": 2, "ordering": "title"}):
+            self.assertEqual(
+                cursors(reverse("async-ad-list"), params),
+                cursors(reverse("ad-list"), params),
+                params,
+            )
+
+    def test_requires_valid_jwt(self):
+        response = self.client.get(reverse("async-ad-list"))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("WWW-Authenticate", response)
+
+        response = self.client.get(reverse("async-ad-list"), HTTP_AUTHORIZATION="Bearer broken")
+        self.assertEqual(response.status_code, 401)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse("async-ad-list"), **self.auth)
+        self.assertEqual(response.status_code, 401)
+
+    def test_not_found(self):
+        response = self.client.get(reverse("async-ad-detail", args=[0]), **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_client(self):
+        client = AsyncClient()
+        # middleware бюджета тоже работает в async-режиме
+        with override_settings(QUERY_BUDGET_MODE="raise"):
+            response = await client.get(
+                reverse("async-proposals-to-me"),
+                headers={"Authorization": self.auth["HTTP_AUTHORIZATION"]},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-DB-Queries"], "2")
+        self.assertEqual(len(response.json()["results"]), 1)
+
+
+class AdImageTestMixin:
+    """Картинки пишутся во временный MEDIA_ROOT и обрабатываются синхронно."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, ADS_IMAGE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        self.client.force_authenticate(user=self.user)
+
+    def _jpeg(self, size=(1200, 900)):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera"  # Make
+        exif[0x0112] = 1  # Orientation
+        buffer = BytesIO()
+        Image.new("RGB", size, "red").save(buffer, "JPEG", exif=exif)
+        return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+    def _open(self, name):
+        ad_image = Ad._meta.get_field("image")
+        with ad_image.storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+        return image
+
+
+class AdImageVariantsTests(AdImageTestMixin, APITestCase):
+    def test_upload_builds_variants_and_strips_exif(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("ad-list"),
+                {
+                    "title": "Книга с фото",
+                    "description": "D",
+                    "category": self.category.pk,
+                    "condition": "new",
+                    "image": self._jpeg(),
+                },
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ad = Ad.objects.get(pk=response.data["id"])
+
+        self.assertEqual(ad.image_variants["source"], ad.image.name)
+        webp = [v for v in ad.image_variants["variants"] if v["format"] == "webp"]
+        self.assertEqual([(v["width"], v["height"]) for v in webp], [(320, 240), (800, 600)])
+        self.assertFalse(self._open(webp[0]["name"]).getexif())
+        self.assertFalse(self._open(ad.image.name).getexif())
+
+        data = self.client.get(reverse("ad-detail", args=[ad.pk])).data
+        self.assertIn("/thumb.webp 320w", data["srcset"]["webp"])
+        self.assertIn("/medium.webp 800w", data["srcset"]["webp"])
+        listed = self.client.get(reverse("ad-list")).data["results"][0]
+        self.assertEqual(listed["srcset"], data["srcset"])
+
+    def test_backfill_command(self):
+        ad = Ad.objects.create(
+            user=self.user,
+            title="Старое объявление",
+            description="D",
+            category=self.category,
+            condition="used",
+            image=self._jpeg(size=(200, 100)),
+        )  # on_commit в тесте не выполняется — вариантов пока нет
+        self.assertEqual(ad.image_variants, {})
+
+        out = StringIO()
+        call_command("backfill_image_variants", workers=0, stdout=out)
+        self.assertIn("Готово: 1", out.getvalue())
+        ad.refresh_from_db()
+        # маленький оригинал: один размер, без дублей ширины в srcset
+        variants = ad.image_variants["variants"]
+        self.assertEqual({v["width"] for v in variants}, {200})
+        self.assertIn("webp", {v["format"] for v in variants})
+
+
+class ContentAddressedImageTests(AdImageTestMixin, APITestCase):
+    def _create(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Ad.objects.create(
+                user=self.user,
+                title=title,
+                description="D",
+                category=self.category,
+                condition="new",
+                image=self._jpeg(),
+            )
+
+    def test_identical_uploads_share_one_file(self):
+        first = self._create("Первое объявление")
+        second = self._create("Второе объявление")
+        storage = Ad._meta.get_field("image").storage
+
+        # после обработки объявления ссылаются на очищенную от EXIF копию под её
+        # собственным хешем — имя читаем из БД, а не из объекта с момента загрузки
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertRegex(first.image.name, r"^ads_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(StoredImage.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(StoredImage.objects.count(), 1)  # ссылки на оригиналы сняты
+        self.assertTrue(first.image_variants)
+        self.assertEqual(second.image_variants, first.image_variants)  # не пересчитывали
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+
+        variant = second.image_variants["variants"][0]["name"]
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+        self.assertFalse(storage.exists(variant))
+        self.assertFalse(StoredImage.objects.exists())
+
+    def test_replacing_image_releases_old_file(self):
+        ad = self._create("Объявление с фото")
+        ad.refresh_from_db()  # очищенная копия, см. выше
+        old_name = ad.image.name
+        ad.image = self._jpeg(size=(640, 480))
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.save()
+        ad.refresh_from_db()
+        self.assertNotEqual(ad.image.name, old_name)
+        self.assertFalse(Ad._meta.get_field("image").storage.exists(old_name))
+        self.assertEqual(list(StoredImage.objects.values_list("name", "refcount")), [(ad.image.name, 1)])
+
+    def test_stripped_original_is_stored_under_its_own_hash(self):
+        ad = self._create("Объявление с EXIF")
+        upload_name = ad.image.name
+        ad.refresh_from_db()
+        storage = Ad._meta.get_field("image").storage
+        self.assertNotEqual(ad.image.name, upload_name)
+        self.assertFalse(storage.exists(upload_name))
+        with storage.open(ad.image.name) as file:
+            content = file.read()
+        self.assertIn(hashlib.sha256(content).hexdigest(), ad.image.name)
+        self.assertFalse(self._open(ad.image.name).getexif())
+        self.assertEqual(ad.image_variants["source"], ad.image.name)
+
+    def test_dedupe_keeps_file_released_in_same_moment(self):
+        ad = self._create("Объявление")
+        ad.refresh_from_db()
+        storage = Ad._meta.get_field("image").storage
+        name = ad.image.name
+        with storage.open(name) as file:
+            content = file.read()
+        with self.captureOnCommitCallbacks(execute=True):
+            release_image(name)  # последняя ссылка — файл удалится после коммита
+            # а до коммита ту же картинку переиспользовала новая загрузка
+            self.assertEqual(storage.save("ads_images/again.jpg", ContentFile(content)), name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=name).refcount, 1)
+
+
+class _WebhookStandIn(BaseHTTPRequestHandler):
+    """Локальный приёмник вебхуков: запоминает тела, отвечает статусами из очереди."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((body, self.headers.get("X-Webhook-Signature")))
+        code = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(code)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboxWebhookTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookStandIn)
+        self.server.received, self.server.statuses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.endpoint = WebhookEndpoint.objects.create(
+            url=f"http://127.0.0.1:{self.server.server_port}/hook", secret="s3cret"
+        )
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        self.category = Category.objects.create(title="Книги")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _create_ad(self, title):
+        return self.client.post(
+            reverse("ad-list"),
+            {"title": title, "description": "D", "category": self.category.pk, "condition": "new"},
+        )
+
+    def test_event_written_in_same_transaction(self):
+        self.assertEqual(self._create_ad("Первая книга").status_code, status.HTTP_201_CREATED)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.event_type, "ad.created")
+        self.assertEqual(event.payload["title"], "Первая книга")
+
+        # не записалось событие — не записалось и объявление
+        with mock.patch("ads.signals.record_event", side_effect=RuntimeError("outbox down")):
+            with self.assertRaises(RuntimeError):
+                self._create_ad("Вторая книга")
+        self.assertFalse(Ad.objects.filter(title="Вторая книга").exists())
+
+    def test_batched_delivery_with_signature(self):
+        self._create_ad("Первая книга")
+        self._create_ad("Вторая книга")
+
+        stats = dispatch_once()
+        self.assertEqual(stats, {"events": 2, "delivered": 2, "failed": 0})
+        self.assertEqual(len(self.server.received), 1)  # оба события одним POST
+        body, signature = self.server.received[0]
+        expected = "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+        self.assertEqual(signature, expected)
+        events = json.loads(body)["events"]
+        self.assertEqual([e["payload"]["title"] for e in events], ["Первая книга", "Вторая книга"])
+        self.assertEqual(dispatch_once(), {"events": 0, "delivered": 0, "failed": 0})
+
+    def test_retry_with_backoff(self):
+        self.server.statuses = [503]
+        self._create_ad("Первая книга")
+
+        self.assertEqual(dispatch_once()["failed"], 1)
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.status, delivery.attempts, delivery.last_error), ("pending", 1, "HTTP 503"))
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+        self.assertEqual(dispatch_once()["delivered"], 0)  # ещё рано
+
+        WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch_once()["delivered"], 1)
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ("delivered", 2))
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self):
+        self.endpoint.url = "http://127.0.0.1:1/unreachable"
+        self.endpoint.save()
+        self._create_ad("Первая книга")
+        dispatch_once()
+        self.assertEqual(WebhookDelivery.objects.get().status, "failed")
+
+
+class ProposalCountersTests(APITestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="pass1234")
+        self.receiver = User.objects.create_user(username="receiver", password="pass1234")
+        self.ad_sender = Ad.objects.create(user=self.sender, title="Ad Sender")
+        self.ad_receiver = Ad.objects.create(user=self.receiver, title="Ad Receiver")
+
+    def _propose(self, status="pending", ad_sender=None):
+        return ExchangeProposal.objects.create(
+            ad_sender=ad_sender or self.ad_sender, ad_receiver=self.ad_receiver, status=status
+        )
+
+    def _ad_counters(self):
+        return Ad.objects.values_list(
+            "received_proposals_count", "pending_proposals_count", "accepted_proposals_count"
+        ).get(pk=self.ad_receiver.pk)
+
+    def _stats(self, user):
+        return UserProposalStats.objects.values_list(
+            "received_count",
+            "pending_received_count",
+            "accepted_received_count",
+            "sent_count",
+            "pending_sent_count",
+        ).get(user=user)
+
+    def test_create_status_change_and_delete(self):
+        first = self._propose()
+        # второе ожидающее предложение той же пары запрещено (unique_pending_proposal) —
+        # шлём с другого объявления того же отправителя
+        self._propose(ad_sender=Ad.objects.create(user=self.sender, title="Ad Sender 2"))
+        self.assertEqual(self._ad_counters(), (2, 2, 0))
+        self.assertEqual(self._stats(self.receiver), (2, 2, 0, 0, 0))
+        self.assertEqual(self._stats(self.sender), (0, 0, 0, 2, 2))
+
+        first.status = "accepted"
+        first.save()
+        first.save()  # повторное сохранение без смены статуса ничего не меняет
+        self.assertEqual(self._ad_counters(), (2, 1, 1))
+        self.assertEqual(self._stats(self.sender), (0, 0, 0, 2, 1))
+
+        loaded = ExchangeProposal.objects.get(pk=first.pk)
+        loaded.status = "rejected"
+        loaded.save()
+        self.assertEqual(self._ad_counters(), (2, 1, 0))
+
+        loaded.delete()
+        self.assertEqual(self._ad_counters(), (1, 1, 0))
+        self.assertEqual(self._stats(self.receiver), (1, 1, 0, 0, 0))
+        self.assertEqual(self._stats(self.sender), (0, 0, 0, 1, 1))
+
+    def test_ad_save_keeps_concurrent_increment(self):
+        stale = Ad.objects.get(pk=self.ad_receiver.pk)
+        self._propose()  # F()-приращение после того, как объявление прочитали
+        stale.title = "Ad Receiver (edited)"
+        stale.save()
+        self.assertEqual(self._ad_counters(), (1, 1, 0))
+        self.assertEqual(Ad.objects.get(pk=self.ad_receiver.pk).title, "Ad Receiver (edited)")
+
+        self.client.force_authenticate(user=self.receiver)
+        self._propose(ad_sender=Ad.objects.create(user=self.sender, title="Ad Sender 2"))
+        response = self.client.patch(
+            reverse("ad-detail", kwargs={"pk": stale.pk}), {"title": "Ad Receiver (api)"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._ad_counters(), (2, 2, 0))
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))
+
+    def test_ad_responses_include_counters(self):
+        self._propose()
+        self.client.force_authenticate(user=self.receiver)
+        response = self.client.get(reverse("ad-detail", kwargs={"pk": self.ad_receiver.pk}))
+        self.assertEqual(response.data["received_proposals_count"], 1)
+        self.assertEqual(response.data["pending_proposals_count"], 1)
+        results = self.client.get(reverse("ad-list")).data["results"]
+        by_id = {item["id"]: item for item in results}
+        self.assertEqual(by_id[self.ad_receiver.pk]["received_proposals_count"], 1)
+
+    def test_summary_endpoint(self):
+        self.client.force_authenticate(user=self.receiver)
+        response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["pending_received_count"], 0)
+
+        self._propose()
+        self._propose(status="accepted")
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(
+            response.data,
+            {
+                "received_count": 2,
+                "pending_received_count": 1,
+                "accepted_received_count": 1,
+                "sent_count": 0,
+                "pending_sent_count": 0,
+            },
+        )
+
+    def test_reconcile_fixes_drift(self):
+        self._propose()
+        self._propose(status="accepted")
+        # правки в обход сигналов
+        ExchangeProposal.objects.update(status="rejected")
+        UserProposalStats.objects.filter(user=self.sender).delete()
+
+        out = StringIO()
+        call_command("reconcile_proposal_counters", "--dry-run", stdout=out)
+        self.assertIn("объявлений 1, пользователей 2", out.getvalue())
+        self.assertEqual(self._ad_counters(), (2, 1, 1))
+
+        call_command("reconcile_proposal_counters", stdout=StringIO())
+        self.assertEqual(self._ad_counters(), (2, 0, 0))
+        self.assertEqual(self._stats(self.receiver), (2, 0, 0, 0, 0))
+        self.assertEqual(self._stats(self.sender), (0, 0, 0, 2, 0))
+
+        out = StringIO()
+        call_command("reconcile_proposal_counters", stdout=out)
+        self.assertIn("объявлений 0, пользователей 0", out.getvalue())
+
+
+class ClaimsJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        self.user = User.objects.create_user(
+            username="claims", password="pass1234", email="claims@example.com"
+        )
+
+    def _obtain(self):
+        response = self.client.post(
+            reverse("token_obtain_pair"), {"username": "claims", "password": "pass1234"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_token_carries_claims_and_skips_user_query(self):
+        access = AccessToken(self._obtain()["access"])
+        self.assertEqual((access["username"], access["is_staff"], access["is_active"]), ("claims", False, True))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        # только SELECT сводки, пользователя не читаем
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_lazy_user_loads_other_fields_on_access(self):
+        token = AccessToken(self._obtain()["access"])
+        user = ClaimsJWTAuthentication().get_user(token)
+        with self.assertNumQueries(0):
+            self.assertEqual((user.pk, user.username, user.is_staff), (self.user.pk, "claims", False))
+            self.assertEqual(user, self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "claims@example.com")
+
+    def test_inactive_claim_rejected(self):
+        token = AccessToken.for_user(self.user)
+        token["username"], token["is_staff"], token["is_active"] = "claims", False, False
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_without_claims_still_works(self):
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        with self.assertNumQueries(2):  # пользователь + сводка
+            response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_verified_tokens_are_cached(self):
+        access = self._obtain()["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        with mock.patch.object(TokenBackend, "decode", autospec=True, side_effect=TokenBackend.decode) as decode:
+            self.client.get(reverse("proposals-summary"))
+            self.client.get(reverse("proposals-summary"))
+        self.assertEqual(decode.call_count, 1)
+
+    def test_cached_token_still_expires(self):
+        access = self._obtain()["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get(reverse("proposals-summary")).status_code, status.HTTP_200_OK)
+        later = timezone.now() + timedelta(days=1)
+        with mock.patch("ads.authentication.aware_utcnow", return_value=later):
+            response = self.client.get(reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lru_evicts_least_recently_used(self):
+        tokens = VerifiedTokenCache(2)
+        tokens.put(b"a", "A")
+        tokens.put(b"b", "B")
+        tokens.get(b"a")
+        tokens.put(b"c", "C")
+        self.assertEqual((tokens.get(b"a"), tokens.get(b"b"), tokens.get(b"c")), ("A", None, "C"))
+        self.assertEqual(len(tokens), 2)
+
+    def test_refresh_updates_claims(self):
+        refresh = self._obtain()["refresh"]
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(reverse("token_refresh"), {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(AccessToken(response.data["access"])["is_staff"])
+        self.assertTrue(RefreshToken(response.data["refresh"])["is_staff"])
+
+    def test_refresh_reads_user_no_more_than_simplejwt(self):
+        def user_reads(serializer_class):
+            serializer = serializer_class(data={"refresh": self._obtain()["refresh"]})
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(serializer.is_valid(), serializer.errors)
+            # blacklist() и outstand() simplejwt читают пользователя сами — одинаково у обоих
+            return sum('FROM "auth_user"' in query["sql"] for query in queries.captured_queries)
+
+        self.assertEqual(user_reads(ClaimsTokenRefreshSerializer), user_reads(TokenRefreshSerializer))
+
+    def test_refresh_for_inactive_or_deleted_user(self):
+        refresh = self._obtain()["refresh"]
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post(reverse("token_refresh"), {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.delete()
+        response = self.client.post(reverse("token_refresh"), {"refresh": refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.reset()
+        self.user = User.objects.create_user(username="claims", password="pass1234")
+        # фильтр работает только с общим кешем; LocMem в тестах считаем общим
+        patcher = mock.patch("ads.token_blacklist.is_shared_cache", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _refresh(self, refresh):
+        # сигнал о blacklist срабатывает после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("token_refresh"), {"refresh": refresh})
+
+    def _blacklist_query_count(self, refresh):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._refresh(refresh)
+        queries = [q["sql"] for q in ctx.captured_queries]
+        # проверка simplejwt — SELECT 1 … JOIN outstandingtoken WHERE jti = …
+        checks = [sql for sql in queries if "blacklistedtoken" in sql and '"jti" =' in sql]
+        return response, checks
+
+    def test_not_blacklisted_token_needs_no_query(self):
+        blacklist_filter.is_blacklisted("warm-up")  # фильтр строится один раз на процесс
+        refresh = str(RefreshToken.for_user(self.user))
+        response, checks = self._blacklist_query_count(refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(checks, [])
+
+    def test_rotated_token_is_rejected(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        self.assertEqual(self._refresh(refresh).status_code, status.HTTP_200_OK)
+        # BLACKLIST_AFTER_ROTATION: старый refresh отозван
+        self.assertEqual(self._refresh(refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_blacklisted_in_other_process_is_rejected(self):
+        refresh = RefreshToken.for_user(self.user)
+        blacklist_filter.is_blacklisted("warm-up")
+        # другой процесс: запись в БД и ключ в общем кеше, наш фильтр о ней не знает
+        refresh.blacklist()
+        cache.set(BLACKLISTED_KEY.format(jti=refresh["jti"]), True)
+        self.assertEqual(self._refresh(str(refresh)).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_BLACKLIST_SYNC_SECONDS=0)
+    def test_periodic_catch_up_without_shared_cache(self):
+        refresh = RefreshToken.for_user(self.user)
+        blacklist_filter.is_blacklisted("warm-up")
+        with mock.patch.object(blacklist_filter, "added"):
+            refresh.blacklist()
+        self.assertIsNone(blacklist_filter.is_blacklisted(refresh["jti"]))  # попал в фильтр
+
+    def test_process_local_cache_always_checks_database(self):
+        blacklist_filter.is_blacklisted("warm-up")
+        refresh = str(RefreshToken.for_user(self.user))
+        with mock.patch("ads.token_blacklist.is_shared_cache", return_value=False):
+            response, checks = self._blacklist_query_count(refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(checks), 1)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_prune_deletes_only_expired(self):
+        now = timezone.now()
+        old = OutstandingToken.objects.create(jti="old", token="x", expires_at=now - timedelta(days=2))
+        BlacklistedToken.objects.create(token=old)
+        OutstandingToken.objects.create(jti="old2", token="x", expires_at=now - timedelta(days=2))
+        fresh = OutstandingToken.objects.create(jti="fresh", token="x", expires_at=now + timedelta(days=1))
+        BlacklistedToken.objects.create(token=fresh)
+
+        out = StringIO()
+        call_command("prune_tokens", "--batch-size", "1", "--sleep", "0", stdout=out)
+        self.assertIn("Удалено токенов: 2", out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list("jti", flat=True)), ["fresh"])
+        self.assertEqual(BlacklistedToken.objects.get().token_id, fresh.pk)
+
+
+class SlidingWindowThrottleTests(APITestCase):
+    def setUp(self):
+        caches["throttle"].clear()
+        self.user = User.objects.create_user(username="writer", password="pass1234")
+        self.other = User.objects.create_user(username="other", password="pass1234")
+        self.ad_receiver = Ad.objects.create(user=self.other, title="Ad Receiver")
+        self.client.force_authenticate(user=self.user)
+
+    def _throttle(self, rate, now):
+        throttle = SharedUserRateThrottle()
+        throttle.rate = rate
+        throttle.num_requests, throttle.duration = throttle.parse_rate(rate)
+        throttle.timer = lambda: now
+        return throttle
+
+    def _request(self):
+        return mock.Mock(user=self.user)
+
+    def test_previous_window_weight(self):
+        request = self._request()
+        allowed = [self._throttle("4/min", 60_000 + i).allow_request(request, None) for i in range(5)]
+        self.assertEqual(allowed, [True, True, True, True, False])
+        # середина следующего окна: 4 * 0.5 + новые <= 4 — пропускаем ещё два
+        allowed = [self._throttle("4/min", 60_090).allow_request(request, None) for _ in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+
+    def test_wait_until_window_cools_down(self):
+        request = self._request()
+        for i in range(4):
+            self._throttle("4/min", 60_000 + i).allow_request(request, None)
+        throttle = self._throttle("4/min", 60_030)
+        self.assertFalse(throttle.allow_request(request, None))
+        # следующее окно через 30 с, там ждём, пока 4 * (1 - e) + 1 <= 4: e >= 1/4
+        self.assertAlmostEqual(throttle.wait(), 45)
+
+    def test_concurrent_requests_counted_atomically(self):
+        request = self._request()
+        results = []
+
+        def hit():
+            results.append(self._throttle("20/min", 60_000).allow_request(request, None))
+
+        threads = [threading.Thread(target=hit) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 20)
+
+    def test_proposals_create_scope(self):
+        senders = [Ad.objects.create(user=self.user, title=f"Моё объявление {i}") for i in range(3)]
+        with mock.patch.dict(SharedScopedRateThrottle.THROTTLE_RATES, {"proposals_create": "2/min"}):
+            codes = [
+                self.client.post(
+                    reverse("proposals-create"), {"ad_sender": ad.pk, "ad_receiver": self.ad_receiver.pk}
+                ).status_code
+                for ad in senders
+            ]
+        self.assertEqual(codes, [201, 201, 429])
+
+    def test_ads_write_scope_does_not_limit_reads(self):
+        with mock.patch.dict(SharedScopedRateThrottle.THROTTLE_RATES, {"ads_write": "1/min"}):
+            url = reverse("ad-detail", kwargs={"pk": self.ad_receiver.pk})
+            self.client.force_authenticate(user=self.other)
+            self.assertEqual(self.client.patch(url, {"condition": "used"}).status_code, 200)
+            self.assertEqual(self.client.patch(url, {"condition": "new"}).status_code, 429)
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_process_local_store_only_with_debug(self):
+        with self.settings(DEBUG=True):
+            check_throttle_settings()
+        with self.settings(DEBUG=False), self.assertRaises(ImproperlyConfigured):
+            check_throttle_settings()  # LocMemCache
+        with self.settings(DEBUG=False), mock.patch("ads.throttling.is_shared_cache", return_value=True):
+            check_throttle_settings()
+
+
+class ReferenceDataCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_reference_data()
+        # снимок живёт только при общем кеше; LocMem в тестах считаем общим
+        patcher = mock.patch("ads.reference.is_shared_cache", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(title="Книги")
+            self.tag = Tag.objects.create(name="фантастика")
+        self.client.force_authenticate(user=self.user)
+
+    def _ad_data(self, category):
+        return {
+            "title": "Книга про космос",
+            "description": "Desc",
+            "condition": "new",
+            "category": category.pk,
+            "tag_ids": [self.tag.pk],
+        }
+
+    def test_serializer_resolves_from_snapshot(self):
+        reference_data()  # прогрев
+        serializer = AdSerializer(data=self._ad_data(self.category))
+        with self.assertNumQueries(0):
+            valid = serializer.is_valid()
+        self.assertTrue(valid, serializer.errors)
+        self.assertEqual(serializer.validated_data["category"], self.category)
+        self.assertEqual(serializer.validated_data["tag_ids"], [self.tag])
+
+    def test_snapshot_reloads_after_change(self):
+        snapshot = reference_data()
+        self.assertIs(reference_data(), snapshot)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(title="Спорт")
+        self.assertIsNot(reference_data(), snapshot)
+        self.assertEqual(len(reference_data().objects[Category]), 2)
+
+    def test_stale_snapshot_falls_back_to_db(self):
+        reference_data()
+        other = Category.objects.create(title="Спорт")  # коммита (и нового поколения) в тесте нет
+        serializer = AdSerializer(data=self._ad_data(other))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data["category"], other)
+
+    @mock.patch("ads.reference.is_shared_cache", return_value=False)
+    def test_process_local_cache_reads_database(self, _):
+        self.assertIn(self.category.pk, reference_data().objects[Category])
+        # категорию удалили, а тег переименовали в другом воркере — поколение в памяти
+        # этого процесса о том не знает, поэтому снимок не запоминается
+        Category.objects.filter(pk=self.category.pk).delete()
+        Tag.objects.filter(pk=self.tag.pk).update(name="космос")
+        self.assertNotIn(self.category.pk, reference_data().objects[Category])
+        self.assertEqual(tag_ids_by_name(["космос", "фантастика"]), {"космос": self.tag.pk})
+        self.assertEqual(self.client.get(reverse("category-list")).data["results"], [])
+
+        serializer = AdSerializer(data=self._ad_data(self.category))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("category", serializer.errors)
+
+        response = self.client.post(reverse("ad-bulk"), [self._ad_data(self.category)], format="json")
+        self.assertEqual(response.data["results"][0]["status"], "error")
+        self.assertIn("category", response.data["results"][0]["errors"])
+
+    def test_categories_etag(self):
+        url = reverse("category-list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c["title"] for c in response.data["results"]], ["Книги"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = "Книги и журналы"
+            self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["results"][0]["title"], "Книги и журналы")
+
+
+class AdTagFilterFacetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_reference_data()
+        patcher = mock.patch("ads.reference.is_shared_cache", return_value=True)  # снимок справочников
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username="seller", password="pass1234")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books = Category.objects.create(title="Книги")
+            self.sport = Category.objects.create(title="Спорт")
+            self.scifi = Tag.objects.create(name="фантастика")
+            self.rare = Tag.objects.create(name="редкое")
+        self.both = self._ad("Дюна", self.books, "new", [self.scifi, self.rare])
+        self.scifi_only = self._ad("Солярис", self.books, "used", [self.scifi])
+        self.plain = self._ad("Мяч", self.sport, "used", [])
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("ad-list")
+
+    def _ad(self, title, category, condition, tags):
+        ad = Ad.objects.create(
+            user=self.user, title=title, description="Desc", category=category, condition=condition
+        )
+        ad.tags.set(tags)
+        return ad
+
+    def _titles(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(ad["title"] for ad in response.data["results"])
+
+    def test_tags_any_and_all(self):
+        self.assertEqual(self._titles(tags="фантастика,редкое"), ["Дюна", "Солярис"])
+        self.assertEqual(self._titles(tags="Фантастика,редкое", tags_mode="all"), ["Дюна"])
+        self.assertEqual(self._titles(tags="редкое, неизвестный"), ["Дюна"])
+        self.assertEqual(self._titles(tags="редкое,неизвестный", tags_mode="all"), [])
+
+    def test_facets_single_query(self):
+        reference_data()  # названия — из снимка
+        queryset = Ad.objects.filter(category=self.books)
+        with self.assertNumQueries(1):
+            facets = facet_counts(queryset)
+        self.assertEqual(facets["category"], [{"id": self.books.pk, "title": "Книги", "count": 2}])
+        self.assertEqual(
+            [(item["value"], item["count"]) for item in facets["condition"]], [("new", 1), ("used", 1)]
+        )
+        self.assertEqual(
+            facets["tags"],
+            [
+                {"id": self.scifi.pk, "name": "фантастика", "count": 2},
+                {"id": self.rare.pk, "name": "редкое", "count": 1},
+            ],
+        )
+
+    def test_facets_in_list_response(self):
+        response = self.client.get(self.url, {"tags": "фантастика", "facets": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["facets"]["category"][0]["count"], 2)
+        self.assertEqual({t["name"]: t["count"] for t in response.data["facets"]["tags"]}, {"фантастика": 2, "редкое": 1})
+        self.assertNotIn("facets", self.client.get(self.url).data)
+
+    def test_tag_missing_from_snapshot_found_ignoring_case(self):
+        reference_data()
+        first = Tag.objects.create(name="Первое издание")  # коммита (и нового поколения) в тесте нет
+        self.plain.tags.add(first)
+        self.assertEqual(self._titles(tags="первое ИЗДАНИЕ"), ["Мяч"])
+
+    def test_facets_extend_list_budget(self):
+        reference_data()  # названия в фасетах — из снимка
+        with self.settings(QUERY_BUDGET_MODE="raise"):
+            response = self.client.get(self.url, {"category": self.books.pk})
+            self.assertLessEqual(int(response["X-DB-Queries"]), 2)
+            # агрегат фасетов и повторная проверка ?category= — сверх бюджета списка
+            response = self.client.get(self.url, {"category": self.books.pk, "facets": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(int(response["X-DB-Queries"]), 2)
+
+
+class AdMatchesTests(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner", password="pass1234")
+        self.other = User.objects.create_user(username="other", password="pass1234")
+        self.books = Category.objects.create(title="Книги")
+        self.sport = Category.objects.create(title="Спорт")
+        self.scifi = Tag.objects.create(name="фантастика")
+        self.rare = Tag.objects.create(name="редкое")
+        self.ball = Tag.objects.create(name="мяч")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad = self._ad(self.owner, "Дюна", self.books, [self.scifi, self.rare])
+            self.own = self._ad(self.owner, "Солярис", self.books, [self.scifi, self.rare])
+            self.close = self._ad(self.other, "Гиперион", self.books, [self.scifi, self.rare])
+            self.partial = self._ad(self.other, "Марсианин", self.sport, [self.scifi])
+            self.unrelated = self._ad(self.other, "Футбольный мяч", self.sport, [self.ball])
+        self.client.force_authenticate(user=self.owner)
+
+    def _ad(self, user, title, category, tags):
+        ad = Ad.objects.create(user=user, title=title, description="Desc", category=category, condition="used")
+        ad.tags.set(tags)
+        return ad
+
+    def _matches(self, ad):
+        return list(
+            AdMatch.objects.filter(ad=ad).order_by("-score").values_list("candidate_id", "shared_tags")
+        )
+
+    def test_ranked_candidates_from_other_users(self):
+        self.assertEqual(self._matches(self.ad), [(self.close.pk, 2), (self.partial.pk, 1)])
+        response = self.client.get(reverse("ad-matches", args=[self.ad.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([r["ad"]["id"] for r in results], [self.close.pk, self.partial.pk])
+        self.assertAlmostEqual(results[0]["score"], 1.0)
+        self.assertEqual(results[0]["ad"]["user"], "other")
+        self.assertEqual(results[0]["category"], "Книги")
+
+    def test_single_query_read(self):
+        url = reverse("ad-matches", args=[self.ad.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"limit": 1})
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_incremental_refresh_on_tag_and_category_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unrelated.tags.add(self.scifi)
+        self.assertIn(self.unrelated.pk, dict(self._matches(self.ad)))
+        self.assertIn(self.ad.pk, dict(self._matches(self.unrelated)))  # обратная строка
+
+        ad = Ad.objects.get(pk=self.partial.pk)
+        before = dict(AdMatch.objects.filter(ad=self.ad).values_list("candidate_id", "score"))
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.category = self.books
+            ad.save()
+        after = dict(AdMatch.objects.filter(ad=self.ad).values_list("candidate_id", "score"))
+        self.assertGreater(after[self.partial.pk], before[self.partial.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.close.tags.clear()
+        self.assertNotIn(self.close.pk, dict(self._matches(self.ad)))
+
+    def test_rebuild_matches_same_as_incremental(self):
+        incremental = set(AdMatch.objects.values_list("ad_id", "candidate_id", "shared_tags"))
+        self.assertEqual(rebuild_matches(), len(incremental))
+        self.assertEqual(set(AdMatch.objects.values_list("ad_id", "candidate_id", "shared_tags")), incremental)
+
+    @override_settings(ADS_MATCHES_PER_AD=2)
+    def test_refresh_keeps_lists_that_hold_ad_outside_its_top(self):
+        rebuild_matches()
+        # у self.ad три чужих соседа, в его top-2 — «Гиперион» и «Марсианин»,
+        # а у нового соседа self.ad в top-2 есть
+        distant = self._ad(self.other, "Ещё одна книга", self.sport, [self.rare, self.ball])
+        rebuild_matches()
+        self.assertNotIn(distant.pk, dict(self._matches(self.ad)))
+        self.assertIn(self.ad.pk, dict(self._matches(distant)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.tags.add(Tag.objects.create(name="первое издание"))
+        refreshed = set(AdMatch.objects.values_list("ad_id", "candidate_id", "score"))
+        self.assertIn(self.ad.pk, dict(self._matches(distant)))
+        self.assertTrue(all(AdMatch.objects.filter(ad=ad).count() <= 2 for ad in Ad.objects.all()))
+        rebuild_matches()
+        self.assertEqual(set(AdMatch.objects.values_list("ad_id", "candidate_id", "score")), refreshed)
+
+    def test_unknown_ad(self):
+        response = self.client.get(reverse("ad-matches", args=[999999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_concurrent_refresh_upserts(self):
+        # параллельный пересчёт вставил те же пары между нашим DELETE и INSERT
+        AdMatch.objects.filter(ad=self.ad, candidate=self.close).update(score=0.1)
+        with mock.patch("ads.matches.AdMatch.objects.filter"):
+            refresh_matches([self.ad.pk])
+        self.assertAlmostEqual(AdMatch.objects.get(ad=self.ad, candidate=self.close).score, 1.0)
+
+    def test_no_matches_route_for_tags(self):
+        response = self.client.get(f"/tags/{self.scifi.pk}/matches/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TradeCycleTests(APITestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"trader{i}", password="pass1234") for i in range(4)]
+        self.ads = [
+            Ad.objects.create(user=user, title=f"Вещь {i}", description="Desc", condition="used")
+            for i, user in enumerate(self.users)
+        ]
+
+    def _propose(self, sender, receiver, status="pending"):
+        return ExchangeProposal.objects.create(
+            ad_sender=self.ads[sender], ad_receiver=self.ads[receiver], status=status
+        )
+
+    def _signatures(self):
+        return sorted(TradeCycle.objects.values_list("signature", flat=True))
+
+    def _signature(self, *indexes):
+        return "-".join(str(self.ads[i].pk) for i in indexes)
+
+    def test_finds_three_and_four_way_cycles_once(self):
+        p01, p12, p20 = self._propose(0, 1), self._propose(1, 2), self._propose(2, 0)
+        self._propose(2, 3)
+        self._propose(3, 0)
+        self._propose(1, 0)  # встречное 0 <-> 1 — обычный обмен, не цикл
+        self._propose(3, 1, status="rejected")
+
+        run = find_cycles(full=True)
+        self.assertEqual(run.found, 2)
+        self.assertEqual(self._signatures(), sorted([self._signature(0, 1, 2), self._signature(0, 1, 2, 3)]))
+        cycle = TradeCycle.objects.get(signature=self._signature(0, 1, 2))
+        self.assertEqual(cycle.proposal_ids, [p01.pk, p12.pk, p20.pk])
+        self.assertEqual(cycle.user_ids, [u.pk for u in self.users[:3]])
+
+        self.assertEqual(find_cycles(full=True).found, 0)  # повторный прогон ничего не дублирует
+
+    def test_same_owner_is_not_a_cycle(self):
+        extra = Ad.objects.create(user=self.users[0], title="Ещё вещь", description="Desc", condition="new")
+        self._propose(0, 1)
+        self._propose(1, 2)
+        ExchangeProposal.objects.create(ad_sender=self.ads[2], ad_receiver=extra)
+        graph = ProposalGraph.load()
+        self.assertEqual(list(graph.edges()), [(self.ads[0].pk, self.ads[1].pk), (self.ads[1].pk, self.ads[2].pk), (self.ads[2].pk, extra.pk)])
+        find_cycles(full=True)
+        self.assertEqual(self._signatures(), [])
+
+    def test_incremental_run_and_status_change(self):
+        self._propose(0, 1)
+        self._propose(1, 2)
+        self.assertEqual(find_cycles().found, 0)
+        closing = self._propose(2, 0)
+        run = find_cycles()
+        self.assertFalse(run.full)
+        self.assertEqual((run.found, self._signatures()), (1, [self._signature(0, 1, 2)]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            closing.status = "rejected"
+            closing.save()
+        self.assertEqual(self._signatures(), [])
+
+    def test_run_removes_cycles_changed_without_signals(self):
+        self._propose(0, 1)
+        self._propose(1, 2)
+        closing = self._propose(2, 0)
+        find_cycles(full=True)
+        ExchangeProposal.objects.filter(pk=closing.pk).update(status="accepted")
+        self.assertEqual(find_cycles().removed, 1)
+        self.assertEqual(self._signatures(), [])
+
+    def test_cycles_endpoint(self):
+        proposals = [self._propose(0, 1), self._propose(1, 2), self._propose(2, 0)]
+        find_cycles(full=True)
+        self.client.force_authenticate(user=self.users[1])
+        url = reverse("proposals-cycles")
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        (cycle,) = response.data["results"]
+        self.assertEqual([p["id"] for p in cycle["proposals"]], [p.pk for p in proposals])
+        self.assertEqual(cycle["proposals"][0]["ad_receiver"]["user"], "trader1")
+
+        self.client.force_authenticate(user=self.users[3])
+        self.assertEqual(self.client.get(url).data["results"], [])
+
+
+class ProposalTransitionTests(APITestCase):
+    def setUp(self):
+        self.receiver = User.objects.create_user(username="receiver", password="pass1234")
+        self.first = User.objects.create_user(username="first", password="pass1234")
+        self.second = User.objects.create_user(username="second", password="pass1234")
+        self.wanted = Ad.objects.create(user=self.receiver, title="Велосипед")
+        self.offer = Ad.objects.create(user=self.first, title="Самокат")
+        self.rival = Ad.objects.create(user=self.second, title="Ролики")
+        self.elsewhere = Ad.objects.create(user=self.second, title="Скейт")
+
+        self.proposal = self._propose(self.offer, self.wanted)
+        self.competing = self._propose(self.rival, self.wanted)  # то же объявление получателя
+        self.offer_elsewhere = self._propose(self.offer, self.elsewhere)  # тот же самокат другому
+        self.unrelated = self._propose(self.rival, self.elsewhere)
+        self.client.force_authenticate(user=self.receiver)
+
+    def _propose(self, sender, receiver):
+        return ExchangeProposal.objects.create(ad_sender=sender, ad_receiver=receiver)
+
+    def _statuses(self):
+        return dict(ExchangeProposal.objects.values_list("pk", "status"))
+
+    def test_accept_rejects_competitors_on_both_ads(self):
+        url = reverse("proposal-status-update", kwargs={"pk": self.proposal.pk})
+        response = self.client.patch(url, {"status": "accepted"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], "accepted")
+        self.assertEqual(
+            self._statuses(),
+            {
+                self.proposal.pk: "accepted",
+                self.competing.pk: "rejected",
+                self.offer_elsewhere.pk: "rejected",
+                self.unrelated.pk: "pending",
+            },
+        )
+        self.assertEqual(OutboxEvent.objects.filter(event_type="proposal.updated").count(), 3)
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))  # счётчики сошлись без сигналов
+
+    def test_second_change_conflicts(self):
+        url = reverse("proposal-status-update", kwargs={"pk": self.proposal.pk})
+        self.assertEqual(self.client.patch(url, {"status": "rejected"}).status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {"status": "accepted"})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self._statuses()[self.proposal.pk], "rejected")
+
+    def test_stale_proposal_is_not_overwritten(self):
+        # параллельный запрос успел принять предложение после того, как мы его прочитали
+        ExchangeProposal.objects.filter(pk=self.proposal.pk).update(status="accepted")
+        self.assertEqual(change_status(self.receiver, [self.proposal.pk], "rejected"), [])
+        self.assertEqual(self._statuses()[self.proposal.pk], "accepted")
+
+    def test_bulk_accept(self):
+        response = self.client.post(
+            reverse("proposals-bulk-status"),
+            {"ids": [self.proposal.pk, self.competing.pk, self.unrelated.pk], "status": "accepted"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # два предложения на одно объявление: принимается раннее, второе — конкурент;
+        # unrelated входящее не этому пользователю
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": self.proposal.pk, "status": "accepted"},
+                {"id": self.competing.pk, "status": "rejected"},
+                {"id": self.unrelated.pk, "status": "conflict"},
+            ],
+        )
+        self.assertEqual(response.data["auto_rejected"], [self.offer_elsewhere.pk])
+        self.assertEqual(self._statuses()[self.unrelated.pk], "pending")
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))
+
+    def test_bulk_reject(self):
+        response = self.client.post(
+            reverse("proposals-bulk-status"),
+            {"ids": [self.proposal.pk, self.competing.pk], "status": "rejected"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["auto_rejected"], [])
+        self.assertEqual(
+            self._statuses(),
+            {
+                self.proposal.pk: "rejected",
+                self.competing.pk: "rejected",
+                self.offer_elsewhere.pk: "pending",
+                self.unrelated.pk: "pending",
+            },
+        )
+        bad = self.client.post(reverse("proposals-bulk-status"), {"ids": [], "status": "pending"}, format="json")
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DuplicateProposalTests(APITestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username="sender", password="pass1234")
+        self.receiver = User.objects.create_user(username="receiver", password="pass1234")
+        self.offer = Ad.objects.create(user=self.sender, title="Самокат")
+        self.wanted = Ad.objects.create(user=self.receiver, title="Велосипед")
+        self.data = {"ad_sender": self.offer.pk, "ad_receiver": self.wanted.pk, "comment": "Меняю"}
+        self.client.force_authenticate(user=self.sender)
+
+    def test_repeat_returns_existing(self):
+        first = self.client.post(reverse("proposals-create"), self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        second = self.client.post(reverse("proposals-create"), self.data)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(ExchangeProposal.objects.count(), 1)
+        self.assertEqual(OutboxEvent.objects.filter(event_type="proposal.created").count(), 1)
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))  # повтор счётчики не трогает
+
+    def test_unknown_ad(self):
+        response = self.client.post(reverse("proposals-create"), {**self.data, "ad_receiver": 999999})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("ad_receiver", response.data)
+
+    def test_database_rejects_second_pending(self):
+        ExchangeProposal.objects.create(ad_sender=self.offer, ad_receiver=self.wanted)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExchangeProposal.objects.create(ad_sender=self.offer, ad_receiver=self.wanted)
+
+    def test_new_proposal_after_rejection(self):
+        proposal, created = ExchangeProposal.objects.get_or_create_pending(self.offer.pk, self.wanted.pk)
+        self.assertTrue(created)
+        change_status(self.receiver, [proposal.pk], "rejected")
+        again, created = ExchangeProposal.objects.get_or_create_pending(self.offer.pk, self.wanted.pk)
+        self.assertTrue(created)
+        self.assertNotEqual(again.pk, proposal.pk)
+        self.assertEqual(again.status, "pending")
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))
+
+    def test_conflicting_pending_closed_before_lookup(self):
+        existing, _ = ExchangeProposal.objects.get_or_create_pending(self.offer.pk, self.wanted.pk)
+        lookup = ExchangeProposalQuerySet.filter
+        closed = []
+
+        def closed_meanwhile(queryset, *args, **kwargs):
+            if not closed:
+                # ожидающее отклонили в другом запросе между нашими INSERT и SELECT
+                closed.append(ExchangeProposal.objects.all().update(status="rejected"))
+            return lookup(queryset, *args, **kwargs)
+
+        with mock.patch.object(ExchangeProposalQuerySet, "filter", autospec=True, side_effect=closed_meanwhile):
+            proposal, created = ExchangeProposal.objects.get_or_create_pending(self.offer.pk, self.wanted.pk)
+        self.assertTrue(created)
+        self.assertNotEqual(proposal.pk, existing.pk)
+        self.assertEqual(ExchangeProposal.objects.filter(status="pending").get().pk, proposal.pk)
+
+    def test_benchmark_seed_has_no_duplicate_pending(self):
+        # 40 предложений между 6 объявлениями — пары обязательно повторяются
+        seed(users=3, ads=6, tags=3, proposals=40, log=lambda message: None)
+        self.assertEqual(ExchangeProposal.objects.filter(ad_sender__title__contains="#").count(), 40)
+        self.assertEqual(reconcile_all(dry_run=True), (0, 0))
+
+    def test_form_view_reports_existing(self):
+        client = Client()
+        client.login(username="sender", password="pass1234")
+        url = reverse("proposal_create-view") + f"?ad_receiver={self.wanted.pk}"
+        client.post(url, {"ad_sender": self.offer.pk})
+        response = client.post(url, {"ad_sender": self.offer.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ExchangeProposal.objects.count(), 1)
+        messages = list(get_messages(response.wsgi_request))
+        self.assertTrue(any("уже отправлено" in str(m) for m in messages))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(APITransactionTestCase):
+    # TestCase держит весь тест в транзакции на default, и роутер читает с primary;
+    # здесь транзакции нет — реплика (второй alias той же базы) видит данные
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        _health.clear()
+        self.reader = User.objects.create_user(username="reader", password="pass1234")
+        self.owner = User.objects.create_user(username="owner", password="pass1234")
+        self.offer = Ad.objects.create(user=self.reader, title="Самокат")
+        self.wanted = Ad.objects.create(user=self.owner, title="Велосипед")
+        self.client.force_authenticate(user=self.reader)
+
+    def _request(self, method, url, data=None, client=None):
+        """Ответ и число запросов на primary и на реплику (проверка отставания не видна)."""
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                response = getattr(client or self.client, method)(url, data)
+        return response, len(primary), len(replica)
+
+    def test_safe_reads_go_to_replica(self):
+        response, primary, replica = self._request("get", reverse("proposals-from-me"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_read_your_writes(self):
+        response, _, replica = self._request(
+            "post", reverse("proposals-create"), {"ad_sender": self.offer.pk, "ad_receiver": self.wanted.pk}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replica, 0)
+
+        response, primary, replica = self._request("get", reverse("proposals-from-me"))
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # закреплён только тот, кто писал
+        self.client.force_authenticate(user=self.owner)
+        _, primary, replica = self._request("get", reverse("proposals-to-me"))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_view_opt_out(self):
+        response, primary, replica = self._request("get", reverse("proposals-summary"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_lagging_or_broken_replica_falls_back_to_primary(self):
+        with mock.patch("ads.routers.replica_lag", return_value=30.0):
+            _, primary, replica = self._request("get", reverse("proposals-from-me"))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        _health.clear()
+        with mock.patch("ads.routers.replica_lag", side_effect=DatabaseError("connection refused")) as lag:
+            self._request("get", reverse("proposals-from-me"))
+            _, primary, replica = self._request("get", reverse("proposals-from-me"))
+        self.assertEqual(lag.call_count, 1)  # результат проверки кешируется
+        self.assertEqual(replica, 0)
+
+    def test_session_views_read_replica(self):
+        client = Client()
+        client.login(username="reader", password="pass1234")
+        response, primary, replica = self._request("get", reverse("index"), client=client)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(replica, 0)
+        # сессия и пользователь — с primary
+        self.assertGreater(primary, 0)
+
+    def test_off_without_configured_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            _, primary, replica = self._request("get", reverse("proposals-from-me"))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_replicas_require_shared_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            check_replica_settings()  # LocMemCache
+        with mock.patch("ads.routers.is_shared_cache", return_value=True):
+            check_replica_settings()
+
+    def test_lag_check_is_not_in_query_budget(self):
+        connections["replica"].ensure_connection()
+        stats = QueryStats()
+        with connections["replica"].execute_wrapper(stats):
+            self.assertEqual(replica_lag("replica"), 0)
+        self.assertEqual(stats.queries, 0)
+
+    def test_router_rules(self):
+        token = _read_route.set(ReadRoute(RequestFactory().get("/"), "replica"))
+        try:
+            self.assertEqual(Ad.objects.all().db, "replica")
+            self.assertEqual(User.objects.all().db, "default")
+            with transaction.atomic():
+                self.assertEqual(Ad.objects.all().db, "default")
+            self.assertEqual(Ad.objects.select_for_update().db, "default")
+        finally:
+            _read_route.reset(token)
+        self.assertEqual(Ad.objects.all().db, "default")  # вне запроса
+
+
+class BenchmarkTests(TestCase):
+    def test_summarize(self):
+        summary = summarize([0.004, 0.001, 0.003, 0.002], wall_time=2, queries=[3, 5, 4], errors=1)
+        self.assertEqual(summary["requests"], 4)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["rps"], 2.0)
+        self.assertEqual(summary["mean_ms"], 2.5)
+        self.assertEqual(summary["p50_ms"], 2.5)
+        self.assertLessEqual(summary["p95_ms"], summary["p99_ms"])
+        self.assertLessEqual(summary["p99_ms"], 4.0)
+        self.assertEqual(summary["queries"], 5)  # худший запрос
+        single = summarize([0.01], wall_time=0)
+        self.assertEqual((single["p50_ms"], single["p99_ms"], single["rps"]), (10.0, 10.0, None))
+        self.assertNotIn("queries", single)
+
+    def test_compare_with_baseline(self):
+        baseline = {
+            "endpoints": {
+                "ads_list": {"p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 0, "queries": 2},
+                "removed": {"p50_ms": 1.0},
+            }
+        }
+        report = {
+            "endpoints": {
+                "ads_list": {"p50_ms": 10.5, "p95_ms": 30.0, "p99_ms": 50.0, "queries": 1},
+                "new_endpoint": {"p50_ms": 100.0},
+            }
+        }
+        regressions = compare_with_baseline(report, baseline, max_regression=0.10)
+        # +5% в пределах порога, p99 без baseline (0) и новый эндпоинт не сравниваются
+        self.assertEqual(regressions, ["ads_list.p95_ms: 20.0 -> 30.0 (+50%)"])
+        self.assertEqual(
+            report["endpoints"]["ads_list"]["vs_baseline"], {"p50_ms": 0.05, "p95_ms": 0.5, "queries": -0.5}
+        )
+        self.assertNotIn("vs_baseline", report["endpoints"]["new_endpoint"])
+        self.assertEqual(compare_with_baseline(report, baseline, max_regression=0.6), [])
+
+    def test_seed_rejects_impossible_counts(self):
+        for counts in (
+            {"users": 0, "ads": 5, "tags": 1, "proposals": 0},
+            {"users": 3, "ads": 1, "tags": 1, "proposals": 5},
+            {"users": 1, "ads": 4, "tags": 1, "proposals": 5},
+            {"users": 2, "ads": -1, "tags": 1, "proposals": 0},
+        ):
+            with self.subTest(**counts), self.assertRaises(ValueError):
+                seed(**counts, log=lambda message: None)
+        with self.assertRaisesMessage(CommandError, "пользователь"):
+            call_command("seed_benchmark_data", users=0, ads=5, stdout=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith=BENCH_USER_PREFIX).exists())
+
+    def test_in_process_run_clears_cache_by_default(self):
+        seed(users=2, ads=4, tags=2, proposals=2, log=lambda message: None)
+        endpoints = select_endpoints(["ads_list"])
+        with mock.patch("benchmarks.runner.cache.clear") as clear:
+            run_in_process(endpoints, iterations=3, warmup=1)
+        self.assertEqual(clear.call_count, 3)
+        with mock.patch("benchmarks.runner.cache.clear") as clear:
+            call_command(
+                "run_benchmarks", "--endpoints", "ads_list", "--iterations", "2", "--warmup", "0",
+                "--keep-cache", "--output", os.devnull, stdout=StringIO(),
+            )
+        clear.assert_not_called()
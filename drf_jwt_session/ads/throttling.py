@@ -0,0 +1,116 @@
+"""
+Throttling по скользящему окну со счётчиками (sliding window counter).
+
+DRF-овский SimpleRateThrottle хранит в кеше список меток времени всех
+запросов за окно и на каждый запрос перезаписывает его целиком. Здесь на
+ключ — два целых счётчика: текущего и предыдущего окна. Оценка
+
+    предыдущее * (1 - доля прошедшего окна) + текущее
+
+сравнивается с лимитом. Текущий счётчик увеличивается атомарным incr, так
+что параллельные воркеры не теряют запросы.
+
+Счётчики живут в кеше THROTTLE_CACHE_ALIAS ("throttle"). С REDIS_URL это
+Django RedisCache (INCR атомарен и общий для всех процессов), без него —
+LocMemCache: лимит тогда на процесс, поэтому так можно только с DEBUG
+(разработка, тесты) — иначе проект не стартует (check_throttle_settings).
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, UserRateThrottle
+
+from .cache import is_shared_cache
+
+
+def check_throttle_settings():
+    """При старте: throttling без общего кеша вне DEBUG — ошибка конфигурации."""
+    alias = getattr(settings, "THROTTLE_CACHE_ALIAS", "default")
+    if api_settings.DEFAULT_THROTTLE_CLASSES and not settings.DEBUG and not is_shared_cache(alias):
+        raise ImproperlyConfigured(
+            f"Кеш {alias!r} для throttling в памяти процесса: лимиты были бы на воркер. "
+            "Задайте REDIS_URL."
+        )
+
+
+class SlidingWindowMixin:
+    timer = time.time
+
+    @property
+    def store(self):
+        return caches[getattr(settings, "THROTTLE_CACHE_ALIAS", "default")]
+
+    def _incr(self, key):
+        # add не трогает существующий ключ; срок — два окна, пока счётчик нужен как «предыдущий»
+        for _attempt in range(2):
+            self.store.add(key, 0, self.duration * 2)
+            try:
+                return self.store.incr(key)
+            except ValueError:  # ключ истёк между add и incr
+                continue
+        return 1
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key, previous_key = f"{self.key}:{window}", f"{self.key}:{window - 1}"
+        self.previous = self.store.get(previous_key, 0)
+        self.current = self._incr(current_key)
+        self.elapsed = (self.now % self.duration) / self.duration
+        if self.previous * (1 - self.elapsed) + self.current <= self.num_requests:
+            return True
+        # отклонённый запрос в лимит не засчитываем, как и DRF
+        try:
+            self.store.decr(current_key)
+        except ValueError:
+            pass
+        self.current -= 1
+        return self.throttle_failure()
+
+    def wait(self):
+        """Секунд до момента, когда оценка опустится ниже лимита."""
+        if self.current >= self.num_requests:
+            # только в следующем окне, и там ещё ждать, пока «остынет» текущее
+            free = 1 - (self.num_requests - 1) / self.current if self.current else 0
+            return (1 - self.elapsed + free) * self.duration
+        # ждём, пока вес предыдущего окна уменьшится
+        needed = 1 - (self.num_requests - 1 - self.current) / self.previous
+        return max(needed - self.elapsed, 0) * self.duration
+
+
+class SharedUserRateThrottle(SlidingWindowMixin, UserRateThrottle):
+    pass
+
+
+class SharedAnonRateThrottle(SlidingWindowMixin, AnonRateThrottle):
+    pass
+
+
+class SharedScopedRateThrottle(SlidingWindowMixin, ScopedRateThrottle):
+    """
+    Отдельный лимит для view с throttle_scope или для действий ViewSet
+    из throttle_scopes = {"create": "ads_write", ...}. Остальные запросы
+    ограничивает только общий лимит пользователя.
+    """
+
+    def allow_request(self, request, view):
+        scopes = getattr(view, "throttle_scopes", None)
+        if scopes is not None:
+            self.scope = scopes.get(getattr(view, "action", None))
+        else:
+            self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope:
+            return True
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)  # SlidingWindowMixin, не ScopedRateThrottle
@@ -0,0 +1,136 @@
+"""
+Проверка blacklist refresh-токенов без запроса к БД в обычном случае.
+
+simplejwt на каждый /api/token/refresh/ проверяет BlacklistedToken запросом
+EXISTS. Здесь вместо него:
+
+1. фильтр Блума в памяти процесса по jti отозванных, ещё не истёкших
+   токенов. «Возможно есть» (редко, ~ TOKEN_BLACKLIST_BLOOM_ERROR_RATE
+   ложных срабатываний) — обычная проверка в БД;
+2. ключ tokens:blacklisted:<jti> в общем кеше: токен, отозванный в другом
+   процессе, которого ещё нет в нашем фильтре. Ключ ставится после коммита
+   записи в blacklist (сигнал post_save) и живёт до истечения токена.
+
+Раз в TOKEN_BLACKLIST_SYNC_SECONDS процесс дочитывает в фильтр записи
+BlacklistedToken с id больше последнего виденного (один запрос) — на случай,
+если ключ вытеснен из кеша.
+
+Без общего кеша (LocMemCache при нескольких воркерах) токен, отозванный
+в другом процессе, был бы виден нам только после дочитывания — окно для
+повторного refresh. Поэтому тогда проверка всегда идёт в БД, как у simplejwt.
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .cache import is_shared_cache
+
+BLACKLISTED_KEY = "tokens:blacklisted:{jti}"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # двойное хеширование: k позиций из двух 64-битных половин blake2b
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BlacklistFilter:
+    """Фильтр Блума по jti из blacklist с периодическим дочитыванием."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+            self._last_id = 0
+            self._synced_at = 0.0
+
+    def _rebuild(self):
+        # с нуля: при старте и при переполнении — истёкшие токены в фильтр не нужны
+        self._last_id = BlacklistedToken.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        jtis = list(
+            BlacklistedToken.objects.filter(id__lte=self._last_id, token__expires_at__gt=aware_utcnow())
+            .values_list("token__jti", flat=True)
+        )
+        capacity = max(_setting("TOKEN_BLACKLIST_BLOOM_CAPACITY", 100_000), len(jtis) * 2)
+        self._bloom = BloomFilter(capacity, _setting("TOKEN_BLACKLIST_BLOOM_ERROR_RATE", 0.001))
+        for jti in jtis:
+            self._bloom.add(jti)
+
+    def _catch_up(self):
+        rows = BlacklistedToken.objects.filter(id__gt=self._last_id).order_by("id").values_list("id", "token__jti")
+        for row_id, jti in rows:
+            self._bloom.add(jti)
+            self._last_id = row_id
+
+    def _sync(self):
+        if self._bloom is None or self._bloom.count > self._bloom.capacity:
+            self._rebuild()
+        elif time.monotonic() - self._synced_at > _setting("TOKEN_BLACKLIST_SYNC_SECONDS", 60):
+            self._catch_up()
+        else:
+            return
+        self._synced_at = time.monotonic()
+
+    def is_blacklisted(self, jti):
+        """True/False — точный ответ без БД, None — надо спросить БД."""
+        if not is_shared_cache():
+            return None
+        with self._lock:
+            self._sync()
+            if jti in self._bloom:
+                return None
+        return True if cache.get(BLACKLISTED_KEY.format(jti=jti)) else False
+
+    def added(self, jti, expires_at):
+        """Запись в blacklist закоммичена: в свой фильтр и в общий кеш."""
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        timeout = (expires_at - aware_utcnow()).total_seconds()
+        if timeout > 0:
+            cache.set(BLACKLISTED_KEY.format(jti=jti), True, timeout)
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class FastBlacklistRefreshToken(RefreshToken):
+    """RefreshToken, который идёт в БД за blacklist только при подозрении."""
+
+    def check_blacklist(self):
+        if blacklist_filter.is_blacklisted(self.payload[api_settings.JTI_CLAIM]) is not False:
+            super().check_blacklist()  # подтверждаем в БД, ошибка — та же, что у simplejwt
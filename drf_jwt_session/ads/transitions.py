@@ -0,0 +1,86 @@
+"""
+Смена статуса предложений без гонок: PATCH /proposals/{id}/update-status/
+и POST /proposals/bulk-status/.
+
+Раньше view читал предложение и сохранял строку целиком — два параллельных
+PATCH молча перезаписывали друг друга. Теперь в одной транзакции:
+
+1. SELECT … FOR UPDATE ожидающих предложений получателя, а при принятии —
+   и всех ожидающих предложений с участием тех же объявлений (конкуренты);
+2. один UPDATE … SET status = CASE … WHERE id IN (…) AND status = 'pending':
+   принятые — accepted, конкуренты и отклоняемые — rejected;
+3. счётчики (ads/counters.py), outbox, кеш и циклы (ads/cycles.py) — пакетом:
+   queryset.update() сигналов не шлёт.
+
+Из двух принимаемых предложений с общим объявлением принимается раннее,
+второе отклоняется как конкурент. Предложение, которое уже не ожидает,
+в результат не попадает — view отвечает 409.
+"""
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .counters import proposals_changed
+from .cycles import drop_cycles
+from .models import ExchangeProposal
+from .outbox import proposal_payload, record_events
+
+
+class ProposalConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Предложение уже принято или отклонено."
+    default_code = "proposal_conflict"
+
+
+def _locked(user, ids, new_status):
+    requested = ExchangeProposal.objects.filter(pk__in=ids, ad_receiver__user=user, status="pending")
+    lookup = Q(pk__in=requested.values("pk"))
+    if new_status == "accepted":
+        for field in ("ad_sender_id", "ad_receiver_id"):
+            for side in ("ad_sender_id", "ad_receiver_id"):
+                lookup |= Q(**{f"{field}__in": requested.values(side)})
+    # строки проверяются заново после ожидания блокировки: чужой коммит
+    # успел сменить статус — строки просто нет в выборке
+    return list(
+        ExchangeProposal.objects.filter(lookup, status="pending")
+        .annotate(receiver_user_id=F("ad_receiver__user_id"))
+        .select_for_update(of=("self",))
+        .order_by("pk")
+    )
+
+
+def change_status(user, ids, new_status):
+    """
+    Принять или отклонить предложения ids, входящие пользователю user.
+    Возвращает изменённые предложения с новым статусом, включая конкурентов.
+    """
+    ids = set(ids)
+    with transaction.atomic():
+        rows = _locked(user, ids, new_status)
+        # конкурент может оказаться и в ids, но входящим не этому пользователю
+        own = {p.pk for p in rows if p.pk in ids and p.receiver_user_id == user.pk}
+        if new_status == "accepted":
+            accepted, taken = set(), set()
+            for proposal in rows:
+                ads = {proposal.ad_sender_id, proposal.ad_receiver_id}
+                if proposal.pk in own and not ads & taken:
+                    accepted.add(proposal.pk)
+                    taken |= ads
+            changed = [p for p in rows if p.pk in accepted or {p.ad_sender_id, p.ad_receiver_id} & taken]
+            value = Case(When(pk__in=accepted, then=Value("accepted")), default=Value("rejected"))
+        else:
+            accepted = set()
+            changed = [p for p in rows if p.pk in own]
+            value = Value("rejected")
+        if not changed:
+            return []
+
+        ExchangeProposal.objects.filter(pk__in=[p.pk for p in changed], status="pending").update(status=value)
+        for proposal in changed:
+            proposal.status = proposal._loaded_status = "accepted" if proposal.pk in accepted else "rejected"
+        proposals_changed([(proposal, "pending", proposal.status) for proposal in changed])
+        record_events("proposal.updated", [proposal_payload(proposal) for proposal in changed])
+        drop_cycles(proposal.pk for proposal in changed)
+    return changed
@@ -1,10 +1,20 @@
 from django.urls import path
 
 from .api_views import (
+    ProposalBulkStatusView,
     ProposalCreateView,
     ProposalsFromMeListView,
     ProposalStatusUpdateView,
+    ProposalSummaryView,
     ProposalsToMeListView,
+    TradeCycleListView,
+)
+from .async_views import (
+    AsyncAdDetailView,
+    AsyncAdListView,
+    AsyncAdRecentView,
+    AsyncProposalsFromMeView,
+    AsyncProposalsToMeView,
 )
 from .views import (
     create_ad,
@@ -38,6 +48,15 @@ urlpatterns = [
     path("proposals/to-me/", ProposalsToMeListView.as_view(), name="proposals-to-me"),
     path("proposals/from-me/", ProposalsFromMeListView.as_view(), name="proposals-from-me"),
     path("proposals/create/", ProposalCreateView.as_view(), name="proposals-create"),
+    path("proposals/summary/", ProposalSummaryView.as_view(), name="proposals-summary"),
+    path("proposals/cycles/", TradeCycleListView.as_view(), name="proposals-cycles"),
+    path("proposals/bulk-status/", ProposalBulkStatusView.as_view(), name="proposals-bulk-status"),
+    # async-двойники читающих эндпоинтов (ASGI)
+    path("async/ads/", AsyncAdListView.as_view(), name="async-ad-list"),
+    path("async/ads/recent/", AsyncAdRecentView.as_view(), name="async-ad-recent"),
+    path("async/ads/<int:pk>/", AsyncAdDetailView.as_view(), name="async-ad-detail"),
+    path("async/proposals/to-me/", AsyncProposalsToMeView.as_view(), name="async-proposals-to-me"),
+    path("async/proposals/from-me/", AsyncProposalsFromMeView.as_view(), name="async-proposals-from-me"),
     path(
         "proposals/<int:pk>/update-status/",
         ProposalStatusUpdateView.as_view(),
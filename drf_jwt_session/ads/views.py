@@ -1,17 +1,19 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import Q
 from django.shortcuts import get_object_or_404, redirect, render
 
 from .forms import AdForm
 from .models import Ad, ExchangeProposal
+from .search import SEARCH_RANK, search_ads_queryset
+from .budgets import query_budget
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 @login_required
+@query_budget(queries=5)  # сессия, пользователь, COUNT, страница
 def index(request):
-    ads = Ad.objects.all().order_by("-created_at")
+    ads = Ad.objects.select_related("user", "category").defer("search_vector").order_by("-created_at")
     paginator = Paginator(ads, 3)
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
@@ -78,15 +80,16 @@ def delete_ad(request, pk):
 
 
 @login_required
+@query_budget(queries=5)
 def search_ads(request):
     query = request.GET.get("q", "")
     category = request.GET.get("category", "")
     condition = request.GET.get("condition", "")
 
-    ads = Ad.objects.all()
+    ads = Ad.objects.select_related("user", "category").defer("search_vector")
 
     if query:
-        ads = ads.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        ads = search_ads_queryset(ads, query)
 
     if category:
         ads = ads.filter(category__iexact=category)
@@ -94,7 +97,10 @@ def search_ads(request):
     if condition:
         ads = ads.filter(condition__iexact=condition)
 
-    ads = ads.order_by("-created_at")
+    if query:
+        ads = ads.order_by(f"-{SEARCH_RANK}", "-created_at")
+    else:
+        ads = ads.order_by("-created_at")
 
     paginator = Paginator(ads, 3)
     page_number = request.GET.get("page")
@@ -110,8 +116,11 @@ def search_ads(request):
 
 
 @login_required
+@query_budget(queries=5)
 def proposals_to_me_view(request):
-    proposals = ExchangeProposal.objects.filter(ad_receiver__user=request.user)
+    proposals = ExchangeProposal.objects.filter(ad_receiver__user=request.user).select_related(
+        "ad_sender__user", "ad_sender__category", "ad_receiver__user", "ad_receiver__category"
+    )
     status = request.GET.get("status")
     sender_id = request.GET.get("sender")
 
@@ -141,8 +150,11 @@ def proposals_to_me_view(request):
 
 
 @login_required
+@query_budget(queries=5)
 def proposals_from_me_view(request):
-    proposals = ExchangeProposal.objects.filter(ad_sender__user=request.user)
+    proposals = ExchangeProposal.objects.filter(ad_sender__user=request.user).select_related(
+        "ad_sender__user", "ad_sender__category", "ad_receiver__user", "ad_receiver__category"
+    )
     status = request.GET.get("status")
     receiver_id = request.GET.get("receiver")
 
@@ -184,11 +196,14 @@ def proposal_create(request):
 
         ad_sender = get_object_or_404(Ad, pk=ad_sender_id, user=request.user)
 
-        proposal = ExchangeProposal.objects.create(
-            ad_sender=ad_sender, ad_receiver=ad_receiver, comment=comment, status="pending"
+        proposal, created = ExchangeProposal.objects.get_or_create_pending(
+            ad_sender.pk, ad_receiver.pk, comment
         )
 
-        messages.success(request, "Предложение обмена успешно создано.")
+        if created:
+            messages.success(request, "Предложение обмена успешно создано.")
+        else:
+            messages.info(request, "Такое предложение уже отправлено и ждёт ответа.")
         return redirect("proposals-from-me-view")
 
     return render(
@@ -0,0 +1,197 @@
+"""
+Рассылка событий из outbox (ads/outbox.py) по вебхукам.
+
+Один цикл dispatch_once:
+
+1. fan_out — берёт пачку неразосланных OutboxEvent (SELECT … FOR UPDATE
+   SKIP LOCKED, так что диспетчеров может быть несколько) и создаёт
+   WebhookDelivery для каждого подходящего активного WebhookEndpoint;
+2. claim_deliveries — забирает доставки, срок которых подошёл, и сдвигает
+   им next_attempt_at на время аренды: если процесс упадёт, их подберёт
+   следующий цикл;
+3. deliver — шлёт их пачками (несколько событий в одном POST) из пула
+   потоков, не больше endpoint.max_concurrency запросов на endpoint
+   одновременно. HTTP идёт вне транзакций, в БД пишет только основной поток.
+
+Лимит max_concurrency — на один диспетчер: аренды на endpoint нет, и два
+процесса вместе дадут до 2×max_concurrency запросов. Порядок доставки тоже
+не гарантирован: пока упавшая пачка ждёт backoff, следующие циклы шлют
+более новые события того же endpoint'а. Получателю нужны идемпотентность
+по id события и сортировка по created_at.
+
+Ошибка (не 2xx, таймаут) — повтор с экспоненциальной задержкой,
+после WEBHOOK_MAX_ATTEMPTS попыток доставка помечается failed.
+"""
+
+import hashlib
+import hmac
+import json
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent, WebhookDelivery, WebhookEndpoint
+
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 3600
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой: 10 с, 20 с, 40 с … до часа, ±10%."""
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.9, 1.1))
+
+
+def fan_out(batch_size):
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.filter(dispatched_at__isnull=True)
+            .order_by("id")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+        now = timezone.now()
+        endpoints = list(WebhookEndpoint.objects.filter(is_active=True))
+        WebhookDelivery.objects.bulk_create(
+            [
+                WebhookDelivery(event=event, endpoint=endpoint, next_attempt_at=now)
+                for event in events
+                for endpoint in endpoints
+                if endpoint.accepts(event.event_type)
+            ],
+            ignore_conflicts=True,
+        )
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_at=now)
+    return len(events)
+
+
+def claim_deliveries(limit):
+    with transaction.atomic():
+        now = timezone.now()
+        deliveries = list(
+            WebhookDelivery.objects.filter(status="pending", next_attempt_at__lte=now)
+            .select_related("event", "endpoint")
+            .order_by("next_attempt_at", "id")
+            .select_for_update(skip_locked=True, of=("self",))[:limit]
+        )
+        lease = now + timedelta(seconds=_setting("WEBHOOK_LEASE_SECONDS", 60))
+        WebhookDelivery.objects.filter(pk__in=[d.pk for d in deliveries]).update(
+            next_attempt_at=lease
+        )
+    return deliveries
+
+
+def _sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _post(endpoint, deliveries):
+    """Один POST с пачкой событий. Возвращает None или текст ошибки."""
+    body = json.dumps(
+        {
+            "events": [
+                {
+                    "id": d.event_id,
+                    "type": d.event.event_type,
+                    "created_at": d.event.created_at,
+                    "payload": d.event.payload,
+                }
+                for d in deliveries
+            ]
+        },
+        cls=DjangoJSONEncoder,
+        ensure_ascii=False,
+    ).encode()
+    request = Request(endpoint.url, data=body, method="POST")
+    request.add_header("Content-Type", "application/json")
+    if endpoint.secret:
+        request.add_header("X-Webhook-Signature", _sign(endpoint.secret, body))
+    try:
+        with urlopen(request, timeout=_setting("WEBHOOK_TIMEOUT", 5)) as response:
+            response.read()
+    except HTTPError as exc:
+        return f"HTTP {exc.code}"
+    except (URLError, OSError) as exc:
+        return str(getattr(exc, "reason", exc))
+    return None
+
+
+def _lanes(deliveries, batch_size):
+    """
+    Пачки каждого endpoint'а раскладываются по max_concurrency «полосам»;
+    полоса шлёт свои пачки последовательно, так что ни один поток не ждёт
+    семафора. При max_concurrency=1 пачки одного цикла этого диспетчера идут
+    по порядку; между циклами, повторами и диспетчерами порядка нет.
+    """
+    by_endpoint = defaultdict(list)
+    for delivery in deliveries:
+        by_endpoint[delivery.endpoint_id].append(delivery)
+    for group in by_endpoint.values():
+        endpoint = group[0].endpoint
+        batches = [group[i : i + batch_size] for i in range(0, len(group), batch_size)]
+        lanes = max(endpoint.max_concurrency, 1)
+        for lane in range(min(lanes, len(batches))):
+            yield endpoint, batches[lane::lanes]
+
+
+def _send_lane(endpoint, batches):
+    results = []
+    for index, batch in enumerate(batches):
+        error = _post(endpoint, batch)
+        results.append((batch, error, True))
+        if error is not None:
+            # endpoint лежит — остальное не шлём, попробуем вместе со следующей попыткой
+            results.extend((rest, error, False) for rest in batches[index + 1 :])
+            break
+    return results
+
+
+def deliver(deliveries):
+    """Шлёт доставки и записывает результат. Возвращает (доставлено, ошибок)."""
+    lanes = list(_lanes(deliveries, _setting("WEBHOOK_EVENTS_PER_REQUEST", 50)))
+    with ThreadPoolExecutor(max_workers=_setting("WEBHOOK_WORKERS", 8)) as pool:
+        results = [item for lane in pool.map(lambda args: _send_lane(*args), lanes) for item in lane]
+
+    now = timezone.now()
+    max_attempts = _setting("WEBHOOK_MAX_ATTEMPTS", 8)
+    changed, delivered, failed = [], 0, 0
+    for batch, error, attempted in results:
+        for delivery in batch:
+            if attempted:
+                delivery.attempts += 1
+            if error is None:
+                delivery.status, delivery.delivered_at, delivery.last_error = "delivered", now, ""
+                delivered += 1
+            else:
+                delivery.last_error = error
+                if delivery.attempts >= max_attempts:
+                    delivery.status = "failed"
+                else:
+                    delivery.next_attempt_at = now + backoff(max(delivery.attempts, 1))
+                failed += 1
+            changed.append(delivery)
+    WebhookDelivery.objects.bulk_update(
+        changed, ["status", "attempts", "next_attempt_at", "last_error", "delivered_at"]
+    )
+    return delivered, failed
+
+
+def dispatch_once(batch_size=None):
+    batch_size = batch_size or _setting("WEBHOOK_BATCH_SIZE", 500)
+    fanned_out = fan_out(batch_size)
+    deliveries = claim_deliveries(batch_size)
+    delivered, failed = deliver(deliveries) if deliveries else (0, 0)
+    return {"events": fanned_out, "delivered": delivered, "failed": failed}
@@ -0,0 +1,92 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.runner import (
+    build_report,
+    compare_with_baseline,
+    run_http,
+    run_in_process,
+    select_endpoints,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет p50/p95/p99, RPS, число запросов к БД и peak RSS ключевых эндпоинтов. "
+        "Без --url — в процессе через test Client, с --url — HTTP-нагрузка на запущенный сервер."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="базовый URL сервера, например http://127.0.0.1:8000")
+        parser.add_argument("--endpoints", nargs="*", help="имена эндпоинтов (по умолчанию все)")
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--concurrency", type=int, default=10, help="потоков в HTTP-режиме")
+        parser.add_argument("--server-pid", type=int, help="pid сервера для peak RSS (HTTP-режим)")
+        parser.add_argument(
+            "--keep-cache",
+            action="store_true",
+            help="не сбрасывать кеш перед каждым запросом (мерить попадания в кеш ответов)",
+        )
+        parser.add_argument("--output", default="bench_report.json")
+        parser.add_argument("--baseline", help="JSON-отчёт прошлого прогона для сравнения")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=0.10,
+            help="допустимый рост метрик относительно baseline (0.10 = 10%%)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            endpoints = select_endpoints(options["endpoints"])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        try:
+            if options["url"]:
+                mode = "http"
+                results = run_http(
+                    options["url"],
+                    endpoints,
+                    options["iterations"],
+                    concurrency=options["concurrency"],
+                    warmup=options["warmup"],
+                    server_pid=options["server_pid"],
+                )
+            else:
+                mode = "in_process"
+                results = run_in_process(
+                    endpoints,
+                    options["iterations"],
+                    warmup=options["warmup"],
+                    clear_cache=not options["keep_cache"],
+                )
+        except RuntimeError as exc:
+            raise CommandError(exc)
+
+        report_options = {
+            key: options[key]
+            for key in ("url", "iterations", "warmup", "concurrency", "keep_cache")
+        }
+        report = build_report(mode, results, report_options)
+
+        regressions = []
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare_with_baseline(report, baseline, options["max_regression"])
+
+        with open(options["output"], "w") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+        for name, metrics in results.items():
+            self.stdout.write(
+                f"{name:<16} p50={metrics['p50_ms']}ms p95={metrics['p95_ms']}ms "
+                f"p99={metrics['p99_ms']}ms rps={metrics['rps']} queries={metrics.get('queries', '-')}"
+            )
+        self.stdout.write(f"Отчёт: {options['output']}")
+
+        if regressions:
+            raise CommandError("Регрессия относительно baseline:\n" + "\n".join(regressions))
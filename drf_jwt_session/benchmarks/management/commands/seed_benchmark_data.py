@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.seeding import flush_benchmark_data, seed, validate_counts
+
+
+class Command(BaseCommand):
+    help = "Наполняет БД пользователями, тегами, объявлениями и предложениями для бенчмарков"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--ads", type=int, default=10_000)
+        parser.add_argument("--tags", type=int, default=200)
+        parser.add_argument("--proposals", type=int, default=20_000)
+        parser.add_argument("--tags-per-ad", type=int, default=3)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=42, help="seed генератора — данные воспроизводимы")
+        parser.add_argument("--flush", action="store_true", help="удалить прошлые bench-данные")
+
+    def handle(self, *args, **options):
+        try:
+            validate_counts(
+                options["users"], options["ads"], options["tags"], options["proposals"], options["tags_per_ad"]
+            )
+        except ValueError as exc:
+            raise CommandError(exc)
+        if options["flush"]:
+            flush_benchmark_data()
+        seed(
+            users=options["users"],
+            ads=options["ads"],
+            tags=options["tags"],
+            proposals=options["proposals"],
+            tags_per_ad=options["tags_per_ad"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS("Готово"))
@@ -0,0 +1,252 @@
+import json
+import platform
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urljoin
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from ads.middleware import QueryStats
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .seeding import BENCH_PASSWORD, BENCH_USER_PREFIX
+
+# name, метод, путь, аутентификация: "jwt" | "session" | None
+ENDPOINTS = [
+    ("ads_list", "GET", "/ads/", "jwt"),
+    ("ads_list_async", "GET", "/async/ads/", "jwt"),
+    ("proposals_to_me", "GET", "/proposals/to-me/", "jwt"),
+    ("proposals_to_me_async", "GET", "/async/proposals/to-me/", "jwt"),
+    ("token_obtain", "POST", "/api/token/", None),
+    ("index", "GET", "/", "session"),
+    ("search_ads", "GET", "/search/?" + urlencode({"q": "телефон"}), "session"),
+]
+
+# метрики, по которым сравниваем с baseline (больше — хуже)
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries")
+
+
+def select_endpoints(names=None):
+    if not names:
+        return list(ENDPOINTS)
+    selected = [endpoint for endpoint in ENDPOINTS if endpoint[0] in names]
+    unknown = set(names) - {endpoint[0] for endpoint in selected}
+    if unknown:
+        raise ValueError(f"Неизвестные эндпоинты: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def _percentile(sorted_values, percent):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[percent - 1]
+
+
+def _peak_rss_kb(pid=None):
+    if pid is None:
+        # на Linux ru_maxrss в килобайтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+
+def summarize(latencies, wall_time, queries=None, errors=0):
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall_time, 1) if wall_time else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+    if queries:
+        summary["queries"] = max(queries)
+    return summary
+
+
+def _bench_user():
+    user = User.objects.filter(username__startswith=BENCH_USER_PREFIX).order_by("id").first()
+    if user is None:
+        raise RuntimeError("Нет данных для бенчмарка — сначала seed_benchmark_data")
+    return user
+
+
+def run_in_process(endpoints, iterations, warmup=5, clear_cache=True):
+    """
+    Гоняет эндпоинты через django.test.Client в этом же процессе: видно
+    чистую стоимость view + ORM без сети. Throttling на время прогона
+    отключён — иначе 1000/day закончится на первом же эндпоинте. Кеш по
+    умолчанию сбрасывается перед каждым запросом: после прогрева иначе
+    мерились бы попадания в кеш ответов, а не view.
+    """
+    user = _bench_user()
+    client = Client(SERVER_NAME="localhost")
+    client.force_login(user)
+    jwt_headers = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+    credentials = {"username": user.username, "password": BENCH_PASSWORD}
+
+    def call(method, path, auth):
+        if method == "POST":
+            return client.post(path, credentials)
+        return client.get(path, **(jwt_headers if auth == "jwt" else {}))
+
+    results = {}
+    with mock.patch.object(APIView, "throttle_classes", ()):
+        for name, method, path, auth in endpoints:
+            for _ in range(warmup):
+                call(method, path, auth)
+
+            latencies, queries, errors = [], [], 0
+            started = time.perf_counter()
+            for _ in range(iterations):
+                if clear_cache:
+                    cache.clear()
+                stats = QueryStats()
+                with connections["default"].execute_wrapper(stats):
+                    t0 = time.perf_counter()
+                    response = call(method, path, auth)
+                    latencies.append(time.perf_counter() - t0)
+                queries.append(stats.queries)
+                if response.status_code >= 400:
+                    errors += 1
+            results[name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+            results[name]["peak_rss_kb"] = _peak_rss_kb()
+    return results
+
+
+class _HttpSession:
+    """Клиент на urllib: JWT для API, cookie-сессия для HTML-страниц."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+        self.token = None
+
+    def request(self, method, path, data=None, headers=None):
+        body = urlencode(data).encode() if data is not None else None
+        request = Request(urljoin(self.base_url, path), data=body, method=method)
+        for key, value in (headers or {}).items():
+            request.add_header(key, value)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except HTTPError as exc:
+            return exc.code
+
+    def login(self):
+        credentials = {"username": self.username, "password": BENCH_PASSWORD}
+        request = Request(urljoin(self.base_url, "/api/token/"), data=urlencode(credentials).encode())
+        with self.opener.open(request, timeout=30) as response:
+            self.token = json.loads(response.read())["access"]
+
+        self.request("GET", "/login/")
+        csrf = next(c.value for c in self.cookies if c.name == "csrftoken")
+        self.request(
+            "POST",
+            "/login/",
+            {**credentials, "csrfmiddlewaretoken": csrf},
+            {"Referer": urljoin(self.base_url, "/login/")},
+        )
+
+    def call(self, method, path, auth):
+        if method == "POST":
+            return self.request(
+                method, path, {"username": self.username, "password": BENCH_PASSWORD}
+            )
+        headers = {"Authorization": f"Bearer {self.token}"} if auth == "jwt" else {}
+        return self.request(method, path, headers=headers)
+
+
+def run_http(base_url, endpoints, iterations, concurrency=10, warmup=5, server_pid=None):
+    """
+    Нагрузка по HTTP на запущенный сервер (runserver, gunicorn, uvicorn).
+    Каждый поток работает от своего bench-пользователя, чтобы квота
+    UserRateThrottle делилась на всех. Количество запросов к БД снаружи
+    не видно; peak RSS — сервера, если передан его pid.
+    """
+    usernames = list(
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX)
+        .order_by("id")
+        .values_list("username", flat=True)[:concurrency]
+    )
+    if not usernames:
+        raise RuntimeError("Нет данных для бенчмарка — сначала seed_benchmark_data")
+    sessions = [_HttpSession(base_url, username) for username in usernames]
+    for session in sessions:
+        session.login()
+
+    results = {}
+    for name, method, path, auth in endpoints:
+        for _ in range(warmup):
+            sessions[0].call(method, path, auth)
+
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def worker(index):
+            session = sessions[index % len(sessions)]
+            t0 = time.perf_counter()
+            status = session.call(method, path, auth)
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(iterations)))
+        results[name] = summarize(latencies, time.perf_counter() - started, errors=len(errors))
+        results[name]["peak_rss_kb"] = _peak_rss_kb(server_pid) if server_pid else None
+    return results
+
+
+def build_report(mode, results, options):
+    return {
+        "meta": {
+            "mode": mode,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "options": options,
+        },
+        "endpoints": results,
+    }
+
+
+def compare_with_baseline(report, baseline, max_regression):
+    """
+    Сравнивает отчёт с сохранённым baseline. Возвращает список строк
+    о регрессиях больше max_regression (0.1 = +10%).
+    """
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            current.setdefault("vs_baseline", {})[metric] = round(change, 3)
+            if change > max_regression:
+                regressions.append(f"{name}.{metric}: {old} -> {new} (+{change:.0%})")
+    return regressions
@@ -0,0 +1,121 @@
+import random
+
+from ads.counters import reconcile_in_batches
+from ads.matches import rebuild_matches
+from ads.models import Ad, Category, ExchangeProposal, Tag
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+BENCH_USER_PREFIX = "bench_user_"
+BENCH_PASSWORD = "bench-password"
+
+WORDS = [
+    "телефон", "ноутбук", "велосипед", "книга", "диван", "куртка", "камера", "гитара",
+    "phone", "laptop", "bicycle", "book", "sofa", "jacket", "camera", "guitar",
+    "новый", "б/у", "отличный", "редкий", "почти", "обмен", "срочно", "винтаж",
+]
+CATEGORIES = ["Электроника", "Книги", "Спорт", "Одежда", "Дом", "Музыка", "Разное"]
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def flush_benchmark_data():
+    # объявления и предложения удалятся каскадом вместе с пользователями
+    User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
+
+
+def validate_counts(users, ads, tags, proposals, tags_per_ad=3):
+    """Ошибка в параметрах — ValueError до того, как что-то записано в БД."""
+    counts = {"users": users, "ads": ads, "tags": tags, "proposals": proposals, "tags_per_ad": tags_per_ad}
+    negative = [name for name, value in counts.items() if value < 0]
+    if negative:
+        raise ValueError(f"Отрицательное количество: {', '.join(negative)}")
+    if ads and not users:
+        raise ValueError("Объявлениям нужен хотя бы один пользователь (--users)")
+    if proposals and (users < 2 or ads < 2):
+        # предложение — между объявлениями разных владельцев
+        raise ValueError("Для предложений нужно минимум 2 пользователя и 2 объявления")
+
+
+@transaction.atomic
+def seed(users, ads, tags, proposals, tags_per_ad=3, batch_size=2000, seed=42, log=print):
+    """
+    Наполняет БД данными для бенчмарков одними bulk_create, без сигналов
+    и поштучных save(). Пароль хешируется один раз на всех пользователей.
+    """
+    validate_counts(users, ads, tags, proposals, tags_per_ad)
+    rng = random.Random(seed)
+
+    password = make_password(BENCH_PASSWORD)
+    start = User.objects.filter(username__startswith=BENCH_USER_PREFIX).count()
+    user_objs = User.objects.bulk_create(
+        [
+            User(username=f"{BENCH_USER_PREFIX}{start + i}", password=password)
+            for i in range(users)
+        ],
+        batch_size=batch_size,
+    )
+    log(f"users: {len(user_objs)}")
+
+    for title in CATEGORIES:
+        Category.objects.get_or_create(title=title)
+    category_ids = list(Category.objects.values_list("id", flat=True))
+
+    Tag.objects.bulk_create(
+        [Tag(name=f"{rng.choice(WORDS)}-{i}") for i in range(tags)],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    tag_ids = list(Tag.objects.values_list("id", flat=True))
+    log(f"tags: {len(tag_ids)}")
+
+    ad_objs = []
+    for i in range(ads):
+        ad_objs.append(
+            Ad(
+                user=user_objs[i % len(user_objs)],
+                # (user, title) уникальны — номер в заголовке
+                title=f"{_sentence(rng, 3)} #{i}",
+                description=_sentence(rng, rng.randint(10, 60)),
+                category_id=rng.choice(category_ids),
+                condition=rng.choice(["new", "used"]),
+            )
+        )
+    ad_objs = Ad.objects.bulk_create(ad_objs, batch_size=batch_size)
+    log(f"ads: {len(ad_objs)}")
+
+    if tag_ids and tags_per_ad:
+        through = Ad.tags.through
+        links = [
+            through(ad_id=ad.id, tag_id=tag_id)
+            for ad in ad_objs
+            for tag_id in rng.sample(tag_ids, min(tags_per_ad, len(tag_ids)))
+        ]
+        through.objects.bulk_create(links, batch_size=batch_size)
+        log(f"ad tags: {len(links)}")
+        # m2m_changed при bulk_create не приходит — кандидатов на обмен строим целиком
+        log(f"ad matches: {rebuild_matches(batch_size)}")
+
+    proposal_objs = []
+    pending_pairs = set()  # ожидающее на пару может быть одно (unique_pending_proposal)
+    if proposals:
+        while len(proposal_objs) < proposals:
+            sender, receiver = rng.sample(ad_objs, 2)
+            if sender.user_id == receiver.user_id:
+                continue
+            status = rng.choices(["pending", "accepted", "rejected"], [6, 2, 2])[0]
+            if status == "pending":
+                if (sender.pk, receiver.pk) in pending_pairs:
+                    continue
+                pending_pairs.add((sender.pk, receiver.pk))
+            proposal_objs.append(ExchangeProposal(ad_sender=sender, ad_receiver=receiver, status=status))
+    ExchangeProposal.objects.bulk_create(proposal_objs, batch_size=batch_size)
+    log(f"proposals: {len(proposal_objs)}")
+
+    # bulk_create не шлёт сигналов — счётчики предложений пересчитываем пачками
+    reconcile_in_batches(
+        [ad.pk for ad in ad_objs], [user.pk for user in user_objs], batch_size=batch_size
+    )
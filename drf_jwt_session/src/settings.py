@@ -45,8 +45,10 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "ads",
     "accounts",
+    "benchmarks",
     "rest_framework",
     "django_filters",
     "drf_spectacular",
@@ -71,12 +73,15 @@ ACCOUNT_EMAIL_REQUIRED = True
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "ads.middleware.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # чтение с реплик, read-your-writes (ads/routers.py)
+    "ads.routers.ReplicaRoutingMiddleware",
 ]
 
 
@@ -85,7 +90,8 @@ REST_FRAMEWORK = {
     
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        # JWT с claims пользователя: без SELECT пользователя на запрос (ads/authentication.py)
+        'ads.authentication.ClaimsJWTAuthentication'
     ],
     # По желанию включаем права доступа
     'DEFAULT_PERMISSION_CLASSES': [
@@ -101,16 +107,71 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 
     # Ограничение запросов (Throttling)
+    # скользящее окно на счётчиках в общем кеше (ads/throttling.py)
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',      # Ограничение по пользователю
-        'rest_framework.throttling.AnonRateThrottle',      # Ограничение по анонимам
+        'ads.throttling.SharedUserRateThrottle',      # Ограничение по пользователю
+        'ads.throttling.SharedAnonRateThrottle',      # Ограничение по анонимам
+        'ads.throttling.SharedScopedRateThrottle',    # Отдельные лимиты на запись
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user': '1000/day',   # например, 1000 запросов в день для аутентифицированных
         'anon': '100/day',    # 100 запросов в день для анонимных пользователей
+        'ads_write': '120/min',         # создание/изменение/удаление объявлений, в т.ч. bulk
+        'proposals_create': '30/min',   # POST /proposals/create/
     },
 }
 
+# Счётчики throttling, поколения кеша ответов и справочников должны быть
+# общими для всех воркеров: с REDIS_URL — Redis (атомарный INCR), без него —
+# память процесса (разработка, тесты). Файловый/БД-кеш как общая замена не
+# годится: incr там — get+set, параллельные запросы теряются, а каждый запрос
+# ходил бы в БД. Поэтому без REDIS_URL и с DEBUG = False проект не стартует
+# (ads/throttling.py: check_throttle_settings).
+CACHES = {
+    'default': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}
+        if os.getenv('REDIS_URL')
+        else {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    ),
+    'throttle': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}
+        if os.getenv('REDIS_URL')
+        else {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle'}
+    ),
+}
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+# Бюджеты запросов к БД (ads/budgets.py): "off", "log" или "raise"
+QUERY_BUDGET_MODE = "log" if DEBUG else "off"
+
+# Кеш ответов GET /ads/ и GET /ads/{id}/ (ads/cache.py), секунды
+ADS_RESPONSE_CACHE_TIMEOUT = 300
+
+# Пакетные операции /ads/bulk/ (ads/bulk.py)
+ADS_BULK_MAX_ITEMS = 1000
+ADS_BULK_CHUNK_SIZE = 200  # одна транзакция на чанк
+
+# Потоковая выгрузка /ads/export/ (ads/export.py): строк на один fetch курсора
+ADS_EXPORT_CHUNK_SIZE = 2000
+
+# Кандидаты на обмен /ads/{id}/matches/ (ads/matches.py): сколько хранить на объявление
+ADS_MATCHES_PER_AD = 20
+ADS_MATCHES_WORKERS = 2  # потоки пересчёта после коммита, 0 — в запросе
+
+# Обмены по кругу /proposals/cycles/ (ads/cycles.py): сколько объявлений в цикле, 3 или 4
+PROPOSAL_CYCLE_MAX_LENGTH = 4
+
+# Превью и WebP/AVIF-варианты картинок (ads/images.py): потоков в пуле, 0 — синхронно
+ADS_IMAGE_WORKERS = 2
+
+# Вебхуки из outbox (ads/webhooks.py, manage.py dispatch_webhooks)
+WEBHOOK_BATCH_SIZE = 500  # событий/доставок за цикл
+WEBHOOK_EVENTS_PER_REQUEST = 50
+WEBHOOK_WORKERS = 8
+WEBHOOK_TIMEOUT = 5  # секунды на запрос
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_LEASE_SECONDS = 60
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Exchange Ads Platform Rest API",
     "DESCRIPTION": "REST API for an exchange ads platform. Built with Django and DRF.",
@@ -134,8 +195,21 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # username, is_staff, is_active в токене — см. ads/authentication.py
+    'TOKEN_OBTAIN_SERIALIZER': 'ads.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'ads.authentication.ClaimsTokenRefreshSerializer',
 }
 
+# сколько проверенных JWT держать в памяти процесса (LRU), 0 — не кешировать
+JWT_VERIFIED_TOKEN_CACHE_SIZE = 1024
+
+# фильтр Блума перед проверкой blacklist refresh-токенов (ads/token_blacklist.py)
+TOKEN_BLACKLIST_BLOOM_CAPACITY = 100_000
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = 0.001
+# как часто дочитывать новые записи blacklist из БД (ключ вытеснен из кеша);
+# без REDIS_URL фильтр не используется — проверка всегда в БД
+TOKEN_BLACKLIST_SYNC_SECONDS = 60
+
 ROOT_URLCONF = "src.urls"
 
 TEMPLATES = [
@@ -170,6 +244,26 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения (ads/routers.py): DB_REPLICA_HOSTS="10.0.0.2,10.0.0.3:5433".
+# Нужен общий кеш (REDIS_URL): в нём метка «только что писал» для всех воркеров.
+# Без DB_REPLICA_HOSTS чтение с реплик выключено; alias replica (та же база)
+# остаётся для тестов маршрутизации — соединение он открывает, только если им пользуются.
+_replica_hosts = [entry for entry in os.getenv("DB_REPLICA_HOSTS", "").split(",") if entry]
+for _number, _entry in enumerate(_replica_hosts or [""], 1):
+    _host, _, _port = _entry.partition(":")
+    DATABASES["replica" if _number == 1 else f"replica{_number}"] = {
+        **DATABASES["default"],
+        "HOST": _host or DATABASES["default"]["HOST"],
+        "PORT": _port or DATABASES["default"]["PORT"],
+        "OPTIONS": {"connect_timeout": 2},  # недоступная реплика не должна вешать запрос
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"] if _replica_hosts else []
+DATABASE_ROUTERS = ["ads.routers.ReplicaRouter"]
+REPLICA_PIN_SECONDS = 10  # после записи пользователь читает с primary
+REPLICA_MAX_LAG_SECONDS = 5  # реплика отстала сильнее — читаем с primary
+REPLICA_HEALTH_CHECK_SECONDS = 5  # как часто процесс перепроверяет реплику
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -7,12 +7,13 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
-from ads.api_views import AdViewSet, CategoryViewSet, PostViewSet
+from ads.api_views import AdViewSet, CategoryViewSet, PostViewSet, TagViewSet
 
 # Роутер
 router = DefaultRouter()
 router.register(r'ads', AdViewSet, basename='ad')
 router.register(r'categories', CategoryViewSet, basename='category')
+router.register(r'tags', TagViewSet, basename='tag')
 router.register(r'posts', PostViewSet, basename='post')
 
 urlpatterns = [